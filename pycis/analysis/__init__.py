@@ -10,3 +10,4 @@ except Exception as e:
 	print('WARNING: pycis.analysis.CISImage() is unavailable due to error: {0}'.format(e))
 
 
+from .calibrate import *
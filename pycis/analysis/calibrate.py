@@ -0,0 +1,177 @@
+import copy
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import xarray as xr
+from scipy.optimize import least_squares
+from pycis.analysis import wrap
+
+
+def fit_instrument(instrument, phase, params, contrast=None, contrast_weight=1, bounds=None, loss='soft_l1',
+                   f_scale=0.1, n_starts=1, seed=None, max_workers=None, processes=False, fpath=None, **kwargs):
+    """
+    Fit instrument parameters to a stack of demodulated calibration images
+
+    The calibration images are of monochromatic sources (lasers or narrow lamp lines) at known wavelengths. The
+    demodulated phase is modelled by the interferometer delay (see pycis.model.Instrument.get_delay()) and the
+    demodulated contrast, if given, by the instrument contrast (see pycis.model.Instrument.get_contrast()). The fit uses
+    scipy.optimize.least_squares(), by default with a robust loss that limits the influence of outliers such as hot
+    pixels and Fourier artefacts. The Jacobian is exact, from the analytic derivatives of the delays and contrasts (see
+    pycis.model.Instrument.get_delay() and pycis.model.Instrument.get_contrast()), evaluated in the same pass as the
+    model. Several starts can be run in parallel, to escape the local minima that come with a wrapped phase.
+
+    :param pycis.model.Instrument instrument: Initial guess, of one of the hand-coded instrument types (see
+        Instrument.get_type()). Not modified.
+    :param xr.DataArray phase: Demodulated phase(s) in radians, with dimensions 'x' and 'y' (sensor positions in m,
+        typically a subsampled region of interest), dimension (or scalar coordinate) 'wavelength' (in m) and, for the
+        multi-delay instrument types, dimension 'delay' indexing the delays in the order returned by
+        Instrument.get_delay(). NaN values are ignored.
+    :param list params: Names of the parameters to fit, labelled as in pycis.model.Instrument.get_jacobian() e.g.
+        ['thickness_1', 'cut_angle_1', 'orientation', ], where 'orientation' is the orientation of the first
+        interferometer component, all others turning with it. In addition, 'contrast_inst_<idx>' is the contrast_inst
+        of the retarder at index idx of the interferometer.
+    :param xr.DataArray contrast: Demodulated contrast(s), with the same dimensions as phase. Needed to fit
+        contrast_inst.
+    :param float contrast_weight: Weight of the contrast residuals relative to the phase residuals (in radians).
+    :param tuple bounds: (lower, upper) bounds on the parameters, each a float or a list ordered as params. Needed if
+        n_starts > 1.
+    :param str loss: Loss function, see scipy.optimize.least_squares(). 'linear' for ordinary least squares.
+    :param float f_scale: Soft margin between inlier and outlier residuals, in radians, see
+        scipy.optimize.least_squares().
+    :param int n_starts: Number of starts. The first is the initial guess and the rest are drawn uniformly within
+        bounds.
+    :param seed: Seed for the random starts, passed to np.random.default_rng().
+    :param int max_workers: Maximum number of starts run in parallel. Defaults to the number of processors.
+    :param bool processes: Run the starts on a pool of processes instead of a pool of threads.
+    :param str fpath: If given, path to a .yaml file to which the fitted instrument config is written, see
+        Instrument.write_config().
+    :param kwargs: Passed to scipy.optimize.least_squares().
+    :return: (instrument, results) tuple of the fitted instrument and the scipy.optimize.OptimizeResult of each start,
+        best (lowest cost) first.
+    """
+    assert instrument.type not in ['mueller', 'symbolic']
+    if contrast is None:
+        assert not any(param.startswith('contrast_inst') for param in params)
+    else:
+        assert contrast.dims == phase.dims
+
+    x0 = np.array([_get_param(instrument, param) for param in params], dtype=float)
+    starts = [x0, ]
+    if n_starts > 1:
+        assert bounds is not None
+        rng = np.random.default_rng(seed)
+        lower, upper = [np.broadcast_to(b, x0.shape) for b in bounds]
+        starts += list(rng.uniform(lower, upper, (n_starts - 1, x0.size, )))
+
+    kwargs = dict(bounds=(-np.inf, np.inf) if bounds is None else bounds, loss=loss, f_scale=f_scale, x_scale='jac',
+                  **kwargs)
+    args = (instrument, phase, contrast, params, contrast_weight, kwargs, )
+
+    if n_starts == 1:
+        results = [_fit(x0, *args), ]
+    else:
+        if max_workers is None:
+            max_workers = multiprocessing.cpu_count()
+        max_workers = min(max_workers, n_starts)
+        if processes:
+            # spawn rather than fork: forking after numba's parallel thread pool has started is not safe
+            executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+        with executor:
+            results = list(executor.map(_fit, starts, *[[arg] * n_starts for arg in args]))
+    results = sorted(results, key=lambda result: result.cost)
+
+    instrument_fit = copy.deepcopy(instrument)
+    values = [float(value) for value in results[0].x]
+    _set_params(instrument_fit.interferometer, instrument.interferometer, params, values)
+    instrument_fit.compile()
+    if fpath is not None:
+        instrument_fit.write_config(fpath)
+    return instrument_fit, results
+
+
+def _fit(x0, instrument, phase, contrast, params, contrast_weight, kwargs):
+    """
+    A single start of fit_instrument(), on its own copy of the instrument.
+    """
+    # compiled once per start: each evaluation of the model then only updates the fitted parameters, see _get_model()
+    instrument_fit = copy.deepcopy(instrument)
+    instrument_fit.compile()
+    data = [phase.values.ravel(), ]
+    if contrast is not None:
+        data.append(contrast.values.ravel() * contrast_weight)
+    data = np.concatenate(data)
+    valid = np.isfinite(data)
+    is_phase = (np.arange(data.size) < phase.size)[valid]
+    data = data[valid]
+
+    def get_model(values, jacobian=False):
+        model = _get_model(instrument_fit, instrument, params, values, phase, contrast is not None, jacobian)
+        if contrast is not None:
+            model[1] = model[1] * contrast_weight
+        shape = (-1, ) if not jacobian else (-1, len(params), )
+        return np.concatenate([m.values.reshape(shape) for m in model])[valid]
+
+    def fun(values):
+        residuals = data - get_model(values)
+        residuals[is_phase] = wrap(residuals[is_phase])
+        return residuals
+
+    def jac(values):
+        return - get_model(values, jacobian=True)
+
+    return least_squares(fun, x0, jac=jac, **kwargs)
+
+
+def _get_param(instrument, param):
+    if param == 'orientation':
+        return instrument.interferometer[0].orientation
+    name, idx = param.rsplit('_', 1)
+    return getattr(instrument.interferometer[int(idx)], name)
+
+
+def _set_params(interferometer, interferometer_base, params, values):
+    """
+    Set parameter values (scalars or xr.DataArray) on the components of interferometer, a copy of interferometer_base.
+    """
+    for param, value in zip(params, values):
+        if param == 'orientation':
+            rotation = value - interferometer_base[0].orientation
+            for component, component_base in zip(interferometer, interferometer_base):
+                if hasattr(component_base, 'orientation'):
+                    component.orientation = component_base.orientation + rotation
+        else:
+            name, idx = param.rsplit('_', 1)
+            setattr(interferometer[int(idx)], name, value)
+
+
+def _get_model(instrument, instrument_base, params, values, phase, contrast, jacobian=False):
+    """
+    Modelled phase and (if contrast is True) contrast for the given parameter values, broadcast against phase. If
+    jacobian is True, their derivatives with respect to params instead, along a final dimension 'parameter'.
+
+    The parameter values are set directly on the components of instrument's compiled plan, which Instrument.get_delay()
+    and Instrument.get_contrast() read, rather than recompiling for every evaluation. Fitting the parameters preserves
+    the instrument type, and instrument is a private copy, so the plan is not otherwise used.
+    """
+    _set_params(instrument.plan.interferometer, instrument_base.interferometer, params, values)
+    model = [instrument.get_delay(phase.wavelength, phase.x, phase.y, jacobian=jacobian), ]
+    if contrast:
+        model.append(instrument.get_contrast(jacobian=jacobian))
+
+    if jacobian:
+        model = [xr.concat([_broadcast(deriv.get(param, 0), phase) for param in params], dim='parameter',
+                           coords='minimal', compat='override', ) for _, deriv in model]
+    else:
+        model = [_broadcast(m, phase) for m in model]
+    return [m.transpose(*phase.dims, ...) for m in model]
+
+
+def _broadcast(value, phase):
+    """
+    Broadcast a (tuple of) modelled value(s), in the order of Instrument.get_delay(), against phase.
+    """
+    if isinstance(value, tuple):
+        value = xr.concat(xr.broadcast(*[xr.DataArray(v) for v in value]), dim='delay')
+    return xr.DataArray(value).broadcast_like(phase)
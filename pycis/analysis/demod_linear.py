@@ -1,15 +1,17 @@
 import numpy as np
-from numpy.fft import fft2, ifft2, fftshift, ifftshift, fftfreq
+from scipy.fft import fft2, ifft2, fftshift, ifftshift, fftfreq
 import xarray as xr
 
 from pycis.analysis import make_carrier_window
-from pycis.model import get_pixelated_phase_mask
+from pycis.model import get_pixelated_phase_mask, get_dtype
 
 
 def fft2_im(image):
     """
     2-D fast Fourier transform of an image
 
+    Single-precision (float32 / complex64) images are transformed in single precision.
+
     :param image:
     :return: fft
     """
@@ -25,18 +27,20 @@ def fft2_im(image):
     return xr.DataArray(fftshift(fft2(image.data)), coords=(freq_x, freq_y), )
 
 
-def demodulate_linear(image, fringe_freq, ):
+def demodulate_linear(image, fringe_freq, precision=None, ):
     """
     demodulation of interferograms with a linear phase shear
 
     :param image: xr.DataArray with dimensions 'x' and 'y' in units m, indicating pixel position on the sensor plane.
     :param fringe_freq: tuple / list of two floats corresponding to the x- and y-components of the predicted
     fringe frequency in units of m^(-1)
+    :param str precision: 'single' or 'double' floating-point precision. Defaults to the global precision, see
+        pycis.model.set_precision().
     :return:
     """
-
+    image = image.astype(get_dtype(precision))
     fft = fft2_im(image)
-    window = make_carrier_window(fft, fringe_freq, sign='pm')
+    window = make_carrier_window(fft, fringe_freq, sign='pm').astype(image.dtype)
 
     fft_dc = fft * (1 - window)
     fft_carrier = fft * window
@@ -1,18 +1,20 @@
 import numpy as np
-from numpy.fft import ifft2, ifftshift
+from scipy.fft import ifft2, ifftshift
 import xarray as xr
 from pycis.analysis import make_carrier_window, make_lowpass_window, fft2_im
-from pycis.model import get_pixelated_phase_mask, get_pixel_idxs, get_superpixel_position
+from pycis.model import get_pixelated_phase_mask, get_pixel_idxs, get_superpixel_position, get_dtype
 
 
-def demod_single_delay_pixelated(im):
+def demod_single_delay_pixelated(im, precision=None):
     """
     :param im: xr.DataArray image to be demodulation. Must have dimensions 'x' and 'y'.
+    :param str precision: 'single' or 'double' floating-point precision. Defaults to the global precision, see
+        pycis.model.set_precision().
     :return:
     """
     sensor_format = [len(im.x), len(im.y)]
     idxs1, idxs2, idxs3, idxs4 = get_pixel_idxs(sensor_format)
-    im = im.astype(float)
+    im = im.astype(get_dtype(precision))
     xs, ys = get_superpixel_position(im.x, im.y, )
     m1 = im.isel(x=idxs1[0], y=idxs1[1], ).assign_coords({'x': xs, 'y': ys})
     m2 = im.isel(x=idxs2[0], y=idxs2[1], ).assign_coords({'x': xs, 'y': ys})
@@ -26,22 +28,24 @@ def demod_single_delay_pixelated(im):
     return i0 / 4, phase, contrast
 
 
-def demod_single_delay_pixelated_mod(im):
+def demod_single_delay_pixelated_mod(im, precision=None):
     """
     alternative to demod_single_delay_pixelated() using 'synchronous demodulation' instead of the 'four-bucket' algorithm.
     
     :param im: xr.DataArray image to be demodulation. Must have dimensions 'x' and 'y'.
+    :param str precision: see demod_single_delay_pixelated().
     :return:
     """
     if im.dims[0] != 'x':
         im = im.transpose('x', 'y')
+    im = im.astype(get_dtype(precision))
     xs, ys = get_superpixel_position(im.x, im.y, )
 
     fft = fft2_im(im)
     pm = get_pixelated_phase_mask(im.shape)
-    sp = im * np.exp(-1j * pm)
+    sp = im * np.exp(-1j * pm).astype(get_dtype(precision, complex=True))
     fft_sp = fft2_im(sp)
-    window_lowpass = make_lowpass_window(fft_sp, 100)
+    window_lowpass = make_lowpass_window(fft_sp, 100).astype(im.dtype)
     fft_dc = fft * window_lowpass
     fft_carrier = fft_sp * window_lowpass
     dc = xr.DataArray(ifft2(ifftshift(fft_dc.data)), coords=im.coords, dims=im.dims).real
@@ -56,13 +60,14 @@ def demod_single_delay_pixelated_mod(im):
     return dc, phase, contrast
 
 
-def demod_multi_delay_pixelated(image, fringe_freq, ):
+def demod_multi_delay_pixelated(image, fringe_freq, precision=None, ):
 
+    image = image.astype(get_dtype(precision))
     fft = fft2_im(image)
-    window_pm = make_carrier_window(fft, fringe_freq, sign='pm')
-    window_p = make_carrier_window(fft, fringe_freq, sign='p')
-    window_m = make_carrier_window(fft, fringe_freq, sign='m')
-    window_lowpass = make_lowpass_window(fft, fringe_freq)
+    window_pm = make_carrier_window(fft, fringe_freq, sign='pm').astype(image.dtype)
+    window_p = make_carrier_window(fft, fringe_freq, sign='p').astype(image.dtype)
+    window_m = make_carrier_window(fft, fringe_freq, sign='m').astype(image.dtype)
+    window_lowpass = make_lowpass_window(fft, fringe_freq).astype(image.dtype)
 
     fft_carrier = fft * window_pm * window_lowpass
     fft_dc = (fft - fft_carrier) * window_lowpass
@@ -77,7 +82,7 @@ def demod_multi_delay_pixelated(image, fringe_freq, ):
     carrier_1 = xr.DataArray(ifft2(ifftshift(fft_carrier.data)), coords=image.coords, dims=image.dims)
 
     pm = get_pixelated_phase_mask(image.shape)
-    sp = image * np.exp(1j * pm)
+    sp = image * np.exp(1j * pm).astype(get_dtype(precision, complex=True))
 
     fft_sp = fft2_im(sp)
     c, d = image.coords, image.dims
@@ -109,25 +114,27 @@ def demod_multi_delay_pixelated(image, fringe_freq, ):
     return dc, phase, contrast
 
 
-def demod_triple_delay_pixelated(image, fringe_freq, **kwargs):
+def demod_triple_delay_pixelated(image, fringe_freq, precision=None, **kwargs):
     """
 
     :param image: (xr.DataArray) CIS Image to demodulate
     :param fringe_freq: (tuple) Tuple containing xy-coord of fringe location in Fourier space
+    :param str precision: see demod_single_delay_pixelated().
     :param kwargs: Additional kwargs - namely wfactor passed to make_carrier_window()
     :return:
     """
+    image = image.astype(get_dtype(precision))
     fft = fft2_im(image)
-    window_p = make_carrier_window(fft, fringe_freq, sign='p', **kwargs)
-    window_m = make_carrier_window(fft, fringe_freq, sign='m', **kwargs)
-    window_lowpass = make_lowpass_window(fft, fringe_freq)
+    window_p = make_carrier_window(fft, fringe_freq, sign='p', **kwargs).astype(image.dtype)
+    window_m = make_carrier_window(fft, fringe_freq, sign='m', **kwargs).astype(image.dtype)
+    window_lowpass = make_lowpass_window(fft, fringe_freq).astype(image.dtype)
 
     fft_dc = fft * window_lowpass
 
     dc = xr.DataArray(ifft2(ifftshift(fft_dc.data)), coords=image.coords, dims=image.dims).real
 
     pm = get_pixelated_phase_mask(image.shape)
-    sp = image * np.exp(1j * pm)
+    sp = image * np.exp(1j * pm).astype(get_dtype(precision, complex=True))
 
     fft_sp = fft2_im(sp)
     c, d = image.coords, image.dims
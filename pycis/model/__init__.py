@@ -1,3 +1,4 @@
+from .precision import *
 from .spectrum import *
 from .dispersion import *
 from .coherence import *
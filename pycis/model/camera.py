@@ -1,7 +1,9 @@
 import inspect
+import threading
+from functools import lru_cache
 import numpy as np
 import xarray as xr
-from pycis.model import LinearPolariser, mueller_product
+from pycis.model import LinearPolariser
 
 camera_types = [
     'monochrome',
@@ -9,6 +11,15 @@ camera_types = [
     'rgb',
 ]
 
+# pixelated polariser orientations (in degrees) over the 2x2 superpixel, keyed by (x_pixel % 2, y_pixel % 2). Consistent
+# with get_pixel_idxs()
+polariser_layout = {
+    (0, 0): 0,
+    (1, 0): 45,
+    (1, 1): 90,
+    (0, 1): 135,
+}
+
 
 class Camera(object):
     """
@@ -31,13 +42,26 @@ class Camera(object):
         self.cam_noise = cam_noise
         self.type = type
         self.x, self.y = self.get_pixel_position()
+        self._quadrature_weights = {}
+        # guards the quadrature weight cache, which tiles evaluated on a thread pool share
+        self._quadrature_lock = threading.Lock()
 
         assert type in camera_types
         if type == 'monochrome_polarised':
             assert sensor_format[0] % 2 == 0
             assert sensor_format[1] % 2 == 0
 
-    def capture(self, spectrum, apply_polarisers=None, clean=False):
+    def __getstate__(self):
+        # locks can be neither pickled nor copied
+        state = self.__dict__.copy()
+        del state['_quadrature_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._quadrature_lock = threading.Lock()
+
+    def capture(self, spectrum, apply_polarisers=None, clean=False, seed=None):
         """
         Capture an image.
 
@@ -45,12 +69,36 @@ class Camera(object):
             (optionally) 'stokes'. If there is no 'stokes' dim then the light is assumed to be unpolarised.
         :param bool apply_polarisers: Whether to apply a pixelated polariser array to the spectrum.
         :param bool clean: False to add realistic image noise. Clean images used for testing.
+        :param seed: Seed for the image noise, see Camera.digitise().
         :return: (xr.DataArray) Captured image.
         """
 
-        # check pixel centre positions are compatible with camera
-        assert np.all(np.isin(spectrum.x, self.x))
-        assert np.all(np.isin(spectrum.y, self.y))
+        if self.type == 'rgb':
+            from pycis.tools.color_system import cs_srgb
+            return cs_srgb.spec_to_rgb(self.get_intensity(spectrum, apply_polarisers=apply_polarisers), )
+
+        signal = self.integrate(spectrum, apply_polarisers=apply_polarisers)
+        return self.digitise(signal, clean=clean, seed=seed)
+
+    def get_intensity(self, spectrum, apply_polarisers=None):
+        """
+        Spectrum of the total intensity (first Stokes parameter) observed at each pixel.
+
+        :param xr.DataArray spectrum: Spectrum in units of photons / m with dimensions 'x', 'y', 'wavelength' and
+            (optionally) 'stokes'. If there is no 'stokes' dim then the light is assumed to be unpolarised. Instead of
+            'x' and 'y', the spectrum can have dimension 'point', with coordinates 'x' and 'y' giving the position of
+            each sample point (see pycis.model.Instrument.capture_points()).
+        :param bool apply_polarisers: Whether to apply a pixelated polariser array to the spectrum. Defaults to True
+            for camera type 'monochrome_polarised'.
+        :return: (xr.DataArray) Intensity spectrum in units of photons / m.
+        """
+
+        # check pixel centre positions are compatible with camera. Sample points are checked by
+        # Instrument.capture_points()
+        if 'point' not in spectrum.dims:
+            x_pixel, y_pixel = self.check_pixel_position(spectrum.x.values, spectrum.y.values)
+        else:
+            x_pixel, y_pixel = self.get_pixel_index(spectrum.x.values, spectrum.y.values)
 
         if apply_polarisers is None:
             if self.type == 'monochrome_polarised':
@@ -58,32 +106,100 @@ class Camera(object):
 
         if apply_polarisers:
             assert 'stokes' in spectrum.dims
-            mueller_matrix = self.get_mueller_matrix()
-            spectrum = mueller_product(mueller_matrix, spectrum, )
+            return self._apply_polarisers(spectrum, x_pixel, y_pixel)
 
         # ensure only total intensity (first Stokes parameter) is observed
         if 'stokes' in spectrum.dims:
             spectrum = spectrum.isel(stokes=0, drop=True)
 
-        if self.type == 'rgb':
-            from pycis.tools.color_system import cs_srgb
-            signal = cs_srgb.spec_to_rgb(spectrum, )
+        return spectrum
 
-        else:
-            signal = spectrum.integrate(coord='wavelength')
+    def integrate(self, spectrum, apply_polarisers=None, transfer=None):
+        """
+        Photon fluence hitting each pixel, integrated over wavelength.
+
+        Integration is linear in the spectrum, so a spectrum split along 'wavelength' into chunks that overlap by one
+        sample can be integrated chunk-by-chunk and the results summed. The trapezoidal rule is used, as a single
+        contraction with the cached quadrature weights (see Camera.get_quadrature_weights()).
 
-            if not clean:
-                np.random.seed()
-                signal.values = np.random.poisson(signal.values)
-            signal = signal * self.qe
-            if not clean:
-                signal.values = signal.values + np.random.normal(0, self.cam_noise, signal.values.shape)
+        :param xr.DataArray spectrum: Spectrum in units of photons / m, see Camera.get_intensity().
+        :param bool apply_polarisers: Whether to apply a pixelated polariser array to the spectrum.
+        :param xr.DataArray transfer: If given, the (dimensionless) fraction of the unpolarised spectrum observed at
+            each pixel, as a function of wavelength e.g. from Instrument.get_spectral_response(). The product of the
+            transfer and the spectrum is then integrated without ever being formed in memory. The transfer must
+            already account for the pixelated polariser array, if present, and the spectrum must be unpolarised (no
+            'stokes' dimension).
+        :return: (xr.DataArray) Photon fluence in units of photons.
+        """
+        weights = self.get_quadrature_weights(spectrum.wavelength)
+        if spectrum.dtype == np.float32:
+            weights = weights.astype(np.float32)
+        if transfer is None:
+            spectrum = self.get_intensity(spectrum, apply_polarisers=apply_polarisers)
+            return xr.dot(spectrum, weights, dims='wavelength')
+
+        # fold the weights into the spectrum, so that the only temporary has the shape of the spectrum (often without
+        # pixel dimensions), never that of the product of spectrum and transfer
+        assert 'stokes' not in spectrum.dims
+        return xr.dot(spectrum * weights, transfer, dims='wavelength')
+
+    def get_quadrature_weights(self, wavelength):
+        """
+        Trapezoidal quadrature weights w for integration over the given wavelength coordinate, such that the integral of
+        f is sum(w * f).
 
-            signal = signal / self.epercount
-            signal.values = np.digitize(signal.values, np.arange(0, 2 ** self.bit_depth))
-            signal = signal.astype(np.uint16)
+        Weights are cached on the camera, keyed by the wavelength values, so repeated captures on the same wavelength
+        grid don't recalculate them. The returned array is read-only.
 
-        return signal
+        :param xr.DataArray wavelength: Wavelength coordinate in m, with dimension 'wavelength'.
+        :return: (xr.DataArray) Quadrature weights in m, with dimension 'wavelength'.
+        """
+        wl = np.asarray(wavelength.values, dtype=float)
+        key = wl.tobytes()
+        with self._quadrature_lock:
+            if key not in self._quadrature_weights:
+                if len(self._quadrature_weights) >= 8:
+                    self._quadrature_weights = {}
+                dwl = np.diff(wl)
+                weights = np.zeros(wl.size)
+                weights[:-1] += dwl / 2
+                weights[1:] += dwl / 2
+                weights.flags.writeable = False
+                self._quadrature_weights[key] = xr.DataArray(weights, dims=('wavelength', ),
+                                                             coords={'wavelength': wl}, )
+            return self._quadrature_weights[key]
+
+    def digitise(self, signal, clean=False, seed=None, dtype=np.float64, gaussian_threshold=None):
+        """
+        Convert photon fluence to camera counts, adding shot noise and camera noise.
+
+        :param xr.DataArray signal: Photon fluence in units of photons, see Camera.integrate().
+        :param bool clean: False to add realistic image noise. Clean images used for testing.
+        :param seed: Seed for the random number generator, passed to np.random.default_rng(). An int gives
+            reproducible noise and an np.random.Generator is used as is (e.g. to draw successive frames from one
+            stream). Defaults to fresh entropy from the operating system on every call, so that noise is independent
+            between calls, threads and processes.
+        :type seed: None, int, np.random.SeedSequence, np.random.Generator
+        :param dtype: Floating-point type used for the calculation: np.float64 or (faster, less memory) np.float32.
+        :param float gaussian_threshold: If given, shot noise for pixels whose expected photon count exceeds this
+            threshold is drawn from the Gaussian approximation to the Poisson distribution, which is cheaper for large
+            counts. A threshold of ~1000 photons is accurate for most purposes.
+        :return: (xr.DataArray) Image in units of camera counts.
+        """
+        dtype = np.dtype(dtype).type
+        values = np.asarray(signal.values, dtype=dtype)
+        if not clean:
+            rng = np.random.default_rng(seed)
+            values = _add_shot_noise(values, rng, gaussian_threshold)
+        values = values * dtype(self.qe)
+        if not clean:
+            values += dtype(self.cam_noise) * rng.standard_normal(values.shape, dtype=dtype)
+        values = values / dtype(self.epercount)
+
+        # quantise: equivalent to np.digitize(values, np.arange(0, 2 ** self.bit_depth))
+        values = np.clip(np.floor(values) + 1, 0, 2 ** self.bit_depth)
+
+        return signal.copy(data=values.astype(np.uint16))
 
     def get_pixel_position(self, x_pixel=None, y_pixel=None, ):
         """
@@ -132,6 +248,92 @@ class Camera(object):
 
         return mat
 
+    def get_analyser_vectors(self, ):
+        """
+        Compact representation of the pixelated polariser array, which repeats over 2x2 superpixels.
+
+        The intensity observed at a pixel is the dot product of its analyser vector (the first row of its polariser's
+        Mueller matrix) with the Stokes vector of the incident light.
+
+        :return: (xr.DataArray) analyser vectors with dimensions 'x_parity', 'y_parity' and 'stokes' (shape (2, 2, 4)),
+            where x_parity = x_pixel % 2 and y_parity = y_pixel % 2.
+        """
+        analyser = np.zeros([2, 2, 4, ])
+        for (x_parity, y_parity), orientation in polariser_layout.items():
+            analyser[x_parity, y_parity, :] = LinearPolariser(orientation=orientation).get_mueller_matrix()[0, :]
+        return xr.DataArray(analyser, dims=('x_parity', 'y_parity', 'stokes', ), )
+
+    def get_pixel_index(self, x=None, y=None, ):
+        """
+        Calculate pixel indices from pixel centre positions on the sensor plane -- the inverse of
+        Camera.get_pixel_position().
+
+        :param x: x position(s) in m.
+        :type x: float, np.array, xr.DataArray
+        :param y: y position(s) in m.
+        :type y: float, np.array, xr.DataArray
+        :return: x_pixel, y_pixel: integer pixel indices, of the same type as x and y. None for any position not given.
+        """
+        pixel = []
+        for position, npix in zip([x, y, ], self.sensor_format):
+            if position is None:
+                pixel.append(None)
+            else:
+                pixel.append(np.rint(position / self.pixel_size + npix / 2 - 0.5).astype(int))
+        return tuple(pixel)
+
+    def check_pixel_position(self, x=None, y=None, rtol=1e-6, ):
+        """
+        Check that positions on the sensor plane are pixel centres, and return their pixel indices.
+
+        The check is arithmetic, from the pixel size and the sensor format, so it costs O(n) for n positions and
+        accepts positions that differ from the pixel centres only by float rounding.
+
+        :param x: x position(s) in m.
+        :type x: float, np.array, xr.DataArray
+        :param y: y position(s) in m.
+        :type y: float, np.array, xr.DataArray
+        :param float rtol: Maximum distance from the pixel centre, as a fraction of the pixel size.
+        :return: x_pixel, y_pixel: integer pixel indices, as np.ndarray. None for any position not given.
+        :raises ValueError: if any position is not a pixel centre on the sensor.
+        """
+        pixel = []
+        for position, npix in zip([x, y, ], self.sensor_format):
+            if position is None:
+                pixel.append(None)
+                continue
+            index = np.asarray(position, dtype=float) / self.pixel_size + npix / 2 - 0.5
+            index_int = np.rint(index).astype(int)
+            if np.any(np.abs(index - index_int) > rtol) or np.any(index_int < 0) or np.any(index_int >= npix):
+                raise ValueError('pycis: positions are not pixel centres on the camera sensor')
+            pixel.append(index_int)
+        return tuple(pixel)
+
+    def _apply_polarisers(self, spectrum, x_pixel, y_pixel):
+        """
+        Total intensity observed through the pixelated polariser array, given the Stokes spectrum incident on the
+        sensor and the pixel indices of its positions (see Camera.check_pixel_position()).
+
+        If spectrum covers a contiguous block of whole superpixels it is reshaped into superpixel blocks and contracted
+        with the analyser vectors directly. Otherwise the analyser vector of each pixel is looked up from its parity.
+        """
+        analyser = self.get_analyser_vectors()
+        if spectrum.dtype == np.float32:
+            analyser = analyser.astype(np.float32)
+
+        if 'point' not in spectrum.dims and _check_superpixel_block(x_pixel) and _check_superpixel_block(y_pixel):
+            spectrum = spectrum.transpose('x', 'y', ..., 'stokes')
+            nx, ny = spectrum.sizes['x'], spectrum.sizes['y']
+            shape_other = spectrum.shape[2:-1]
+            data = spectrum.data.reshape((nx // 2, 2, ny // 2, 2, ) + shape_other + (4, ))
+            data = np.einsum('ijk,aibj...k->aibj...', analyser.values, data)
+            return spectrum.isel(stokes=0, drop=True).copy(data=data.reshape((nx, ny, ) + shape_other))
+
+        x_parity = xr.DataArray(x_pixel % 2, dims=spectrum.x.dims, )
+        y_parity = xr.DataArray(y_pixel % 2, dims=spectrum.y.dims, )
+        analyser = analyser.isel(x_parity=x_parity, y_parity=y_parity, )
+        return xr.dot(analyser, spectrum, dims='stokes')
+
     def get_pixelated_phase_mask(self, ):
         """
         Calls the fn. camera.get_pixelated_phase_mask and assigns the correct x, y coordinates.
@@ -146,24 +348,55 @@ class Camera(object):
         return args == other_args
 
 
+def _add_shot_noise(values, rng, gaussian_threshold=None):
+    """
+    Draw photon counts with expectation values, using the Gaussian approximation to the Poisson distribution above
+    gaussian_threshold (if given).
+    """
+    dtype = values.dtype
+    if gaussian_threshold is None:
+        return rng.poisson(values).astype(dtype)
+
+    large = values > gaussian_threshold
+    values_out = np.empty_like(values)
+    values_out[~large] = rng.poisson(values[~large])
+    values_large = values[large]
+    values_out[large] = np.rint(values_large + np.sqrt(values_large) * rng.standard_normal(values_large.shape,
+                                                                                          dtype=dtype))
+    return values_out
+
+
+def _check_superpixel_block(pixel):
+    """
+    Do the (sorted) pixel indices cover a contiguous range of whole superpixels?
+    """
+    if pixel.size == 0:
+        return False
+    return pixel.size % 2 == 0 and pixel[0] % 2 == 0 and np.all(np.diff(pixel) == 1)
+
+
 def get_pixelated_phase_mask(sensor_format):
     """
     pixelated phase mask for the standard polarised CI instrument layout described in my thesis.
 
+    Memoised: the mask for each sensor format is calculated once and then shared between calls. Its values are
+    read-only, so copy before modifying.
+
     :param sensor_format: (tuple) number of pixels in each dimension (x, y, ).
     :return: (xr.DataArray) phase_mask with dimensions 'x' and 'y' and without coordinates.
     """
+    return _get_pixelated_phase_mask(tuple(sensor_format)).copy(deep=False)
 
-    phase_mask = xr.DataArray(np.zeros(sensor_format), dims=('x', 'y', ), )
-    idxs_x = xr.DataArray(np.arange(0, sensor_format[0], 2), dims=('x',), )
-    pix_idxs_y = xr.DataArray(np.arange(0, sensor_format[1], 2), dims=('y',), )
-
-    phase_mask[idxs_x, pix_idxs_y, ] = 0
-    phase_mask[idxs_x + 1, pix_idxs_y, ] = np.pi / 2
-    phase_mask[idxs_x + 1, pix_idxs_y + 1, ] = np.pi
-    phase_mask[idxs_x, pix_idxs_y + 1, ] = 3 * np.pi / 2
 
-    return phase_mask
+@lru_cache(maxsize=16)
+def _get_pixelated_phase_mask(sensor_format):
+    phase_mask = np.zeros(sensor_format)
+    phase_mask[0::2, 0::2] = 0
+    phase_mask[1::2, 0::2] = np.pi / 2
+    phase_mask[1::2, 1::2] = np.pi
+    phase_mask[0::2, 1::2] = 3 * np.pi / 2
+    phase_mask.flags.writeable = False
+    return xr.DataArray(phase_mask, dims=('x', 'y', ), )
 
 
 def get_pixel_idxs(sensor_format):
@@ -173,9 +406,16 @@ def get_pixel_idxs(sensor_format):
     Following the pixel-numbering conventions defined for the FLIR Blackfly S camera in my paper. This may need to be
     generalised at some point.
 
+    Memoised: the indices for each sensor format are calculated once and then shared between calls. Their values are
+    read-only.
+
     :return: idxs1
     """
+    return _get_pixel_idxs(tuple(sensor_format))
+
 
+@lru_cache(maxsize=16)
+def _get_pixel_idxs(sensor_format):
     idxs_x = xr.DataArray(np.arange(0, sensor_format[0], 2), dims=('x',), )
     idxs_y = xr.DataArray(np.arange(0, sensor_format[1], 2), dims=('y',), )
 
@@ -184,30 +424,37 @@ def get_pixel_idxs(sensor_format):
     idxs3 = idxs_x + 1, idxs_y + 1
     idxs4 = idxs_x, idxs_y + 1
 
-    return idxs1, idxs2, idxs3, idxs4
+    idxs = idxs1, idxs2, idxs3, idxs4
+    for idxs_xy in idxs:
+        for idx in idxs_xy:
+            idx.values.flags.writeable = False
+    return idxs
 
 
 def get_superpixel_position(x, y, ):
     """
     given pixel positions x and y, return the 2x2 superpixel positions xs and ys
 
+    Memoised on the values of x and y. The values of xs and ys are read-only.
+
     :return:
     """
-
-    sensor_format = [len(x), len(y)]
-    pixel_size = float(x[1] - x[0])
-    idxs1, _, _, _ = get_pixel_idxs(sensor_format)
-
-    xs = x.isel(x=idxs1[0]).values + pixel_size / 2
-    xs = xr.DataArray(xs, coords=(xs, ), dims=('x', ))
-    xs.attrs = {'units': 'm'}
-
-    ys = y.isel(y=idxs1[1]).values + pixel_size / 2
-    ys = xr.DataArray(ys, coords=(ys, ), dims=('y', ))
-    ys.attrs = {'units': 'm'}
-
-    return xs, ys
+    xs, ys = _get_superpixel_position(x.values.tobytes(), y.values.tobytes(), x.dtype.str, y.dtype.str, )
+    return xs.copy(deep=False), ys.copy(deep=False)
 
 
+@lru_cache(maxsize=16)
+def _get_superpixel_position(x, y, x_dtype, y_dtype, ):
+    x = np.frombuffer(x, dtype=x_dtype)
+    y = np.frombuffer(y, dtype=y_dtype)
+    pixel_size = float(x[1] - x[0])
 
+    superpixel_position = []
+    for position, dim in zip([x, y, ], ['x', 'y', ]):
+        position_s = position[0::2] + pixel_size / 2
+        position_s.flags.writeable = False
+        position_s = xr.DataArray(position_s, coords=(position_s, ), dims=(dim, ))
+        position_s.attrs = {'units': 'm'}
+        superpixel_position.append(position_s)
 
+    return tuple(superpixel_position)
@@ -1,9 +1,10 @@
 from typing import Union
 import numpy as np
-from numba import vectorize, float64, complex128
+from numba import vectorize, float64, complex128, njit, prange
 import xarray as xr
-from scipy.constants import c
-from pycis.model import get_kappa, wl2freq
+from scipy.constants import c, e, atomic_mass
+from scipy.fft import ifft, next_fast_len
+from pycis.model import get_kappa, wl2freq, CIII_WAVELENGTHS, CIII_REL_INTS, CIII_ZEEMAN_SHIFT
 
 
 def calculate_coherence(spectrum, delay, material=None, freq_ref=None):
@@ -99,6 +100,127 @@ def calculate_coherence(spectrum, delay, material=None, freq_ref=None):
     return integrand.integrate(coord='frequency')
 
 
+def calculate_coherence_fft(spectrum, delay, material=None, freq_ref=None, oversample=2, nspread=12):
+    """
+    Calculate the temporal coherence of an intensity spectrum, as measured by a 2-beam interferometer with given delay(s),
+    using a non-uniform fast Fourier transform (NUFFT).
+
+    Gives the same result as calculate_coherence() in its modes 1 and 2 (no dispersion and the group delay
+    approximation, see calculate_coherence()), but instead of forming and integrating spectrum * exp(i * delay) for each
+    delay, the spectrum is transformed once, by an FFT onto a grid in the delay domain oversampled by the factor
+    oversample, and the coherence at each delay is interpolated from the grid with a Gaussian kernel spanning 2 * nspread
+    grid points. This interpolation is exact to ~1e-12 of the integrated spectrum for the defaults (Greengard & Lee,
+    SIAM Review 46, 443 (2004)), for arbitrary (e.g. per-pixel) delays. The cost is one FFT per spectrum and
+    ~2 * nspread operations per delay, instead of a pass over the spectrum per delay, and no (delay, frequency)
+    temporaries are formed. Spectra not sampled uniformly in frequency (e.g. uniform in wavelength) are first
+    interpolated onto a uniform frequency grid with the same number of points, by cubic spline.
+
+    Mode 3 (the full dispersive integral, delay with a spectral dimension) is passed to calculate_coherence().
+
+    :param spectrum: Intensity spectrum, see calculate_coherence().
+    :type spectrum: xr.DataArray
+    :param delay: Interferometer delay(s) in radians at the reference frequency, see calculate_coherence().
+    :type delay: Union[float, xr.DataArray]
+    :param str material: see calculate_coherence().
+    :param freq_ref: see calculate_coherence().
+    :type freq_ref: Union[float, xr.DataArray]
+    :param int oversample: Oversampling factor of the delay grid.
+    :param int nspread: Half-width, in grid points, of the interpolation kernel.
+    :return: Temporal coherence, see calculate_coherence().
+    """
+    if isinstance(delay, xr.DataArray) and ('frequency' in delay.dims or 'wavelength' in delay.dims):
+        return calculate_coherence(spectrum, delay, material=material, freq_ref=freq_ref)
+
+    if 'wavelength' in spectrum.dims:
+        assert 'frequency' not in spectrum.dims
+        spectrum = wl2freq(spectrum)
+    spectrum = spectrum.sortby('frequency')
+
+    if freq_ref is None:
+        freq_ref = (spectrum * spectrum['frequency']).integrate(coord='frequency') / \
+                   spectrum.integrate(coord='frequency')
+    kappa = 1 if material is None else get_kappa(c / freq_ref, material=material)
+
+    # resample onto a uniform frequency grid, if necessary
+    freq = spectrum['frequency'].values
+    dfreq = (freq[-1] - freq[0]) / (freq.size - 1)
+    if not np.allclose(np.diff(freq), dfreq, rtol=1e-6, atol=0):
+        freq = np.linspace(freq[0], freq[-1], freq.size)
+        spectrum = spectrum.interp(frequency=freq, method='cubic')
+
+    # trapezoidal quadrature weights
+    weights = xr.DataArray(np.full(freq.size, dfreq), dims=('frequency', ), )
+    weights[[0, -1]] /= 2
+    dims_other = tuple(d for d in spectrum.dims if d != 'frequency')
+    coefs = (spectrum * weights).transpose(*dims_other, 'frequency')
+    coefs = coefs.values.reshape(-1, freq.size)
+
+    # delay(1 + kappa * (freq - freq_ref) / freq_ref) = delay + u * (freq - freq_ref), with u in rad / Hz
+    delay = xr.DataArray(delay)
+    u = delay * kappa / freq_ref
+    template = spectrum.isel(frequency=0, drop=True)
+    u = xr.DataArray(u).broadcast_like(template)
+    dims_out = dims_other + tuple(d for d in u.dims if d not in dims_other)
+    u = u.transpose(*dims_out)
+
+    # with freq = freq_mid + k * dfreq, integer k, the integral is exp(i * u * (freq_mid - freq_ref)) times a
+    # trigonometric sum over k, evaluated at u * dfreq by the NUFFT
+    idx_mid = freq.size // 2
+    freq_mid = freq[idx_mid]
+    coherence = _nufft_type_2(coefs, u.values.reshape(coefs.shape[0], -1) * dfreq, idx_mid, oversample, nspread)
+    coherence = u.copy(data=coherence.reshape(u.shape))
+    return coherence * complexp_ufunc(delay + u * (freq_mid - freq_ref))
+
+
+def _nufft_type_2(coefs, x, idx_mid, oversample, nspread):
+    """
+    Evaluate sum_j coefs[p, j] * exp(i * (j - idx_mid) * x[p, q]) for all p and q, by Gaussian gridding.
+
+    :param np.ndarray coefs: shape (n_p, n_j).
+    :param np.ndarray x: shape (n_p, n_q), in radians.
+    :return: (np.ndarray) complex, shape (n_p, n_q).
+    """
+    n_p, n_j = coefs.shape
+    n_grid = next_fast_len(max(oversample * n_j, 2 * nspread))
+    tau = np.pi * nspread / (n_j ** 2 * oversample * (oversample - 0.5))
+
+    # deconvolve the Fourier coefficients of the periodic Gaussian kernel, then transform onto the grid
+    k = np.arange(n_j) - idx_mid
+    grid = np.zeros((n_p, n_grid), dtype=complex)
+    grid[:, k % n_grid] = coefs * np.sqrt(np.pi / tau) * np.exp(k ** 2 * tau)
+    grid = ifft(grid, axis=-1)
+
+    out = np.empty(x.shape, dtype=complex)
+    _nufft_spread_kernel(grid, np.ascontiguousarray(x, dtype=float), tau, nspread, out)
+    return out
+
+
+@njit(parallel=True, nogil=True, cache=True, )
+def _nufft_spread_kernel(grid, x, tau, nspread, out):
+    """
+    Interpolate from the grid at points x with the periodic Gaussian kernel exp(-d^2 / (4 tau)), evaluated with the
+    fast Gaussian gridding factorisation: three exponentials per point rather than one per grid point.
+    """
+    n_grid = grid.shape[1]
+    dy = 2 * np.pi / n_grid
+    weights_fixed = np.exp(-(dy * np.arange(-nspread + 1, nspread + 1)) ** 2 / (4 * tau))
+    n_q = x.shape[1]
+    for ii in prange(x.size):
+        p = ii // n_q
+        q = ii % n_q
+        xx = x[p, q] % (2 * np.pi)
+        l0 = int(np.floor(xx / dy))
+        d0 = xx - l0 * dy
+        e1 = np.exp(-d0 ** 2 / (4 * tau))
+        e2 = np.exp(d0 * dy / (2 * tau))
+        e2_m = e2 ** (-nspread + 1)
+        acc = 0j
+        for m in range(-nspread + 1, nspread + 1):
+            acc += e1 * e2_m * weights_fixed[m + nspread - 1] * grid[p, (l0 + m) % n_grid]
+            e2_m *= e2
+        out[p, q] = acc
+
+
 @vectorize([complex128(float64)], fastmath=False, nopython=True, cache=True, )
 def complexp(x):
     return np.exp(1j * x)
@@ -108,26 +230,100 @@ def complexp_ufunc(x):
     return xr.apply_ufunc(complexp, x, dask='allowed', )
 
 
-def get_coherence_doppler_singlet(temperature, wl0, mass, v, delay=None, material=None, nbins=500, nsigma=5):
-    """
-
-    :param temperature:
-    :param wl0: assumed
-    :param mass:
-    :param v:
-    :return:
+def get_coherence_doppler_multiplet(delay, wavelength, rel_int, temperature, mass, v=0, bfield=0, zeeman_shift=None,
+                                    material=None, freq_ref=None):
     """
+    Analytic temporal coherence of a multiplet of Doppler-broadened, Doppler-shifted and (optionally) Zeeman-split
+    Gaussian line components, as measured by a 2-beam interferometer with given delay(s).
 
-    freq0 = c / wl0
-    freq_shift_norm = (f_0 - freq_0) / freq_0
+    No spectrum is formed: component j, with centre frequency :math:`\\nu_j` and Doppler-width standard deviation
+    :math:`\\sigma_j`, contributes
 
-    if mode == 'group_delay':
-        kappa = get_kappa(wl0, material=material)
-    elif mode == 'no_dispersion':
-        kappa = 1
-
-    phase = delay * (1 + kappa * freq_shift_norm)
-    contrast = np.exp(-2 * (np.pi * sigma * (d / (2 * np.pi * freq_0)) * kappa) ** 2)
+     .. math::
+        I_j\\exp\\left(-\\frac{(u\\sigma_j)^2}{2}\\right)\\exp\\left(i\\phi+iu(\\nu_j-\\nu_0)\\right),
+        \\quad u=\\frac{\\kappa\\phi}{\\nu_0},
+
+    with delay :math:`\\phi` at the reference frequency :math:`\\nu_0` and :math:`\\kappa=1` without dispersion. The
+    result equals calculate_coherence() (modes 1 and 2) applied to the area-normalised spectrum, up to the discretisation
+    error of the latter. All of delay, temperature, v and bfield are broadcast against each other (by dimension name
+    for xr.DataArrays), so the contrast and phase of whole plasma parameter maps come from a handful of elementwise
+    operations per line component.
+
+    :param delay: Interferometer delay(s) in radians at the reference frequency.
+    :type delay: Union[float, np.ndarray, xr.DataArray]
+    :param wavelength: Rest wavelengths of the line components in m.
+    :type wavelength: Union[float, np.ndarray]
+    :param rel_int: Relative intensities of the line components.
+    :type rel_int: Union[float, np.ndarray]
+    :param temperature: Ion temperature in eV.
+    :type temperature: Union[float, np.ndarray, xr.DataArray]
+    :param float mass: Ion mass in atomic mass units.
+    :param v: Line-of-sight flow velocity in km/s, positive for a red-shift.
+    :type v: Union[float, np.ndarray, xr.DataArray]
+    :param bfield: Magnetic field strength in T.
+    :type bfield: Union[float, np.ndarray, xr.DataArray]
+    :param zeeman_shift: Rest-wavelength shift of each line component per unit field, in m / T. Defaults to zero.
+    :type zeeman_shift: Union[float, np.ndarray]
+    :param str material: Birefringent material, for the group delay approximation (see calculate_coherence()).
+        Defaults to None (no dispersion).
+    :param float freq_ref: Reference frequency in Hz. Defaults to the centre-of-mass frequency of the line components
+        at rest and without field, so that flows and fields appear as phase shifts.
+    :return: Complex degree of coherence, normalised by the total intensity. Its absolute value is the contrast and its
+        argument the phase.
+    """
+    wavelength, rel_int = np.broadcast_arrays(np.atleast_1d(wavelength), np.atleast_1d(rel_int))
+    zeeman_shift = np.broadcast_to(0 if zeeman_shift is None else zeeman_shift, wavelength.shape)
+    if freq_ref is None:
+        freq_ref = (c / wavelength * rel_int).sum() / rel_int.sum()
+    kappa = 1 if material is None else get_kappa(c / freq_ref, material=material)
+
+    u = delay * kappa / freq_ref
+    doppler = np.sqrt(temperature * e / (mass * atomic_mass)) / c  # Doppler-width st. dev. / frequency
+    coherence = 0
+    for wl, ri, shift in zip(wavelength, rel_int, zeeman_shift):
+        freq = c / ((wl + shift * bfield) * (1 + v / (c / 1e3)))
+        coherence = coherence + ri * np.exp(-(u * doppler * freq) ** 2 / 2 + 1j * u * (freq - freq_ref))
+    return coherence * np.exp(1j * delay) / rel_int.sum()
+
+
+def get_coherence_doppler_singlet(delay, temperature, wl0, mass, v=0, material=None, freq_ref=None):
+    """
+    Analytic temporal coherence of a Doppler-broadened, Doppler-shifted Gaussian singlet, see
+    get_coherence_doppler_multiplet().
+
+    :param delay: Interferometer delay(s) in radians at the reference frequency.
+    :param temperature: Ion temperature in eV.
+    :param float wl0: Rest wavelength of the singlet in m.
+    :param float mass: Ion mass in atomic mass units.
+    :param v: Line-of-sight flow velocity in km/s.
+    :param str material: see get_coherence_doppler_multiplet().
+    :param float freq_ref: Reference frequency in Hz. Defaults to the rest frequency.
+    :return: Complex degree of coherence.
+    """
+    return get_coherence_doppler_multiplet(delay, wl0, 1, temperature, mass, v=v, material=material,
+                                           freq_ref=freq_ref, )
 
-    return
 
+def get_coherence_ciii_triplet(delay, temperature, v=0, bfield=0, material=None, freq_ref=None):
+    """
+    Analytic temporal coherence of the Doppler-broadened C III triplet at 464.9 nm, see
+    get_coherence_doppler_multiplet().
+
+    Analytic counterpart of calculate_coherence(get_spectrum_ciii_triplet(...), ...), with the same line components
+    (see CIII_WAVELENGTHS etc.): a magnetic field splits each line into a Zeeman doublet of equal halves, as in
+    get_spectrum_ciii_triplet(test=True). The two differ slightly in the Doppler widths, which are proportional to the
+    centre frequency of each line component here, but the same for all line components in get_spectrum_ciii_triplet().
+
+    :param delay: Interferometer delay(s) in radians at the reference frequency.
+    :param temperature: Ion temperature in eV.
+    :param v: Line-of-sight flow velocity in km/s.
+    :param bfield: Magnetic field strength in T.
+    :param str material: see get_coherence_doppler_multiplet().
+    :param float freq_ref: see get_coherence_doppler_multiplet().
+    :return: Complex degree of coherence.
+    """
+    wavelength = np.repeat(CIII_WAVELENGTHS, 2)
+    rel_int = np.repeat(CIII_REL_INTS, 2) / 2
+    zeeman_shift = np.tile([CIII_ZEEMAN_SHIFT, -CIII_ZEEMAN_SHIFT], CIII_WAVELENGTHS.size)
+    return get_coherence_doppler_multiplet(delay, wavelength, rel_int, temperature, 12, v=v, bfield=bfield,
+                                           zeeman_shift=zeeman_shift, material=material, freq_ref=freq_ref, )
@@ -1,5 +1,7 @@
 import copy
+from functools import lru_cache
 import numpy as np
+import xarray as xr
 import matplotlib.pyplot as plt
 import pycis
 from matplotlib.gridspec import GridSpec
@@ -15,10 +17,16 @@ sellmeier_coefs_source_defaults = {
 }
 
 
-def get_refractive_indices(wavelength, material='a-BBO', sellmeier_coefs_source=None, sellmeier_coefs=None, ):
+def get_refractive_indices(wavelength, material='a-BBO', sellmeier_coefs_source=None, sellmeier_coefs=None,
+                           deriv=False, ):
     """
     Calculate the extraordinary and ordinary refractive indices as a function of wavelength
 
+    Results are memoised per set of Sellmeier coefficients and wavelength values (up to cache_size_max wavelengths),
+    so repeated evaluations over the same spectral lines are near-free. This is the usual case: successive captures of
+    spectra on the same wavelength grid, or successive evaluations of the model in pycis.analysis.fit_instrument(). The
+    cache holds the cache_count_max most recently used results. Cached values are exact and read-only.
+
     :param wavelength: Wavelength in m.
     :type wavelength: float, numpy.ndarray, xarray.DataArray
 
@@ -33,18 +41,54 @@ def get_refractive_indices(wavelength, material='a-BBO', sellmeier_coefs_source=
         Manually set the coefficients that describe the material dispersion
         via the Sellmeier equation. Dictionary must have keys 'Ae', 'Be', 'Ce', 'De', 'Ao', 'Bo', 'Co' and 'Do'.
 
+    :param bool deriv: Also return the derivatives of the refractive indices with respect to wavelength, in m^-1.
+
     :return: (ne, no) tuple containing extraordinary and ordinary refractive indices respectively. type(ne) = type(no)
-        = type(wavelength).
+        = type(wavelength). If deriv is True, (ne, no, dne_dwl, dno_dwl).
 
     """
     if all([arg is not None for arg in [sellmeier_coefs_source, sellmeier_coefs]]):
         raise ValueError('pycis: arguments not understood')
 
-    if sellmeier_coefs is not None:
-        form = 1
+    if sellmeier_coefs is None:
+        if sellmeier_coefs_source is None:
+            sellmeier_coefs_source = sellmeier_coefs_source_defaults[material]
+        sellmeier_coefs = sellmeier_coefs_all[sellmeier_coefs_source]['sellmeier_coefs']
+    sellmeier_coefs = tuple(sorted(sellmeier_coefs.items()))
+
+    wl = np.asarray(wavelength, dtype=np.float64)
+    if wl.size <= cache_size_max:
+        indices = _get_refractive_indices(sellmeier_coefs, wl.tobytes(), wl.shape, deriv, )
     else:
-        sellmeier_coefs = get_sellmeier_coefs(material, sellmeier_coefs_source)
-    return sellmeier_eqn(wavelength * 1e6, sellmeier_coefs, )
+        indices = _calc_refractive_indices(sellmeier_coefs, wl, deriv, )
+
+    if isinstance(wavelength, xr.DataArray):
+        return [xr.DataArray(n, dims=wavelength.dims, coords=wavelength.coords, name=wavelength.name, )
+                for n in indices]
+    elif np.ndim(wavelength) == 0:
+        return [n[()] for n in indices]
+    return list(indices)
+
+
+# maximum number of wavelengths in a cached result, and the number of results cached: at most 32 MB in total
+cache_size_max = 4096
+cache_count_max = 32
+
+
+@lru_cache(maxsize=cache_count_max)
+def _get_refractive_indices(sellmeier_coefs, wl, shape, deriv, ):
+    wl = np.frombuffer(wl, dtype=np.float64).reshape(shape)
+    indices = _calc_refractive_indices(sellmeier_coefs, wl, deriv, )
+    for n in indices:
+        n.flags.writeable = False
+    return indices
+
+
+def _calc_refractive_indices(sellmeier_coefs, wl, deriv, ):
+    indices = sellmeier_eqn(wl * 1e6, dict(sellmeier_coefs), deriv=deriv, )
+    if deriv:
+        indices = indices[:2] + [dn * 1e6 for dn in indices[2:]]  # per micron --> per m
+    return tuple(np.asarray(n, dtype=np.float64) for n in indices)
 
 
 def get_kappa(wavelength, **kwargs):
@@ -69,19 +113,14 @@ def get_kappa(wavelength, **kwargs):
     :return: kappa. type(kappa) = type(wavelength)
 
     """
-    ne, no = get_refractive_indices(wavelength, **kwargs)
-    ne_p1, no_p1 = get_refractive_indices(wavelength + DWL, **kwargs)
-    ne_m1, no_m1 = get_refractive_indices(wavelength - DWL, **kwargs)
-
+    ne, no, dne_dwl, dno_dwl = get_refractive_indices(wavelength, deriv=True, **kwargs)
     biref = ne - no
-    biref_p1 = ne_p1 - no_p1
-    biref_m1 = ne_m1 - no_m1
-    biref_deriv = (biref_p1 - biref_m1) / (2 * DWL)
+    biref_deriv = dne_dwl - dno_dwl
 
     return 1 - (wavelength / biref) * biref_deriv
 
 
-def sellmeier_eqn(wl, c, ):
+def sellmeier_eqn(wl, c, deriv=False, ):
     """
     Given a set of Sellmeier coefficients, calculate the extraordinary and ordinary refractive indices as a function of
     wavelength
@@ -93,22 +132,35 @@ def sellmeier_eqn(wl, c, ):
         Coefficients that describe material dispersion via the Sellmeier equation. Dictionary must have keys 'Ae', 'Be',
          'Ce', ... and 'Ao', 'Bo', 'Co', ... The form of Sellmeier equation used is determined by len(c).
 
+    :param bool deriv: Also return the derivatives of the refractive indices with respect to wavelength, in micron^-1.
+
     :return: (ne, no) tuple containing extraordinary and ordinary refractive indices respectively as a function of
-        wavelength.
+        wavelength. If deriv is True, (ne, no, dne_dwl, dno_dwl).
 
     """
     ts = ['e', 'o']
+    wl_2 = wl ** 2
     if len(c) == 8:
-        return [(c['A'+t] + (c['B'+t] / (wl ** 2 + c['C'+t])) + (c['D'+t] * wl ** 2)) ** 0.5 for t in ts]
+        n_2 = [c['A'+t] + (c['B'+t] / (wl_2 + c['C'+t])) + (c['D'+t] * wl_2) for t in ts]
+        dn_2 = [-2 * c['B'+t] * wl / (wl_2 + c['C'+t]) ** 2 + 2 * c['D'+t] * wl for t in ts]
     elif len(c) == 10:
-        return [(c['A'+t] + (c['B'+t] / (wl ** 2 + c['C'+t])) + (c['D'+t] / (wl ** 2 + c['E'+t]))) ** 0.5 for t in ts]
+        n_2 = [c['A'+t] + (c['B'+t] / (wl_2 + c['C'+t])) + (c['D'+t] / (wl_2 + c['E'+t])) for t in ts]
+        dn_2 = [-2 * c['B'+t] * wl / (wl_2 + c['C'+t]) ** 2 - 2 * c['D'+t] * wl / (wl_2 + c['E'+t]) ** 2 for t in ts]
     elif len(c) == 12:
-        return [((c['A'+t] * wl ** 2 / (wl ** 2 - c['B'+t])) +
-                (c['C'+t] * wl ** 2 / (wl ** 2 - c['D'+t])) +
-                (c['E'+t] * wl ** 2 / (wl ** 2 - c['F'+t])) + 1) ** 0.5 for t in ts]
+        n_2 = [(c['A'+t] * wl_2 / (wl_2 - c['B'+t])) +
+               (c['C'+t] * wl_2 / (wl_2 - c['D'+t])) +
+               (c['E'+t] * wl_2 / (wl_2 - c['F'+t])) + 1 for t in ts]
+        dn_2 = [-2 * wl * ((c['A'+t] * c['B'+t] / (wl_2 - c['B'+t]) ** 2) +
+                           (c['C'+t] * c['D'+t] / (wl_2 - c['D'+t]) ** 2) +
+                           (c['E'+t] * c['F'+t] / (wl_2 - c['F'+t]) ** 2)) for t in ts]
     else:
         raise NotImplementedError
 
+    n = [n_2_t ** 0.5 for n_2_t in n_2]
+    if deriv:
+        return n + [dn_2_t / (2 * n_t) for dn_2_t, n_t in zip(dn_2, n)]
+    return n
+
 
 def get_sellmeier_coefs(material, sellmeier_coefs_source=None):
     """
@@ -1,17 +1,58 @@
 import copy
+import hashlib
+import operator
 import sys
 import os
 import inspect
 import yaml
+import multiprocessing
+import threading
 from datetime import datetime
+from functools import reduce
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import numpy as np
 import xarray as xr
-from math import isclose, radians
-from numba import vectorize, f8
+from numba import vectorize, f8, get_num_threads, set_num_threads
 from fnmatch import fnmatch
 import pycis
-from pycis.model import mueller_product, LinearPolariser, Camera, QuarterWaveplate, Component, LinearRetarder, \
-    UniaxialCrystal, TiltableComponent
+from scipy.constants import c
+from pycis.model import mueller_product, MUELLER_DIMS, LinearPolariser, Camera, QuarterWaveplate, Component, LinearRetarder, \
+    UniaxialCrystal, TiltableComponent, calculate_coherence_fft, wl2freq, DWL, get_dtype, get_precision, \
+    get_pixelated_phase_mask
+
+
+class InstrumentPlan(NamedTuple):
+    """
+    Frozen execution plan for an instrument, see Instrument.compile()
+
+    Plans compare and hash by their content hash, key.
+
+    :param str type: Instrument type, see Instrument.get_type().
+    :param tuple interferometer: Copies of the interferometer components, as they were at compile time.
+    :param tuple retarders: The retarders in interferometer, in order.
+    :param tuple polarisers: The polarisers in interferometer, in order.
+    :param tuple terms: Interference terms for the hand-coded instrument types, each an (amplitude, combination,
+        absolute, offset, pixelated) tuple, see Instrument._get_interferogram_terms().
+    :param tuple mueller_plan: Steps of the Mueller calculation, see Instrument.get_mueller_plan().
+    :param str key: SHA-1 hex digest of the camera, optics and interferometer configuration, stable across processes.
+    """
+    type: str
+    interferometer: tuple
+    retarders: tuple
+    polarisers: tuple
+    terms: tuple
+    mueller_plan: tuple
+    key: str
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, InstrumentPlan) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
 
 
 class Instrument:
@@ -34,7 +75,7 @@ class Instrument:
 
     :param bool force_mueller: \
         Forces the full Mueller matrix calculation of the interferogram, regardless of whether an
-        analytical shortcut is available.
+        analytical shortcut (hand-coded or generated by pycis.model.symbolic) is available.
 
     """
     def __init__(self, config=None, camera=None, optics=None, interferometer=None, force_mueller=False):
@@ -47,10 +88,22 @@ class Instrument:
             self.interferometer = interferometer
 
         self.force_mueller = force_mueller
+        self._geometry_cache = {}
+        # guards the geometry cache, which tiles evaluated on a thread pool share (see Instrument.capture())
+        self._geometry_lock = threading.RLock()
+        self.spectral_response = None
         self.check_inputs()
-        self.retarders = [c for c in self.interferometer if isinstance(c, LinearRetarder)]
-        self.polarisers = [c for c in self.interferometer if isinstance(c, LinearPolariser)]
-        self.type = self.get_type()
+        self.compile()
+
+    def __getstate__(self):
+        # locks can be neither pickled nor copied
+        state = self.__dict__.copy()
+        del state['_geometry_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._geometry_lock = threading.RLock()
 
     def read_config(self, config):
         """
@@ -92,6 +145,8 @@ class Instrument:
         Write the current instrument config to a .yaml config file that can then be reloaded at a later date.
 
         :param str filepath:
+        :raises ValueError: if any interferometer component has an array-valued parameter, which cannot be stored in a
+            config file.
         """
 
         config = {
@@ -99,7 +154,7 @@ class Instrument:
             'lens_1_focal_length': self.optics[0],
             'lens_2_focal_length': self.optics[1],
             'lens_3_focal_length': self.optics[2],
-            'interferometer': [dict([(type(c).__name__, vars(c))]) for c in self.interferometer]
+            'interferometer': [dict([(type(c).__name__, _get_component_config(c))]) for c in self.interferometer]
         }
 
         assert fpath[-5:] == '.yaml'
@@ -112,6 +167,41 @@ class Instrument:
         assert isinstance(self.optics, list)
         assert all(isinstance(co, Component) for co in self.interferometer)
 
+    def compile(self):
+        """
+        Freeze the instrument into an execution plan, used by all subsequent calculations of the interferogram
+
+        The instrument type is (re-)derived, the interferometer components are copied, constant factors (instrument
+        contrasts, polariser orientation offsets and the products of constant Mueller matrices) are precomputed and a
+        content hash is taken, which can key caches across processes. Called on construction. Call again after
+        modifying the camera, optics or interferometer components to pick up the changes. State derived from the
+        previous configuration (the ray-geometry cache and any stored spectral response) is dropped.
+
+        :return: (InstrumentPlan) the plan, also stored as Instrument.plan.
+        """
+        self.retarders = [c for c in self.interferometer if isinstance(c, LinearRetarder)]
+        self.polarisers = [c for c in self.interferometer if isinstance(c, LinearPolariser)]
+        self.type = self.get_type()
+        self.clear_geometry_cache()
+        self.spectral_response = None
+
+        interferometer = tuple(copy.deepcopy(c) for c in self.interferometer)
+        h = hashlib.sha1()
+        _update_hash(h, [getattr(self.camera, arg) for arg in inspect.signature(Camera).parameters])
+        _update_hash(h, [self.optics, self.force_mueller, ])
+        _update_hash(h, [(type(c).__name__, vars(c)) for c in interferometer])
+
+        self.plan = InstrumentPlan(
+            type=self.type,
+            interferometer=interferometer,
+            retarders=tuple(c for c in interferometer if isinstance(c, LinearRetarder)),
+            polarisers=tuple(c for c in interferometer if isinstance(c, LinearPolariser)),
+            terms=self._get_interferogram_plan(),
+            mueller_plan=_get_mueller_plan(interferometer),
+            key=h.hexdigest(),
+        )
+        return self.plan
+
     def get_type(self):
         """
         Instrument type determines how the interferogram is calculated
@@ -125,6 +215,8 @@ class Instrument:
         - 'double_delay_linear'
         - 'triple_delay_linear'
         - 'quad_delay_linear'
+        - 'symbolic': any other polariser / retarder stack, using a kernel generated from its symbolic interferogram
+          (see pycis.model.symbolic)
 
         :return: type (str)
         """
@@ -170,13 +262,16 @@ class Instrument:
                 pol_1_orientation = self.interferometer[0].orientation
                 pol_2_orientation = self.interferometer[-1].orientation
 
-                conditions_met = [pol_1_orientation == pol_2_orientation, ] + \
-                                 [isclose(crys.orientation - pol_1_orientation, 45) for crys in self.retarders]
+                conditions_met = [np.all(np.isclose(pol_1_orientation, pol_2_orientation)), ] + \
+                                 [np.all(np.isclose(c.orientation - pol_1_orientation, 45)) for c in self.retarders]
                 if all(conditions_met):
                     inst_type = 'single_delay_linear'
 
         if inst_type is None:
-            inst_type = 'mueller'
+            if self._check_symbolic():
+                inst_type = 'symbolic'
+            else:
+                inst_type = 'mueller'
 
         return inst_type
 
@@ -184,6 +279,9 @@ class Instrument:
         """
         Calculate incidence angle(s) of ray(s) through the component
 
+        If x and y are (a subset of) the camera's pixel centre positions, the angles are taken from the geometry cache
+        (see Instrument.get_geometry).
+
         :param x: x position(s) on sensor plane in m.
         :type x: float, xr.DataArray
 
@@ -195,18 +293,18 @@ class Instrument:
 
         :return: (float, xr.DataArray) Incidence angle(s) in radians.
         """
-        if isinstance(component, TiltableComponent):
-            x0 = self.optics[2] * np.tan(radians(component.tilt_x))
-            y0 = self.optics[2] * np.tan(radians(component.tilt_y))
-        else:
-            x0 = 0
-            y0 = 0
-        return np.arctan2(((x - x0) ** 2 + (y - y0) ** 2) ** 0.5, self.optics[2], )
+        inc_angle = self._get_cached_geometry(x, y, component, 0)
+        if inc_angle is not None:
+            return inc_angle
+        return self._calc_inc_angle(x, y, component)
 
     def get_azim_angle(self, x, y, component):
         """
         Calculate azimuthal angle(s) of ray(s) through the component
 
+        If x and y are (a subset of) the camera's pixel centre positions, the angles are taken from the geometry cache
+        (see Instrument.get_geometry).
+
         :param x: x position(s) on sensor plane in m.
         :type x: float, xr.DataArray
 
@@ -218,13 +316,109 @@ class Instrument:
 
         :return: (float, xr.DataArray) Azimuthal angle(s) in radians.
         """
+        azim_angle = self._get_cached_geometry(x, y, component, 1)
+        if azim_angle is not None:
+            return azim_angle
+        return self._calc_azim_angle(x, y, component)
+
+    def get_geometry(self, component):
+        """
+        Incidence and azimuthal angles of the rays through the component, evaluated at every camera pixel centre
+
+        Results are cached on the instrument, keyed by the camera geometry, the focal length of the final lens and the
+        component's tilt (and, for the azimuthal angle, its orientation). Changing any of these means the maps are
+        recalculated on the next call and stale entries are dropped. The returned arrays are read-only and shared
+        between calls, so copy before modifying.
+
+        :param component: Interferometer component.
+        :type component: pycis.Component
+
+        :return: (inc_angle, azim_angle) tuple of read-only xr.DataArray, both in radians.
+        """
+        keys = self._get_geometry_keys(component)
+        if keys is None:
+            return self._calc_inc_angle(self.camera.x, self.camera.y, component), \
+                self._calc_azim_angle(self.camera.x, self.camera.y, component)
+        with self._geometry_lock:
+            if any(key not in self._geometry_cache for key in keys):
+                self._prune_geometry_cache(keep=keys)
+            for key, fn in zip(keys, [self._calc_inc_angle, self._calc_azim_angle]):
+                if key not in self._geometry_cache:
+                    angle = fn(self.camera.x, self.camera.y, component)
+                    angle.values.flags.writeable = False
+                    self._geometry_cache[key] = angle
+            return tuple(self._geometry_cache[key] for key in keys)
+
+    def clear_geometry_cache(self):
+        """
+        Empty the ray-geometry cache.
+        """
+        with self._geometry_lock:
+            self._geometry_cache = {}
+
+    def _get_geometry_keys(self, component):
+        """
+        Cache keys for the incidence and azimuthal angle maps of the given component, or None if its tilt or orientation
+        is array-valued (a design sweep, see pycis.model.Component), in which case the maps are not cached.
+        """
+        camera_key = (tuple(self.camera.sensor_format), self.camera.pixel_size, self.optics[2], )
+        if isinstance(component, TiltableComponent):
+            tilt_key = (component.tilt_x, component.tilt_y, )
+        else:
+            tilt_key = (0, 0, )
+        orientation_key = (getattr(component, 'orientation', 0), )
+        if any(np.ndim(param) != 0 for param in tilt_key + orientation_key):
+            return None
+        key_inc = ('inc_angle', ) + camera_key + tilt_key
+        key_azim = ('azim_angle', ) + camera_key + tilt_key + orientation_key
+        return key_inc, key_azim
+
+    def _prune_geometry_cache(self, keep=()):
+        """
+        Drop cached angle maps that no longer correspond to the camera, optics or tilt / orientation of the compiled
+        plan's components (which are the ones looked up), other than those with keys in keep.
+        """
+        keys_current = [key for c in self.plan.interferometer for key in (self._get_geometry_keys(c) or ())] + \
+            list(keep)
+        with self._geometry_lock:
+            self._geometry_cache = {k: v for k, v in self._geometry_cache.items() if k in keys_current}
+
+    def _get_cached_geometry(self, x, y, component, idx):
+        """
+        Look up cached angle map (idx=0: incidence, idx=1: azimuthal) at positions x, y. Returns None if x and y are not
+        pixel centre positions on the camera's sensor.
+        """
+        if not (isinstance(x, xr.DataArray) and isinstance(y, xr.DataArray)):
+            return None
+        if x.dims != ('x', ) or y.dims != ('y', ) or self._get_geometry_keys(component) is None:
+            return None
+
+        angle = self.get_geometry(component)[idx]
+        if np.array_equal(x.values, self.camera.x.values) and np.array_equal(y.values, self.camera.y.values):
+            return angle
+        try:
+            x_pixel, y_pixel = self.camera.check_pixel_position(x.values, y.values)
+        except ValueError:
+            return None
+        return angle.isel(x=x_pixel, y=y_pixel).assign_coords({'x': x.values, 'y': y.values, })
+
+    def _calc_inc_angle(self, x, y, component):
+        if isinstance(component, TiltableComponent):
+            x0 = self.optics[2] * np.tan(np.radians(component.tilt_x))
+            y0 = self.optics[2] * np.tan(np.radians(component.tilt_y))
+        else:
+            x0 = 0
+            y0 = 0
+        return np.arctan2(((x - x0) ** 2 + (y - y0) ** 2) ** 0.5, self.optics[2], )
+
+    def _calc_azim_angle(self, x, y, component):
         if isinstance(component, pycis.TiltableComponent):
-            x0 = self.optics[2] * np.tan(radians(component.tilt_x))
-            y0 = self.optics[2] * np.tan(radians(component.tilt_y))
+            x0 = self.optics[2] * np.tan(np.radians(component.tilt_x))
+            y0 = self.optics[2] * np.tan(np.radians(component.tilt_y))
         else:
             x0 = 0
             y0 = 0
-        return np.arctan2(y - y0, x - x0) + np.pi - radians(component.orientation)
+        return np.arctan2(y - y0, x - x0) + np.pi - np.radians(component.orientation)
 
     def get_mueller_matrix(self, wavelength, x, y):
         """
@@ -242,15 +436,29 @@ class Instrument:
         :return: (xr.DataArray) Mueller matrix.
         """
 
-        mat_total = xr.DataArray(np.identity(4), dims=('mueller_v', 'mueller_h'), )
-        for component in self.interferometer:
-            inc_angle = self.get_inc_angle(x, y, component)
-            azim_angle = self.get_azim_angle(x, y, component)
-            mat_component = component.get_mueller_matrix(wavelength, inc_angle, azim_angle)
+        mat_total = xr.DataArray(np.identity(4), dims=MUELLER_DIMS, )
+        for step in self.plan.mueller_plan:
+            if isinstance(step, xr.DataArray):
+                mat_component = step
+            else:
+                inc_angle = self.get_inc_angle(x, y, step)
+                azim_angle = self.get_azim_angle(x, y, step)
+                mat_component = step.get_mueller_matrix(wavelength, inc_angle, azim_angle)
             mat_total = mueller_product(mat_component, mat_total)
         return mat_total
 
-    def get_delay(self, wavelength, x, y, ):
+    def get_mueller_plan(self):
+        """
+        Plan of the Mueller calculation: each run of consecutive interferometer components with constant Mueller matrices
+        (see pycis.model.Component) is pre-multiplied into a single 4x4 matrix, so that only the components that vary
+        with wavelength or position are evaluated at full resolution.
+
+        :return: (list) steps in the order the light passes through them. Each step is either an xr.DataArray, a
+            constant Mueller matrix with dimensions ('mueller_v', 'mueller_h'), or a pycis.model.Component.
+        """
+        return list(self.plan.mueller_plan)
+
+    def get_delay(self, wavelength, x, y, jacobian=False):
         """
         Calculate the interferometer delay(s) at the given wavelength(s)
 
@@ -263,48 +471,133 @@ class Instrument:
         :param y: y position(s) on sensor plane in m.
         :type y: float, xr.DataArray
 
-        :return: (xr.DataArray) Interferometer delay(s) in radians.
+        :param bool jacobian: Also return the exact derivatives of the delay(s) with respect to the instrument
+            parameters, labelled as in Instrument.get_jacobian(), and with respect to wavelength (in rad / m), labelled
+            'wavelength'.
+
+        :return: (xr.DataArray) Interferometer delay(s) in radians. If jacobian is True, (delay, jacobian) where
+            jacobian is a dict of derivatives, each with the same structure as delay.
         """
-        # Would be nice to write a generalised method if possible
-        assert self.type != 'mueller'
+        plan = self.plan
+        assert plan.type not in ['mueller', 'symbolic'], \
+            'pycis: Instrument.get_delay() needs a hand-coded instrument type, not ' + plan.type
 
         # get delay for each retarder
         delay = []
-        for ret in self.retarders:
-            inc_angle = self.get_inc_angle(x, y, ret)
-            azim_angle = self.get_azim_angle(x, y, ret)
-            delay.append(ret.get_delay(wavelength, inc_angle, azim_angle))
+        deriv = []
+        for ret in plan.retarders:
+            if jacobian:
+                d, dd = self._get_delay_jacobian(wavelength, x, y, ret)
+            else:
+                inc_angle = self.get_inc_angle(x, y, ret)
+                azim_angle = self.get_azim_angle(x, y, ret)
+                d, dd = ret.get_delay(wavelength, inc_angle, azim_angle), {}
+            delay.append(d)
+            deriv.append(dd)
+
+        # calculation depends on instrument type: each output delay is a signed sum of retarder delays (taken as an
+        # absolute value if absolute is True) plus an offset due to the polariser orientation, if pixelated
+        delay_sum = (0, 1), (1, 1),
+        delay_diff = (0, 1), (1, -1),
+        if plan.type == 'single_delay_linear':
+            outputs = [(tuple((idx, 1) for idx in range(len(plan.retarders))), False, ), ]
+            offset = None
+
+        elif fnmatch(plan.type, '*_delay_linear'):
+            outputs = [(((0, 1), ), False, ), (((1, 1), ), False, ), (delay_sum, False, ), (delay_diff, True, ), ]
+            offset = None
+
+        elif plan.type == 'single_delay_pixelated':
+            outputs = [(((0, 1), ), False, ), ]
+            offset = -2 * np.radians(plan.polarisers[0].orientation)
+
+        elif plan.type == 'double_delay_pixelated':
+            outputs = [(delay_sum, False, ), (delay_diff, True, ), ]
+            offset = -2 * np.radians(plan.polarisers[0].orientation - 45)
+
+        elif plan.type == 'triple_delay_pixelated':
+            outputs = [(((1, 1), ), False, ), (delay_sum, False, ), (delay_diff, True, ), ]
+            offset = -2 * np.radians(plan.polarisers[0].orientation - 22.5)
+        else:
+            raise NotImplementedError
 
-        # calculation depends on instrument type
-        if self.type == 'single_delay_linear':
-            delay_out = sum(delay)
+        delay_out = []
+        deriv_out = []
+        for combination, absolute in outputs:
+            d = sum(sign * delay[idx] for idx, sign in combination)
+            dd = {}
+            for idx, sign in combination:
+                for param, value in deriv[idx].items():
+                    dd[param] = dd.get(param, 0) + sign * value
+            if absolute:
+                dd = {param: np.sign(d) * value for param, value in dd.items()}
+                d = abs(d)
+            if offset is not None:
+                d = d + offset
+                if jacobian:
+                    # rotation of the whole interferometer rotates the polariser too
+                    dd['orientation'] = dd.get('orientation', 0) - 2 * np.pi / 180
+            delay_out.append(d)
+            deriv_out.append(dd)
+
+        if len(outputs) == 1:
+            delay_out, deriv_out = delay_out[0], deriv_out[0]
+        else:
+            delay_out = tuple(delay_out)
+            params = list(dict.fromkeys(param for dd in deriv_out for param in dd))
+            deriv_out = {param: tuple(dd.get(param, 0) for dd in deriv_out) for param in params}
+        return (delay_out, deriv_out) if jacobian else delay_out
 
-        elif fnmatch(self.type, '*_delay_linear'):
-            delay_sum = delay[0] + delay[1]
-            delay_diff = abs(delay[0] - delay[1])
-            delay_out = delay[0], delay[1], delay_sum, delay_diff
+    def get_contrast(self, jacobian=False):
+        """
+        Instrument contrast of each of the interferometer delays returned by Instrument.get_delay(), in the same order:
+        the product of the contrast_inst of the retarders that contribute to the delay. This is the fringe contrast
+        measured for a monochromatic source.
+
+        :param bool jacobian: Also return the derivatives of the contrast(s) with respect to the contrast_inst of each
+            retarder, labelled 'contrast_inst_<idx>' with idx the retarder's index in the interferometer.
+        :return: (float, tuple) Instrument contrast(s). If jacobian is True, (contrast, jacobian) where jacobian is a
+            dict of derivatives, each with the same structure as contrast.
+        """
+        plan = self.plan
+        assert plan.type not in ['mueller', 'symbolic'], \
+            'pycis: Instrument.get_contrast() needs a hand-coded instrument type, not ' + plan.type
 
-        elif self.type == 'single_delay_pixelated':
-            orientation_delay = -2 * radians(self.polarisers[0].orientation)
-            delay_out = delay[0] + orientation_delay
+        # indices of the retarders contributing to each output contrast
+        if plan.type == 'single_delay_linear':
+            outputs = [tuple(range(len(plan.retarders))), ]
 
-        elif self.type == 'double_delay_pixelated':
-            orientation_delay = -2 * radians(self.polarisers[0].orientation - 45)
-            delay_sum = delay[0] + delay[1]
-            delay_diff = abs(delay[0] - delay[1])
-            delay_out = delay_sum + orientation_delay, delay_diff + orientation_delay
+        elif fnmatch(plan.type, '*_delay_linear'):
+            outputs = [(0, ), (1, ), (0, 1, ), (0, 1, ), ]
 
-        elif self.type == 'triple_delay_pixelated':
-            orientation_delay = -2 * radians(self.polarisers[0].orientation - 22.5)
-            delay_sum = delay[0] + delay[1]
-            delay_diff = abs(delay[0] - delay[1])
-            delay_out = delay[1] + orientation_delay, delay_sum + orientation_delay, delay_diff + orientation_delay
+        elif plan.type == 'single_delay_pixelated':
+            outputs = [(0, ), ]
+
+        elif plan.type == 'double_delay_pixelated':
+            outputs = [(0, 1, ), (0, 1, ), ]
+
+        elif plan.type == 'triple_delay_pixelated':
+            outputs = [(1, ), (0, 1, ), (0, 1, ), ]
         else:
             raise NotImplementedError
 
-        return delay_out
-
-    def capture(self, spectrum, clean=False):
+        contrast_inst = [ret.contrast_inst for ret in plan.retarders]
+        contrast_out = tuple(reduce(operator.mul, [contrast_inst[idx] for idx in output], 1.) for output in outputs)
+        deriv_out = {}
+        for idx, ret in enumerate(plan.retarders):
+            if not any(idx in output for output in outputs):
+                continue
+            param = 'contrast_inst_' + str([c is ret for c in plan.interferometer].index(True))
+            deriv_out[param] = tuple(reduce(operator.mul, [contrast_inst[i] for i in output if i != idx], 1.)
+                                     if idx in output else 0 for output in outputs)
+
+        if len(outputs) == 1:
+            contrast_out = contrast_out[0]
+            deriv_out = {param: value[0] for param, value in deriv_out.items()}
+        return (contrast_out, deriv_out) if jacobian else contrast_out
+
+    def capture(self, spectrum, clean=False, wavelength_chunk=None, tile_size=None, max_workers=None, processes=False,
+                coherence=False, seed=None, precision=None):
         """
         Capture image of given spectrum.
 
@@ -314,104 +607,724 @@ class Instrument:
             incident spectrum is uniform across pixels. However, if there is no 'stokes' dimension then it is assumed
             that light is unpolarised (i.e. the spectrum supplied is the S_0 Stokes parameter only).
         :param bool clean: False to add realistic image noise, passed to self.camera.capture()
+        :param int wavelength_chunk: If given, stream the calculation along the wavelength axis in chunks of (at most)
+            this many samples, accumulating the integrated signal as it goes. Peak memory is then set by the chunk size
+            rather than by the number of wavelength samples. Results are the same as for the one-shot calculation.
+            Must be at least 2. Not supported for camera type 'rgb'.
+        :param tuple tile_size: If given, (nx, ny) the size in pixels of the sensor tiles into which the calculation is
+            split. Tiles are processed concurrently and the integrated signal stitched together before noise is added.
+            This bounds the memory used per tile and can shorten the calculation for large sensors on multi-core
+            machines, but each tile has a fixed overhead: on a single core, tiling is slower than the one-shot
+            calculation. Not supported for camera type 'rgb'.
+        :param int max_workers: Maximum number of tiles processed in parallel. Defaults to the number of processors.
+            The compiled kernels' threads are shared out between the workers.
+        :param bool processes: Process tiles on a pool of processes instead of a pool of threads. Threads suffice
+            for the compiled and NumPy kernels, which release the GIL.
+        :param bool coherence: True to use the fast approximate calculation for narrow-band spectra, see
+            Instrument.get_signal_coherence().
+        :param seed: Seed for the image noise, see Camera.digitise().
+        :param str precision: 'single' or 'double' floating-point precision for the calculation. Defaults to the
+            global precision, see pycis.model.set_precision().
         :return: (xr.DataArray) image in units of camera counts.
         """
-        if 'x' in spectrum.dims:
-            assert np.all(np.isin(spectrum.x, self.camera.x))  # check pixel centre positions compatible with camera
-            x = spectrum.x
+        spectrum, x, y = self._align_to_sensor(spectrum)
+        dtype = get_dtype(precision)
+        spectrum = spectrum.astype(dtype, copy=False)
+
+        if self.camera.type == 'rgb':
+            assert wavelength_chunk is None and tile_size is None
+            spectrum, apply_polarisers = self.get_sensor_spectrum(spectrum, x, y)
+            return self.camera.capture(spectrum, apply_polarisers=apply_polarisers, clean=clean, seed=seed)
+
+        if tile_size is None:
+            signal = self.get_signal(spectrum, x, y, wavelength_chunk=wavelength_chunk, coherence=coherence)
         else:
-            x = self.camera.x
+            signal = self._get_signal_tiled(spectrum, x, y, tile_size, wavelength_chunk, max_workers, processes,
+                                            coherence)
+
+        return self.camera.digitise(signal, clean=clean, seed=seed, dtype=dtype)
+
+    def capture_batch(self, spectrum, dim='time', block_size=1, clean=False, seed=None, precision=None):
+        """
+        Capture a series of images of spectra that differ only along a given dimension e.g. the frames of a time series.
+
+        The spectral response of the instrument (see Instrument.get_spectral_response()) is calculated once, on the
+        wavelength grid of the spectrum, and shared by all frames; the stored Instrument.spectral_response is used
+        instead if it is compatible. Each block of frames is then captured by a single contraction with the response.
+        Images are yielded block by block, so the whole series need never be held in memory at once and spectrum can be
+        a lazy (dask-backed) DataArray.
+
+        :param spectrum: (xr.DataArray) photon fluence spectrum, see Instrument.capture(), with the additional dimension
+            dim.
+        :param str dim: Name of the frame dimension.
+        :param int block_size: Number of frames per block.
+        :param bool clean: False to add realistic image noise, passed to self.camera.digitise()
+        :param seed: Seed for the image noise, see Camera.digitise(). All frames are drawn from one random number
+            stream, so a given seed reproduces the whole series.
+        :param str precision: see Instrument.capture().
+        :return: generator of (xr.DataArray) images in units of camera counts, each with dimensions (dim, 'x', 'y') and
+            with at most block_size frames.
+        """
+        assert self.camera.type != 'rgb'
+        assert dim in spectrum.dims
+        spectrum, x, y = self._align_to_sensor(spectrum)
+        dtype = get_dtype(precision)
 
-        if 'y' in spectrum.dims:
-            assert np.all(np.isin(spectrum.y, self.camera.y))  # check pixel centre positions compatible with camera
-            y = spectrum.y
+        if self._check_spectral_response(spectrum):
+            response = self.spectral_response
         else:
-            y = self.camera.y
+            response = self.get_spectral_response(spectrum.wavelength, x=x, y=y, stokes='stokes' in spectrum.dims,
+                                                  precision=precision)
+            response = response * self.camera.get_quadrature_weights(response.wavelength).astype(dtype)
+
+        rng = np.random.default_rng(seed)
+        for idx in range(0, spectrum.sizes[dim], block_size):
+            spectrum_block = spectrum.isel({dim: slice(idx, idx + block_size)}).astype(dtype, copy=False)
+            signal = self._apply_spectral_response(spectrum_block, x, y, response=response)
+            yield self.camera.digitise(signal, clean=clean, seed=rng, dtype=dtype).transpose(dim, 'x', 'y')
+
+    def capture_points(self, spectrum, x, y, clean=False, seed=None, precision=None):
+        """
+        Capture the image at an arbitrary set of sample points on the sensor plane only, e.g. sight lines matched to a
+        spectrometer.
+
+        Ray geometry, delays and the camera model are evaluated only at the given points, so the cost scales with the
+        number of points rather than with the sensor size. The points need not be pixel centres: the interferometer is
+        evaluated at the exact positions, while the pixelated polariser array (if present) is that of the pixel
+        containing each point.
+
+        :param spectrum: (xr.DataArray) photon fluence spectrum, see Instrument.capture(), but without dimensions 'x' or
+            'y'. It may have dimension 'point', matching the sample points.
+        :param x: x position(s) of the sample points on the sensor plane in m.
+        :type x: np.ndarray, list
+        :param y: y position(s) of the sample points on the sensor plane in m, with the same length as x.
+        :type y: np.ndarray, list
+        :param bool clean: False to add realistic image noise, passed to self.camera.digitise()
+        :param seed: Seed for the image noise, see Camera.digitise().
+        :param str precision: see Instrument.capture().
+        :return: (xr.DataArray) image in units of camera counts, with dimension 'point' and coordinates 'x' and 'y'.
+        """
+        assert self.camera.type != 'rgb'
+        assert 'x' not in spectrum.dims and 'y' not in spectrum.dims
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        assert x.ndim == 1 and x.shape == y.shape
+
+        coords = {'x': ('point', x, ), 'y': ('point', y, ), }
+        x = xr.DataArray(x, dims=('point', ), coords=coords, )
+        y = xr.DataArray(y, dims=('point', ), coords=coords, )
+        x_pixel, y_pixel = self.camera.get_pixel_index(x.values, y.values)
+        assert np.all((0 <= x_pixel) & (x_pixel < self.camera.sensor_format[0]))
+        assert np.all((0 <= y_pixel) & (y_pixel < self.camera.sensor_format[1]))
+
+        dtype = get_dtype(precision)
+        spectrum = spectrum.astype(dtype, copy=False)
+        signal = self._integrate(spectrum, x, y)
+        return self.camera.digitise(signal, clean=clean, seed=seed, dtype=dtype)
+
+    def get_signal(self, spectrum, x=None, y=None, wavelength_chunk=None, coherence=False):
+        """
+        Photon fluence hitting each pixel, integrated over wavelength, before noise is added and the signal digitised.
+
+        :param spectrum: (xr.DataArray) photon fluence spectrum, see Instrument.capture().
+        :param x: x position(s) on sensor plane in m, see Instrument.get_sensor_spectrum().
+        :type x: xr.DataArray
+        :param y: y position(s) on sensor plane in m, see Instrument.get_sensor_spectrum().
+        :type y: xr.DataArray
+        :param int wavelength_chunk: see Instrument.capture().
+        :param bool coherence: see Instrument.capture().
+        :return: (xr.DataArray) photon fluence in units of photons.
+        """
+        if x is None or y is None:
+            spectrum, x, y = self._align_to_sensor(spectrum)
+        nwl = spectrum.sizes['wavelength']
+
+        if coherence:
+            return self.get_signal_coherence(spectrum, x, y)
+
+        if self._check_spectral_response(spectrum):
+            return self._apply_spectral_response(spectrum, x, y)
+
+        if wavelength_chunk is None or wavelength_chunk >= nwl:
+            return self._integrate(spectrum, x, y)
+
+        assert wavelength_chunk >= 2
+
+        # consecutive chunks overlap by one sample, so that the sum of their trapezoidal integrals is the integral over
+        # the whole wavelength axis
+        signal = 0
+        for idx_start in range(0, nwl - 1, wavelength_chunk - 1):
+            spectrum_chunk = spectrum.isel(wavelength=slice(idx_start, idx_start + wavelength_chunk))
+            signal = signal + self._integrate(spectrum_chunk, x, y)
+
+        return signal
+
+    def _integrate(self, spectrum, x, y):
+        """
+        Photon fluence hitting each pixel, integrated over wavelength. For unpolarised light, the instrument's spectral
+        response is integrated together with the spectrum, so that their product is never formed.
+        """
+        if 'stokes' not in spectrum.dims:
+            transfer = self.get_spectral_response(spectrum.wavelength, x, y, precision=get_precision(spectrum.dtype))
+            return self.camera.integrate(spectrum, transfer=transfer)
+
+        spectrum, apply_polarisers = self.get_sensor_spectrum(spectrum, x, y)
+        return self.camera.integrate(spectrum, apply_polarisers=apply_polarisers)
+
+    def get_jacobian(self, spectrum, x=None, y=None):
+        """
+        Photon fluence hitting each pixel (see Instrument.get_signal()) together with its exact derivatives with respect
+        to the instrument parameters, all evaluated in the same vectorised pass, for gradient-based fitting.
+
+        The parameters are labelled '<name>_<idx>' for the thickness (in m) and cut_angle, tilt_x and tilt_y (in
+        degrees) of the retarder at index idx of the interferometer, and 'orientation' for a rotation (in degrees) of
+        the whole interferometer about the optical axis, which preserves the instrument type. Multiply by
+        camera.qe / camera.epercount for the derivatives of a clean image, in camera counts per unit parameter.
+
+        Only for the hand-coded instrument types (see Instrument.get_type()) and unpolarised spectra. The calculation is
+        in double precision.
+
+        :param spectrum: (xr.DataArray) photon fluence spectrum, see Instrument.capture(), without dimension 'stokes'.
+        :param x: x position(s) on sensor plane in m, see Instrument.get_sensor_spectrum().
+        :type x: xr.DataArray
+        :param y: y position(s) on sensor plane in m, see Instrument.get_sensor_spectrum().
+        :type y: xr.DataArray
+        :return: (signal, jacobian) where signal is the photon fluence in units of photons and jacobian has the
+            dimension 'parameter' (with the parameter labels as coordinates) followed by the dimensions of signal.
+        """
+        if self.plan.type in ['mueller', 'symbolic'] or 'stokes' in spectrum.dims:
+            raise NotImplementedError
+        if x is None or y is None:
+            spectrum, x, y = self._align_to_sensor(spectrum)
+        spectrum = spectrum.astype(np.float64, copy=False)
+
+        phase_mask = self._get_phase_mask(x, y)
+        terms = self._get_interferogram_terms(spectrum.wavelength, x, y, phase_mask, jacobian=True)
+        transfer = (1 + sum(a * np.cos(d + p) for a, d, p, _ in terms)) / 4
+        signal = self.camera.integrate(spectrum, transfer=transfer)
+
+        # the signal is integrated over wavelength
+        params = list(dict.fromkeys(param for *_, deriv in terms for param in deriv if param != 'wavelength'))
+        jacobian = []
+        for param in params:
+            transfer = - sum(a * np.sin(d + p) * deriv[param] for a, d, p, deriv in terms if param in deriv) / 4
+            jacobian.append(self.camera.integrate(spectrum, transfer=transfer).broadcast_like(signal))
+        jacobian = xr.concat(jacobian, dim='parameter').assign_coords(parameter=params)
+        return signal, jacobian.transpose('parameter', *signal.dims)
+
+    def get_signal_coherence(self, spectrum, x=None, y=None, freq_ref=None):
+        """
+        Photon fluence hitting each pixel, calculated from the temporal coherence of the spectrum.
+
+        Fast approximation to Instrument.get_signal() for narrow-band spectra. Interferometer delays are evaluated only
+        at the reference frequency, with dispersion accounted for to first order by the 'group delay approximation'
+        (see pycis.model.calculate_coherence). The group delay of each interference term is taken from the
+        finite-difference derivative of its delay, so that it includes the dependence on the ray angles through the
+        crystals and on the combination of crystals in sum and difference delays. The remaining error is set by the
+        second-order term in the Taylor expansion of the delay about the reference frequency, so it grows with the
+        square of the spectral width and is largest for thick crystals. For a 0.01 nm wide line near 465 nm and
+        ~1 cm crystals it is ~1e-6 of the mean signal.
+
+        The coherence is evaluated at each pixel's group delay by a non-uniform FFT of the spectrum (see
+        pycis.model.calculate_coherence_fft()), so for a spectrum uniform across the sensor (no 'x' or 'y' dimension)
+        the cost no longer scales with the product of the number of pixels and the number of wavelengths.
+
+        Only available for the hand-coded instrument types and for unpolarised light.
+
+        :param spectrum: (xr.DataArray) photon fluence spectrum, see Instrument.capture().
+        :param x: x position(s) on sensor plane in m, see Instrument.get_sensor_spectrum().
+        :type x: xr.DataArray
+        :param y: y position(s) on sensor plane in m, see Instrument.get_sensor_spectrum().
+        :type y: xr.DataArray
+        :param float freq_ref: Reference frequency in Hz. Defaults to the centre-of-mass frequency of the spectrum,
+            summed over pixels.
+        :return: (xr.DataArray) photon fluence in units of photons.
+        """
+        if self.plan.type in ['mueller', 'symbolic'] or 'stokes' in spectrum.dims:
+            raise NotImplementedError
+        if x is None or y is None:
+            spectrum, x, y = self._align_to_sensor(spectrum)
+
+        spectrum_freq = wl2freq(spectrum)
+        if freq_ref is None:
+            spectrum_total = spectrum_freq.sum(dim=[d for d in spectrum_freq.dims if d != 'frequency'])
+            freq_ref = float((spectrum_total * spectrum_total.frequency).integrate(coord='frequency') /
+                             spectrum_total.integrate(coord='frequency'))
+        wl_ref = c / freq_ref
+
+        phase_mask = self._get_phase_mask(x, y)
+        terms = self._get_interferogram_terms(wl_ref, x, y, phase_mask)
+        terms_p1 = self._get_interferogram_terms(wl_ref + DWL, x, y, phase_mask)
+        terms_m1 = self._get_interferogram_terms(wl_ref - DWL, x, y, phase_mask)
+
+        signal = spectrum.integrate(coord='wavelength')
+        for (amplitude, delay, phase), (_, delay_p1, _), (_, delay_m1, _) in zip(terms, terms_p1, terms_m1):
+            group_delay = -wl_ref ** 2 / c * (delay_p1 - delay_m1) / (2 * DWL)  # d(delay) / d(frequency)
+            envelope = self._get_coherence_envelope(spectrum_freq, group_delay, freq_ref)
+            signal = signal + amplitude * np.real(envelope * np.exp(1j * (delay + phase)))
+
+        return (signal / 4).transpose('x', 'y', ...)
+
+    @staticmethod
+    def _get_coherence_envelope(spectrum, group_delay, freq_ref):
+        """
+        Coherence of the spectrum, measured with delay group_delay * (frequency - freq_ref).
+
+        :param xr.DataArray spectrum: spectrum with dimension 'frequency'.
+        :param xr.DataArray group_delay: group delay in s, with dimensions 'x' and 'y'.
+        :param float freq_ref: reference frequency in Hz.
+        """
+        # without dispersion, the coherence measures delay gd * frequency; remove the carrier at freq_ref
+        coherence = calculate_coherence_fft(spectrum, group_delay * freq_ref, freq_ref=freq_ref)
+        return coherence * np.exp(-1j * group_delay * freq_ref)
+
+    def _get_signal_tiled(self, spectrum, x, y, tile_size, wavelength_chunk, max_workers, processes, coherence):
+        """
+        Instrument.get_signal(), evaluated tile-by-tile across the sensor in parallel.
+        """
+        tile_size_x, tile_size_y = tile_size
+        if self.camera.type == 'monochrome_polarised':
+            # keep whole superpixels in each tile
+            assert tile_size_x % 2 == 0 and tile_size_y % 2 == 0
+
+        slices_x = [slice(idx, idx + tile_size_x) for idx in range(0, len(x), tile_size_x)]
+        slices_y = [slice(idx, idx + tile_size_y) for idx in range(0, len(y), tile_size_y)]
+
+        if max_workers is None:
+            max_workers = min(len(slices_x) * len(slices_y), os.cpu_count() or 1)
+        # share numba's threads out between the workers, rather than each running a full set of them
+        num_threads = max(1, get_num_threads() // max_workers)
+
+        if processes:
+            # spawn rather than fork: forking after numba's parallel thread pool has started is not safe. The instrument
+            # is sent to each worker once, rather than with every tile
+            executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_tile_worker, initargs=(num_threads, self, ), )
+            get_signal = _get_signal_tile
+        else:
+            # numba's thread count is set per thread
+            executor = ThreadPoolExecutor(max_workers=max_workers, initializer=set_num_threads,
+                                          initargs=(num_threads, ), )
+            get_signal = self.get_signal
+        with executor:
+            futures = []
+            for slice_x in slices_x:
+                futures_row = []
+                for slice_y in slices_y:
+                    spectrum_tile = spectrum
+                    if 'x' in spectrum.dims:
+                        spectrum_tile = spectrum_tile.isel(x=slice_x)
+                    if 'y' in spectrum.dims:
+                        spectrum_tile = spectrum_tile.isel(y=slice_y)
+                    args = [spectrum_tile, x.isel(x=slice_x), y.isel(y=slice_y), wavelength_chunk, coherence, ]
+                    futures_row.append(executor.submit(get_signal, *args))
+                futures.append(futures_row)
+
+            signal = [xr.concat([f.result() for f in futures_row], dim='y') for futures_row in futures]
+        return xr.concat(signal, dim='x')
+
+    def get_sensor_spectrum(self, spectrum, x=None, y=None):
+        """
+        Spectrum of the light reaching the camera sensor
+
+        :param spectrum: (xr.DataArray) photon fluence spectrum, see Instrument.capture().
+        :param x: x position(s) on sensor plane in m. Defaults to spectrum.x, or the camera pixel positions if spectrum
+            has no dimension 'x'.
+        :type x: xr.DataArray
+        :param y: y position(s) on sensor plane in m. Defaults as for x.
+        :type y: xr.DataArray
+        :return: (spectrum, apply_polarisers) tuple, to be passed to self.camera.capture(). Depending on the
+            calculation used, the pixelated polariser array (if present) is either already accounted for in the
+            spectrum (apply_polarisers=False) or not (apply_polarisers=None).
+        """
+        if x is None or y is None:
+            spectrum, x, y = self._align_to_sensor(spectrum)
 
         failed = False
-        if self.type != 'mueller':
+        inst_type = self.plan.type
+        if inst_type not in ['mueller', 'symbolic']:
             try:
-                delay = self.get_delay(spectrum.wavelength, x, y)
                 apply_polarisers = False
-                phase_mask = self.camera.get_pixelated_phase_mask().sel({'x': x, 'y': y})
-                contrast_inst = [ret.contrast_inst for ret in self.retarders]
+                phase_mask = self._get_phase_mask(x, y)
 
                 if 'stokes' not in spectrum.dims:
-                    if self.type == 'single_delay_linear':
-                        spectrum = spectrum / 4 * (1 + np.prod(contrast_inst) * np.cos(delay))
-
-                    elif self.type == 'double_delay_linear':
-                        contrast_inst_sum = contrast_inst_diff = np.prod(contrast_inst)
-                        _, _, delay_sum, delay_diff = delay
-                        spectrum = spectrum / 4 * (
-                                1
-                                + 0.5 * contrast_inst_diff * np.cos(delay_diff)
-                                - 0.5 * contrast_inst_sum * np.cos(delay_sum)
-                        )
-
-                    elif self.type == 'triple_delay_linear':
-                        contrast_inst_sum = contrast_inst_diff = np.prod(contrast_inst)
-                        _, delay_2, delay_sum, delay_diff = delay
-                        root2 = np.sqrt(2)
-                        spectrum = spectrum / 4 * (
-                                1
-                                + root2 / 2 * contrast_inst[1] * np.cos(delay_2)
-                                + root2 / 4 * contrast_inst_diff * np.cos(delay_diff)
-                                - root2 / 4 * contrast_inst_sum * np.cos(delay_sum)
-                        )
-
-                    elif self.type == 'quad_delay_linear':
-                        contrast_inst_sum = contrast_inst_diff = np.prod(contrast_inst)
-                        delay_1, delay_2, delay_sum, delay_diff = delay
-                        spectrum = spectrum / 4 * (
-                                1
-                                + 0.5 * contrast_inst[0] * np.cos(delay_1)
-                                + 0.5 * contrast_inst[1] * np.cos(delay_2)
-                                + 0.25 * contrast_inst_diff * np.cos(delay_diff)
-                                - 0.25 * contrast_inst_sum * np.cos(delay_sum)
-                        )
-
-                    elif self.type == 'single_delay_pixelated':
-                        spectrum = spectrum / 4 * (1 + contrast_inst[0] * np.cos(delay + phase_mask))
-
-                    elif self.type == 'double_delay_pixelated':
-                        contrast_inst_sum = contrast_inst_diff = np.prod(contrast_inst)
-                        delay_sum, delay_diff = delay
-                        spectrum = spectrum / 4 * (
-                                1
-                                + 0.5 * contrast_inst_diff * np.cos(delay_diff + phase_mask)
-                                - 0.5 * contrast_inst_sum * np.cos(delay_sum + phase_mask)
-                        )
-
-                    elif self.type == 'triple_delay_pixelated':
-                        contrast_inst_sum = contrast_inst_diff = np.prod(contrast_inst)
-                        delay_2, delay_sum, delay_diff = delay
-                        root2 = np.sqrt(2)
-                        spectrum = spectrum / 4 * (
-                                1
-                                + root2 / 2 * contrast_inst[1] * np.cos(delay_2 + phase_mask)
-                                + root2 / 4 * contrast_inst_diff * np.cos(delay_diff + phase_mask)
-                                - root2 / 4 * contrast_inst_sum * np.cos(delay_sum + phase_mask)
-                        )
-                    else:
-                        raise NotImplementedError
+                    terms = self._get_interferogram_terms(spectrum.wavelength, x, y, phase_mask, dtype=spectrum.dtype)
+                    spectrum = spectrum / 4 * (1 + sum(a * np.cos(d + p) for a, d, p in terms))
                 else:
                     raise NotImplementedError
             except NotImplementedError:
+                # the hand-coded formulas are for unpolarised light only. Polarised input is an expected case, not an
+                # error, so fall back to the kernel / Mueller calculation below without a warning
                 failed = True
-                # TODO add warning here?
 
-        if self.type == 'mueller' or failed is True:
+        if inst_type == 'symbolic' or failed is True:
+            try:
+                spectrum = self._apply_interferogram_kernel(spectrum, x, y)
+                apply_polarisers = False
+                failed = False
+            except NotImplementedError:
+                failed = True
+
+        if inst_type == 'mueller' or failed is True:
             # full Mueller matrix calculation
             if 'stokes' not in spectrum.dims:
                 a0 = xr.zeros_like(spectrum)
                 spectrum = xr.combine_nested([spectrum, a0, a0, a0], concat_dim=('stokes',))
-            mueller_matrix_total = self.get_mueller_matrix(spectrum.wavelength, x, y)
-            spectrum = mueller_product(mueller_matrix_total, spectrum)
+            # propagate the Stokes vectors through the interferometer, one component at a time, instead of forming the
+            # total Mueller matrix at every pixel and wavelength
+            for step in self.plan.mueller_plan:
+                if isinstance(step, xr.DataArray):
+                    spectrum = mueller_product(step, spectrum)
+                else:
+                    inc_angle = self.get_inc_angle(x, y, step)
+                    azim_angle = self.get_azim_angle(x, y, step)
+                    spectrum = step.apply_mueller_matrix(spectrum, spectrum.wavelength, inc_angle, azim_angle)
             apply_polarisers = None
 
-        image = self.camera.capture(spectrum, apply_polarisers=apply_polarisers, clean=clean)
-        return image
+        return spectrum, apply_polarisers
+
+    def get_spectral_response(self, wavelength, x=None, y=None, stokes=False, precision=None):
+        """
+        Spectral response of each pixel: the intensity spectrum observed at the pixel per unit incident spectrum.
+
+        The interferogram is linear in the incident spectrum, so for a spectrum S on the same wavelength grid the
+        intensity spectrum observed at each pixel is the product of S and the response (summed over 'stokes', if
+        present).
+
+        :param wavelength: Wavelength(s) in m.
+        :type wavelength: np.ndarray, xr.DataArray
+        :param x: x position(s) on sensor plane in m. Defaults to the camera pixel positions.
+        :type x: xr.DataArray
+        :param y: y position(s) on sensor plane in m. Defaults to the camera pixel positions.
+        :type y: xr.DataArray
+        :param bool stokes: True to return the response to each of the four Stokes parameters of the incident light,
+            along dimension 'stokes'. False to return the response to unpolarised light only.
+        :param str precision: see Instrument.capture().
+        :return: (xr.DataArray) spectral response (dimensionless) with dimensions 'x', 'y', 'wavelength' and, if stokes
+            is True, 'stokes', followed by the dimensions of any array-valued component parameters.
+        """
+        if not isinstance(wavelength, xr.DataArray):
+            wavelength = xr.DataArray(wavelength, dims=('wavelength', ), coords=(wavelength, ), )
+        if x is None:
+            x = self.camera.x
+        if y is None:
+            y = self.camera.y
+
+        basis = xr.ones_like(wavelength, dtype=get_dtype(precision))
+        if stokes:
+            basis = basis * xr.DataArray(np.identity(4), dims=('stokes', 'stokes_in', ), )
+        spectrum, apply_polarisers = self.get_sensor_spectrum(basis, x, y)
+        response = self.camera.get_intensity(spectrum, apply_polarisers=apply_polarisers)
+        if stokes:
+            response = response.rename({'stokes_in': 'stokes'})
+
+        dims = tuple(dict.fromkeys(x.dims + y.dims)) + ('wavelength', ) + (('stokes', ) if stokes else ())
+        return response.broadcast_like(x).broadcast_like(y).transpose(*dims, ...)
+
+    def set_spectral_response(self, wavelength, stokes=False, precision=None):
+        """
+        Precompute and store the spectral response of each pixel on the given wavelength grid.
+
+        Subsequent captures of spectra on this wavelength grid reduce to a weighted sum over wavelength (and 'stokes')
+        of the product of the stored response and the spectrum, skipping the interferometer calculation entirely.
+        Spectra on any other wavelength grid are captured as usual. The stored response is dropped by
+        Instrument.compile(), so call again after modifying and recompiling the instrument.
+
+        :param wavelength: Wavelength(s) in m.
+        :type wavelength: np.ndarray, xr.DataArray
+        :param bool stokes: True to also store the response to polarised light, see
+            Instrument.get_spectral_response().
+        :param str precision: see Instrument.capture().
+        """
+        response = self.get_spectral_response(wavelength, stokes=stokes, precision=precision)
+        # fold in the trapezoidal quadrature weights
+        response = response * self.camera.get_quadrature_weights(response.wavelength).astype(response.dtype)
+        response.values.flags.writeable = False
+        self.spectral_response = response
+
+    def _check_spectral_response(self, spectrum):
+        """
+        Can the stored spectral response be used to capture the given spectrum?
+        """
+        response = self.spectral_response
+        if response is None or self.camera.type == 'rgb':
+            return False
+        if 'stokes' in spectrum.dims and 'stokes' not in response.dims:
+            return False
+        return np.array_equal(spectrum.wavelength.values, response.wavelength.values)
+
+    def _apply_spectral_response(self, spectrum, x, y, response=None):
+        """
+        Photon fluence hitting each pixel, by contraction of the spectrum with the given spectral response (quadrature
+        weights included). Defaults to the stored spectral response.
+        """
+        if response is None:
+            response = self.spectral_response
+        if response.sizes['x'] != x.size or response.sizes['y'] != y.size:
+            response = response.sel(x=x, y=y)
+
+        dims = ['wavelength', ]
+        if 'stokes' in spectrum.dims:
+            dims.append('stokes')
+        elif 'stokes' in response.dims:
+            response = response.isel(stokes=0, drop=True)
+        spectrum = spectrum.drop_vars('wavelength')
+        response = response.drop_vars('wavelength')
+
+        return xr.dot(response, spectrum, dims=dims).transpose('x', 'y', ...)
+
+    def _get_interferogram_terms(self, wavelength, x, y, phase_mask, dtype=np.float64, jacobian=False):
+        """
+        Interference terms for the hand-coded instrument types, from the compiled plan
+
+        :param wavelength: Wavelength in m, see Instrument.get_delay().
+        :param x: x position(s) on sensor plane in m.
+        :param y: y position(s) on sensor plane in m.
+        :param xr.DataArray phase_mask: pixelated phase mask, see Camera.get_pixelated_phase_mask().
+        :param dtype: NumPy dtype of the returned delays. For float32, the delays (including the phase mask) are wrapped
+            to [0, 2 pi) in double precision before rounding, see pycis.model.set_precision().
+        :param bool jacobian: If True, each term also carries a dict of the derivatives of its delay with respect to the
+            instrument parameters, see Instrument.get_jacobian(). Double precision only.
+        :return: list of (amplitude, delay, phase) tuples such that the spectrum observed at each pixel, for unpolarised
+            input spectrum S, is S / 4 * (1 + sum(amplitude * cos(delay + phase))). If jacobian is True, list of
+            (amplitude, delay, phase, jacobian) tuples.
+        """
+        if not self.plan.terms:
+            raise NotImplementedError
+
+        delays = []
+        derivs = []
+        for ret in self.plan.retarders:
+            if jacobian:
+                delay, deriv = self._get_delay_jacobian(wavelength, x, y, ret)
+                derivs.append(deriv)
+            else:
+                inc_angle = self.get_inc_angle(x, y, ret)
+                azim_angle = self.get_azim_angle(x, y, ret)
+                delay = ret.get_delay(wavelength, inc_angle, azim_angle)
+            delays.append(delay)
+
+        terms = []
+        for amplitude, combination, absolute, offset, pixelated in self.plan.terms:
+            (idx, _), *combination = combination
+            delay = delays[idx]
+            deriv = dict(derivs[idx]) if jacobian else {}
+            for idx, sign in combination:
+                delay = delay + delays[idx] if sign > 0 else delay - delays[idx]
+                if jacobian:
+                    for param, value in derivs[idx].items():
+                        deriv[param] = deriv.get(param, 0) + sign * value
+            if absolute:
+                deriv = {param: value * np.sign(delay) for param, value in deriv.items()}
+                delay = abs(delay)
+            if np.any(offset):
+                delay = delay + offset
+            if jacobian and pixelated:
+                # the polariser orientation offset turns with the interferometer
+                deriv['orientation'] = deriv.get('orientation', 0) - 2 * np.pi / 180
+            phase = phase_mask if pixelated else 0
+            if dtype == np.float32:
+                delay = np.remainder(delay + phase, 2 * np.pi).astype(np.float32)
+                phase = 0
+            terms.append((amplitude, delay, phase, deriv) if jacobian else (amplitude, delay, phase))
+        return terms
+
+    def _get_delay_jacobian(self, wavelength, x, y, component):
+        """
+        Delay of the given retarder at sensor positions x and y, with a dict of its derivatives with respect to the
+        retarder's parameters (labelled as in Instrument.get_jacobian()), including their effect on the ray geometry,
+        and with respect to wavelength (labelled 'wavelength').
+        """
+        inc_angle = self.get_inc_angle(x, y, component)
+        azim_angle = self.get_azim_angle(x, y, component)
+        delay, jac = component.get_delay(wavelength, inc_angle, azim_angle, jacobian=True)
+        if not jac:
+            return delay, {}
+
+        idx = [c is component for c in self.plan.interferometer].index(True)
+        deriv = {name + '_' + str(idx): jac[name] for name in ['thickness', 'cut_angle', ] if name in jac}
+        deriv['wavelength'] = jac['wavelength']
+
+        # tilt moves the centre (x0, y0) of the ray geometry on the sensor plane
+        f = self.optics[2]
+        x0 = f * np.tan(np.radians(component.tilt_x))
+        y0 = f * np.tan(np.radians(component.tilt_y))
+        dx, dy = x - x0, y - y0
+        r_2 = dx ** 2 + dy ** 2
+        centre = r_2 == 0
+        r_2 = xr.where(centre, 1, r_2)
+        r = np.sqrt(r_2)
+        # the ray angles are singular at the centre, but the delay is smooth there: moving the centre along x (y) then
+        # changes it at minus the rate of a ray tilting from normal incidence towards +x (+y), per unit focal length
+        orientation = np.radians(component.orientation)
+        for name, tilt, d_inc, d_azim, azim_angle_centre in [
+            ('tilt_x', component.tilt_x, - dx / r, dy / r_2, np.pi - orientation, ),
+            ('tilt_y', component.tilt_y, - dy / r, - dx / r_2, 3 * np.pi / 2 - orientation, ),
+        ]:
+            d_centre = f * np.pi / 180 / np.cos(np.radians(tilt)) ** 2
+            d_inc = d_inc * f / (f ** 2 + r_2)
+            d_delay = jac['inc_angle'] * d_inc + jac['azim_angle'] * d_azim
+            if np.any(centre):
+                _, jac_centre = component.get_delay(wavelength, 0, azim_angle_centre, jacobian=True)
+                d_delay = xr.where(centre, - jac_centre['inc_angle'] / f, d_delay)
+            deriv[name + '_' + str(idx)] = d_centre * d_delay
+
+        deriv['orientation'] = - np.pi / 180 * jac['azim_angle']
+        return delay, deriv
+
+    def _get_interferogram_plan(self):
+        """
+        Interference terms for the hand-coded instrument types, as (amplitude, combination, absolute, offset, pixelated)
+        tuples. The delay of each term is the sum of the retarder delays given by combination, a tuple of (retarder
+        index, sign) pairs, taken as an absolute value if absolute is True, plus a constant offset due to the polariser
+        orientation. If pixelated is True, the pixelated phase mask is added to the delay.
+
+        :return: (tuple) terms, empty if the instrument type is not hand-coded.
+        """
+        contrast_inst = [ret.contrast_inst for ret in self.retarders]
+        # contrast_inst may be array-valued (see pycis.model.Component)
+        contrast_inst_sum = contrast_inst_diff = reduce(operator.mul, contrast_inst, 1.)
+        root2 = np.sqrt(2)
+        delay_sum = (0, 1), (1, 1),
+        delay_diff = (0, 1), (1, -1),
+
+        if self.type == 'single_delay_linear':
+            terms = [(contrast_inst_sum, tuple((idx, 1) for idx in range(len(self.retarders))), False, 0, False), ]
+
+        elif self.type == 'double_delay_linear':
+            terms = [
+                (0.5 * contrast_inst_diff, delay_diff, True, 0, False),
+                (-0.5 * contrast_inst_sum, delay_sum, False, 0, False),
+            ]
+
+        elif self.type == 'triple_delay_linear':
+            terms = [
+                (root2 / 2 * contrast_inst[1], ((1, 1), ), False, 0, False),
+                (root2 / 4 * contrast_inst_diff, delay_diff, True, 0, False),
+                (-root2 / 4 * contrast_inst_sum, delay_sum, False, 0, False),
+            ]
+
+        elif self.type == 'quad_delay_linear':
+            terms = [
+                (0.5 * contrast_inst[0], ((0, 1), ), False, 0, False),
+                (0.5 * contrast_inst[1], ((1, 1), ), False, 0, False),
+                (0.25 * contrast_inst_diff, delay_diff, True, 0, False),
+                (-0.25 * contrast_inst_sum, delay_sum, False, 0, False),
+            ]
+
+        elif self.type == 'single_delay_pixelated':
+            orientation_delay = -2 * np.radians(self.polarisers[0].orientation)
+            terms = [(contrast_inst[0], ((0, 1), ), False, orientation_delay, True), ]
+
+        elif self.type == 'double_delay_pixelated':
+            orientation_delay = -2 * np.radians(self.polarisers[0].orientation - 45)
+            terms = [
+                (0.5 * contrast_inst_diff, delay_diff, True, orientation_delay, True),
+                (-0.5 * contrast_inst_sum, delay_sum, False, orientation_delay, True),
+            ]
+
+        elif self.type == 'triple_delay_pixelated':
+            orientation_delay = -2 * np.radians(self.polarisers[0].orientation - 22.5)
+            terms = [
+                (root2 / 2 * contrast_inst[1], ((1, 1), ), False, orientation_delay, True),
+                (root2 / 4 * contrast_inst_diff, delay_diff, True, orientation_delay, True),
+                (-root2 / 4 * contrast_inst_sum, delay_sum, False, orientation_delay, True),
+            ]
+        else:
+            terms = []
+
+        return tuple(terms)
+
+    def _align_to_sensor(self, spectrum):
+        """
+        Pixel centre positions (x, y) on the sensor plane at which to evaluate the given spectrum.
+
+        Positions are checked against the camera arithmetically (see Camera.check_pixel_position()) and snapped to the
+        camera's pixel centre positions, which carry the pixel indices as coordinates 'x_pixel' and 'y_pixel'.
+
+        :return: (spectrum, x, y), where the coordinates of spectrum are replaced by the snapped positions.
+        """
+        positions = []
+        for idx, (dim, position_camera) in enumerate(zip(['x', 'y', ], [self.camera.x, self.camera.y, ])):
+            if dim not in spectrum.dims:
+                positions.append(position_camera)
+                continue
+
+            position = spectrum[dim].values
+            pixel = self.camera.check_pixel_position(**{dim: position})[idx]
+            if not (pixel.size == position_camera.size and np.array_equal(pixel, np.arange(pixel.size))):
+                position_camera = position_camera.isel({dim: pixel})
+            if not np.array_equal(position, position_camera.values):
+                spectrum = spectrum.assign_coords({dim: position_camera.values})
+            positions.append(position_camera)
+
+        return (spectrum, ) + tuple(positions)
+
+    def _get_phase_mask(self, x, y):
+        """
+        Pixelated phase mask (see Camera.get_pixelated_phase_mask()) at sensor positions x and y, which are either pixel
+        centre positions with dimensions 'x' and 'y' or sample points with dimension 'point'.
+        """
+        if 'point' not in x.dims:
+            x_pixel, y_pixel = self.camera.check_pixel_position(x.values, y.values)
+            phase_mask = get_pixelated_phase_mask(self.camera.sensor_format).isel(x=x_pixel, y=y_pixel)
+            return phase_mask.assign_coords({'x': x, 'y': y, })
+
+        x_pixel, y_pixel = self.camera.get_pixel_index(x, y)
+        return get_pixelated_phase_mask((2, 2, )).isel(x=x_pixel % 2, y=y_pixel % 2)
+
+    def _apply_interferogram_kernel(self, spectrum, x, y):
+        """
+        Calculate the spectrum at the sensor (first Stokes parameter only, after the pixelated polariser array if present)
+        using the kernel generated by pycis.model.symbolic.get_interferogram_kernel().
+
+        :raises NotImplementedError: if no kernel can be generated for this instrument.
+        """
+        try:
+            from pycis.model.symbolic import get_interferogram_kernel
+        except ImportError:
+            raise NotImplementedError
+
+        stokes = 'stokes' in spectrum.dims
+        kernel = get_interferogram_kernel(self.plan.interferometer, self.camera.type, stokes=stokes)
+
+        if self.camera.type == 'monochrome_polarised':
+            m = self._get_phase_mask(x, y) * 2 / np.pi
+        else:
+            m = 0
+
+        phis = []
+        for ret in self.plan.retarders:
+            inc_angle = self.get_inc_angle(x, y, ret)
+            azim_angle = self.get_azim_angle(x, y, ret)
+            phis.append(ret.get_delay(spectrum.wavelength, inc_angle, azim_angle))
+
+        if stokes:
+            s = [spectrum.isel(stokes=ii, drop=True) for ii in range(4)]
+        else:
+            s = [spectrum, ]
+        spectrum = xr.apply_ufunc(kernel, *s, m, *phis, join='inner', dask='allowed', )
+        if s[0].dtype == np.float32:
+            spectrum = spectrum.astype(np.float32)
+        return spectrum
+
+    def _check_symbolic(self):
+        """
+        Can the interferogram be derived by pycis.model.symbolic?
+        """
+        if self.camera.type not in ['monochrome', 'monochrome_polarised']:
+            return False
+        # the symbolic interferogram is derived for fixed component orientations, transmissions and contrasts
+        for c in self.interferometer:
+            if isinstance(c, LinearPolariser):
+                params = [c.orientation, c.tx_1, c.tx_2, ]
+            elif isinstance(c, LinearRetarder):
+                params = [c.orientation, c.contrast_inst, ]
+            else:
+                return False
+            if any(np.ndim(param) != 0 for param in params):
+                return False
+        return True
 
     def get_fringe_frequency(self, wavelength):
         """
@@ -420,19 +1333,21 @@ class Instrument:
         :param float wavelength: Wavelength in m.
         :return: (tuple) x and y components of the fringe frequency in units m^-1 and in order (f_x, f_y).
         """
-        assert self.type != 'mueller'
+        plan = self.plan
+        assert plan.type not in ['mueller', 'symbolic'], \
+            'pycis: Instrument.get_fringe_frequency() needs a hand-coded instrument type, not ' + plan.type
 
-        if self.type == 'single_delay_linear':
+        if plan.type == 'single_delay_linear':
             # add contribution due to each crystal
             spatial_freq_x, spatial_freq_y = 0, 0
-            for crystal in self.retarders:
+            for crystal in plan.retarders:
 
                 sp_f_x, sp_f_y = crystal.get_fringe_frequency(wavelength, self.optics[2], )
                 spatial_freq_x += sp_f_x
                 spatial_freq_y += sp_f_y
 
-        elif self.type == 'triple_delay_pixelated':
-            crystal = self.retarders[0]
+        elif plan.type == 'triple_delay_pixelated':
+            crystal = plan.retarders[0]
             spatial_freq_x, spatial_freq_y = crystal.get_fringe_frequency(wavelength, self.optics[2], )
             # TODO and also the sum and difference terms?
 
@@ -447,7 +1362,8 @@ class Instrument:
         for idx, (typ, rel_or) in enumerate(zip(types, relative_orientations)):
             component = self.interferometer[idx]
             conditions_met.append(isinstance(component, typ))
-            conditions_met.append(isclose(component.orientation - self.interferometer[0].orientation, rel_or))
+            orientation = component.orientation - self.interferometer[0].orientation
+            conditions_met.append(np.all(np.isclose(orientation, rel_or)))
 
         return all(conditions_met)
 
@@ -457,4 +1373,81 @@ class Instrument:
         if condition_1 and condition_2:
             return True
         else:
-            return False
\ No newline at end of file
+            return False
+
+
+# the instrument of a worker process, see Instrument._get_signal_tiled()
+_tile_instrument = None
+
+
+def _init_tile_worker(num_threads, instrument):
+    """
+    Initialise a worker process for Instrument._get_signal_tiled().
+    """
+    global _tile_instrument
+    set_num_threads(num_threads)
+    _tile_instrument = instrument
+
+
+def _get_signal_tile(*args):
+    """
+    Instrument.get_signal() for one tile, in a worker process set up by _init_tile_worker().
+    """
+    return _tile_instrument.get_signal(*args)
+
+
+def _get_component_config(component):
+    """
+    Parameters of an interferometer component as plain Python scalars, for writing to a .yaml config file.
+    """
+    config = {}
+    for name, value in vars(component).items():
+        if isinstance(value, (xr.DataArray, np.ndarray, )):
+            raise ValueError('pycis: cannot write array-valued parameter \'' + name + '\' of ' +
+                             type(component).__name__ + ' to a config file')
+        config[name] = value.item() if isinstance(value, np.generic) else value
+    return config
+
+
+def _get_mueller_plan(interferometer):
+    """
+    Fold each run of consecutive constant components into a single 4x4 Mueller matrix, see Instrument.get_mueller_plan().
+    """
+    plan = []
+    for component in interferometer:
+        mat = component.get_mueller_matrix() if component.constant else None
+        if mat is None or mat.dims != MUELLER_DIMS:
+            plan.append(component)
+        elif plan and isinstance(plan[-1], xr.DataArray):
+            plan[-1] = mueller_product(mat, plan[-1])
+        else:
+            plan.append(mat)
+
+    for step in plan:
+        if isinstance(step, xr.DataArray):
+            step.values.flags.writeable = False
+    return tuple(plan)
+
+
+def _update_hash(h, value):
+    """
+    Update hashlib hash object h with the content of value, recursing into containers and array values.
+    """
+    if isinstance(value, xr.DataArray):
+        _update_hash(h, [value.dims, value.values, {k: v.values for k, v in value.coords.items()}])
+    elif isinstance(value, np.ndarray):
+        h.update(repr((value.shape, value.dtype.str)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        h.update(b'{')
+        for k in sorted(value, key=repr):
+            _update_hash(h, [k, value[k]])
+        h.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        h.update(b'[')
+        for v in value:
+            _update_hash(h, v)
+            h.update(b',')
+        h.update(b']')
+    else:
+        h.update(repr(value).encode())
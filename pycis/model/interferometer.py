@@ -1,59 +1,134 @@
 import numpy as np
 import xarray as xr
-from numba import vectorize, f8
+from numba import vectorize, f8, njit, prange
 from pycis.model import get_refractive_indices
-from math import radians
+
+
+MUELLER_DIMS = ('mueller_v', 'mueller_h', )
 
 
 def mueller_product(mat1, mat2):
     """
     Compute the product of a Mueller matrix with a Mueller matrix / Stokes vector
 
+    The Mueller dimensions are moved to the end, so that the stacks of matrices are multiplied as (..., 4, 4) arrays with
+    a single batched np.matmul call.
+
     :param xarray.DataArray mat1: Mueller matrix.
     :param xarray.DataArray mat2: Mueller matrix or Stokes vector.
     :return: (xarray.DataArray) mat1 @ mat2, a Mueller matrix or a Stokes vector, depending on the dimensions of mat2.
     """
 
     if 'mueller_v' in mat2.dims and 'mueller_h' in mat2.dims:
-        mat2_i = mat2.rename({'mueller_h': 'mueller_i', 'mueller_v': 'mueller_h'})
-        return mat1.dot(mat2_i, dims=('mueller_h', ), ).rename({'mueller_i': 'mueller_h'})
+        return xr.apply_ufunc(
+            np.matmul, mat1, mat2,
+            input_core_dims=[MUELLER_DIMS, MUELLER_DIMS, ],
+            output_core_dims=[MUELLER_DIMS, ],
+            join='inner',
+            dask='allowed',
+        )
 
     elif 'stokes' in mat2.dims:
-        mat2_i = mat2.rename({'stokes': 'mueller_h'})
-        return mat1.dot(mat2_i, dims=('mueller_h', ), ).rename({'mueller_v': 'stokes'})
+        mat2 = mat2.drop_vars('stokes', errors='ignore')
+        return xr.apply_ufunc(
+            _matmul_stokes, mat1, mat2,
+            input_core_dims=[MUELLER_DIMS, ('stokes', ), ],
+            output_core_dims=[('stokes', ), ],
+            join='inner',
+            dask='allowed',
+        )
 
     else:
         raise ValueError('pycis: arguments not understood')
 
 
+def _matmul_stokes(mat, stokes):
+    if stokes.dtype == np.float32:
+        mat = mat.astype(np.float32)
+    if mat.ndim == 2:
+        # a single matrix: one BLAS call
+        return stokes @ mat.T
+    return np.matmul(mat, stokes[..., np.newaxis])[..., 0]
+
+
 def rotation_matrix(angle):
     """
     Mueller matrix for frame rotation (anti-clockwise from x-axis)
 
-    :param float angle: rotation angle in degrees.
-    :return: (xr.DataArray) Frame rotation Mueller matrix.
+    :param angle: rotation angle(s) in degrees.
+    :type angle: float, xr.DataArray
+    :return: (xr.DataArray) Frame rotation Mueller matrix, with the dimensions of angle (if any) followed by the Mueller
+        dimensions.
+    """
+    if isinstance(angle, xr.DataArray):
+        return xr.DataArray(_rotation_matrix(angle.values), dims=angle.dims + MUELLER_DIMS, coords=angle.coords, )
+    return xr.DataArray(_rotation_matrix(angle), dims=MUELLER_DIMS, )
+
+
+def _rotation_matrix(angle):
+    angle2 = 2 * np.radians(angle)
+    c2 = np.cos(angle2)
+    s2 = np.sin(angle2)
+    mat = np.zeros(np.shape(angle2) + (4, 4, ))
+    mat[..., 0, 0] = mat[..., 3, 3] = 1
+    mat[..., 1, 1] = mat[..., 2, 2] = c2
+    mat[..., 1, 2] = s2
+    mat[..., 2, 1] = -s2
+    return mat
+
+
+def _as_parameter(value, name):
+    """
+    Component parameters (thickness, cut_angle, orientation, tilt_x, tilt_y, contrast_inst) are either scalars or arrays.
+    Array values describe a grid of instrument designs, all evaluated in one broadcast calculation: an xr.DataArray is
+    used as is, so that parameters sharing a dimension vary together, and any other 1-D array is given the dimension
+    (and coordinate) name.
     """
+    if isinstance(value, xr.DataArray) or np.ndim(value) == 0:
+        return value
+    value = np.asarray(value)
+    if value.ndim != 1:
+        raise ValueError('pycis: array-valued ' + name + ' must be 1-D or an xr.DataArray')
+    return xr.DataArray(value, dims=(name, ), coords={name: value, }, )
 
-    angle2 = 2 * radians(angle)
-    rot_mat = np.array([[1, 0, 0, 0],
-                        [0, np.cos(angle2), np.sin(angle2), 0],
-                        [0, -np.sin(angle2), np.cos(angle2), 0],
-                        [0, 0, 0, 1]])
-    return xr.DataArray(rot_mat, dims=('mueller_v', 'mueller_h'), )
+
+def _parameters_equal(value, other_value):
+    """
+    Compare two component parameters, either of which may be array-valued (see _as_parameter()).
+    """
+    if isinstance(value, xr.DataArray) or isinstance(other_value, xr.DataArray):
+        return isinstance(value, xr.DataArray) and isinstance(other_value, xr.DataArray) and value.identical(other_value)
+    if isinstance(value, np.ndarray) or isinstance(other_value, np.ndarray):
+        return np.array_equal(value, other_value)
+    return bool(value == other_value)
 
 
 class Component:
     """
     Base class for interferometer component
 
+    Subclasses whose Mueller matrix depends on neither wavelength nor ray geometry set constant = True, so that runs of
+    them can be pre-multiplied into a single 4x4 matrix by pycis.model.Instrument.
+
     """
+    constant = False
+
+    def apply_mueller_matrix(self, stokes, *args, **kwargs):
+        """
+        Apply the component Mueller matrix to the given Stokes vector(s)
+
+        :param xr.DataArray stokes: Stokes vector(s), with dimension 'stokes'.
+        :param args: passed to self.get_mueller_matrix()
+        :return: (xr.DataArray) Transformed Stokes vector(s).
+        """
+        return mueller_product(self.get_mueller_matrix(*args, **kwargs), stokes)
 
     def __eq__(self, other_component):
-        if type(self) == type(other_component) \
-                and list(vars(self).values()) == list(vars(other_component).values()):
-            return True
-        else:
+        if type(self) != type(other_component):
             return False
+        params, other_params = vars(self), vars(other_component)
+        return list(params) == list(other_params) \
+            and all(_parameters_equal(params[name], other_params[name]) for name in params)
 
 
 class OrientableComponent(Component):
@@ -63,7 +138,7 @@ class OrientableComponent(Component):
     """
     def __init__(self, orientation=0, **kwargs):
         super().__init__(**kwargs)
-        self.orientation = orientation
+        self.orientation = _as_parameter(orientation, 'orientation')
 
     def orient(self, matrix):
         """
@@ -73,8 +148,19 @@ class OrientableComponent(Component):
         :return: (xr.DataArray) Component Mueller matrix at the set orientation.
         """
 
-        matrix_i = mueller_product(matrix, rotation_matrix(self.orientation))
-        return mueller_product(rotation_matrix(-self.orientation), matrix_i)
+        if isinstance(self.orientation, xr.DataArray):
+            rot_1 = rotation_matrix(-self.orientation)
+            rot_2 = rotation_matrix(self.orientation)
+            return mueller_product(mueller_product(rot_1, matrix), rot_2)
+
+        rot_1 = _rotation_matrix(-self.orientation)
+        rot_2 = _rotation_matrix(self.orientation)
+        return xr.apply_ufunc(
+            lambda m: rot_1 @ m @ rot_2, matrix,
+            input_core_dims=[MUELLER_DIMS, ],
+            output_core_dims=[MUELLER_DIMS, ],
+            dask='allowed',
+        )
 
 
 class TiltableComponent(Component):
@@ -84,8 +170,8 @@ class TiltableComponent(Component):
     """
     def __init__(self, tilt_x=0, tilt_y=0, **kwargs):
         super().__init__(**kwargs)
-        self.tilt_x = tilt_x
-        self.tilt_y = tilt_y
+        self.tilt_x = _as_parameter(tilt_x, 'tilt_x')
+        self.tilt_y = _as_parameter(tilt_y, 'tilt_y')
 
 
 class Filter(TiltableComponent):
@@ -108,7 +194,7 @@ class Filter(TiltableComponent):
         # wl_shift = self.wl_centre * (np.sqrt(1 - (np.sin(inc_angle) / self.n) ** 2) - 1)
 
         tx = self.tx.interp(wavelength=wavelength)
-        return xr.DataArray(np.identity(4), dims=('mueller_v', 'mueller_h',)) * tx
+        return xr.DataArray(np.identity(4), dims=MUELLER_DIMS) * tx
 
 
 class LinearPolariser(OrientableComponent):
@@ -125,6 +211,8 @@ class LinearPolariser(OrientableComponent):
         Transmission, secondary (orthogonal) component. [0, 1] - default is 0.
 
     """
+    constant = True
+
     def __init__(self, tx_1=1, tx_2=0, **kwargs):
         super().__init__(**kwargs)
 
@@ -144,7 +232,7 @@ class LinearPolariser(OrientableComponent):
              [0, 0, 2 * self.tx_2 * self.tx_1, 0],
              [0, 0, 0, 2 * self.tx_2 * self.tx_1]]
 
-        return self.orient(1 / 2 * xr.DataArray(m, dims=('mueller_v', 'mueller_h'), ))
+        return self.orient(1 / 2 * xr.DataArray(m, dims=MUELLER_DIMS, ))
 
 
 class LinearRetarder(OrientableComponent, TiltableComponent):
@@ -153,7 +241,7 @@ class LinearRetarder(OrientableComponent, TiltableComponent):
     """
     def __init__(self, contrast_inst=1, **kwargs):
         super().__init__(**kwargs)
-        self.contrast_inst = contrast_inst
+        self.contrast_inst = _as_parameter(contrast_inst, 'contrast_inst')
 
     def get_mueller_matrix(self, *args, **kwargs):
         """
@@ -161,18 +249,80 @@ class LinearRetarder(OrientableComponent, TiltableComponent):
         """
 
         delay = self.get_delay(*args, **kwargs)
+        if not isinstance(delay, xr.DataArray):
+            delay = xr.DataArray(delay)
+        orientation, contrast_inst = self.orientation, self.contrast_inst
+        if isinstance(orientation, xr.DataArray) or isinstance(contrast_inst, xr.DataArray):
+            delay, orientation, contrast_inst = xr.broadcast(delay, xr.DataArray(orientation),
+                                                             xr.DataArray(contrast_inst))
+            orientation = orientation.transpose(*delay.dims).values
+            contrast_inst = contrast_inst.transpose(*delay.dims).values
+
+        # the rotated retarder matrix is written down directly, rather than computed as R(-rho) @ M @ R(rho)
+        m11, m12, m13, m22, m23, m31, m32, m33 = self._get_matrix_elements(delay.values, orientation, contrast_inst)
+        m = np.zeros(delay.shape + (4, 4, ))
+        m[..., 0, 0] = 1
+        m[..., 1, 1] = m11
+        m[..., 1, 2] = m[..., 2, 1] = m12
+        m[..., 1, 3] = m13
+        m[..., 2, 2] = m22
+        m[..., 2, 3] = m23
+        m[..., 3, 1] = m31
+        m[..., 3, 2] = m32
+        m[..., 3, 3] = m33
+
+        return xr.DataArray(m, dims=delay.dims + MUELLER_DIMS, coords=delay.coords, )
+
+    def apply_mueller_matrix(self, stokes, *args, **kwargs):
+        """
+        Apply the retarder Mueller matrix to the given Stokes vector(s), without forming the Mueller matrix
 
-        m1 = xr.ones_like(delay)
-        m0 = xr.zeros_like(delay)
-        cc = self.contrast_inst * np.cos(delay)
-        cs = self.contrast_inst * np.sin(delay)
-
-        m = [[m1,  m0,  m0,  m0],
-             [m0,  m1,  m0,  m0],
-             [m0,  m0,  cc,  cs],
-             [m0,  m0, -cs,  cc]]
+        :param xr.DataArray stokes: Stokes vector(s), with dimension 'stokes'.
+        :param args: passed to self.get_delay()
+        :return: (xr.DataArray) Transformed Stokes vector(s).
+        """
+        delay = self.get_delay(*args, **kwargs)
 
-        return self.orient(xr.combine_nested(m, concat_dim=('mueller_v', 'mueller_h', ), ))
+        def fn(d, o, c, s):
+            if s.dtype == np.float32:
+                # wrap in double precision before rounding, see pycis.model.set_precision()
+                d = np.remainder(d, 2 * np.pi).astype(np.float32)
+            m11, m12, m13, m22, m23, m31, m32, m33 = self._get_matrix_elements(d, o, c)
+            s0, s1, s2, s3 = [s[..., ii] for ii in range(4)]
+            out = np.empty(np.broadcast(d, o, c, s0).shape + (4, ), dtype=np.result_type(d, s))
+            out[..., 0] = s0
+            out[..., 1] = m11 * s1 + m12 * s2 + m13 * s3
+            out[..., 2] = m12 * s1 + m22 * s2 + m23 * s3
+            out[..., 3] = m31 * s1 + m32 * s2 + m33 * s3
+            return out
+
+        return xr.apply_ufunc(
+            fn, delay, self.orientation, self.contrast_inst, stokes.drop_vars('stokes', errors='ignore'),
+            input_core_dims=[(), (), (), ('stokes', ), ],
+            output_core_dims=[('stokes', ), ],
+            join='inner',
+        )
+
+    def _get_matrix_elements(self, delay, orientation, contrast_inst):
+        """
+        Non-trivial elements of the Mueller matrix R(-rho) @ M @ R(rho) for retarder orientation rho (in degrees) and
+        instrument contrast contrast_inst, each an array broadcastable against delay.
+        """
+        cc = contrast_inst * np.cos(delay)
+        cs = contrast_inst * np.sin(delay)
+        angle2 = 2 * np.radians(orientation)
+        c2 = np.cos(angle2)
+        s2 = np.sin(angle2)
+
+        m11 = c2 ** 2 + s2 ** 2 * cc
+        m12 = c2 * s2 * (1 - cc)
+        m13 = - s2 * cs
+        m22 = s2 ** 2 + c2 ** 2 * cc
+        m23 = c2 * cs
+        m31 = s2 * cs
+        m32 = - c2 * cs
+        m33 = cc
+        return m11, m12, m13, m22, m23, m31, m32, m33
 
     def get_delay(self, *args, **kwargs):
         raise NotImplementedError
@@ -213,8 +363,8 @@ class UniaxialCrystal(LinearRetarder):
                  **kwargs):
         super().__init__(**kwargs)
 
-        self.thickness = thickness
-        self.cut_angle = cut_angle
+        self.thickness = _as_parameter(thickness, 'thickness')
+        self.cut_angle = _as_parameter(cut_angle, 'cut_angle')
         self.material = material
         self.sellmeier_coefs_source = sellmeier_coefs_source
         self.sellmeier_coefs = sellmeier_coefs
@@ -222,7 +372,7 @@ class UniaxialCrystal(LinearRetarder):
         if all([attr is not None for attr in [self.sellmeier_coefs_source, self.sellmeier_coefs]]):
             raise ValueError('pycis: arguments not understood')
 
-    def get_delay(self, wavelength, inc_angle, azim_angle):
+    def get_delay(self, wavelength, inc_angle, azim_angle, jacobian=False):
         """
         Calculate path delay (in radians) imparted by the retarder
 
@@ -235,19 +385,60 @@ class UniaxialCrystal(LinearRetarder):
         :param azim_angle: Ray azimuthal angle(s) in radians.
         :type azim_angle: float, xarray.DataArray
 
-        :return: (float, xarray.DataArray) Imparted delay in radians.
+        :param bool jacobian: Also return the exact partial derivatives of the delay, see self.get_delay_jacobian().
+
+        :return: (float, xarray.DataArray) Imparted delay in radians. If jacobian is True, (delay, jacobian).
 
         """
+        if jacobian:
+            return self.get_delay_jacobian(wavelength, inc_angle, azim_angle)
 
         kwargs = {
             'sellmeier_coefs_source': self.sellmeier_coefs_source,
             'sellmeier_coefs': self.sellmeier_coefs,
         }
         ne, no = get_refractive_indices(wavelength, self.material, **kwargs)
-        args = [wavelength, inc_angle, azim_angle, ne, no, radians(self.cut_angle), self.thickness, ]
-        # return xr.apply_ufunc(_calc_delay_uniaxial_crystal, *args, dask='allowed', )
-        # return xr.apply_ufunc(_calc_delay_uniaxial_crystal, *args,)
-        return _calc_delay_uniaxial_crystal(*args)
+        args = [wavelength, inc_angle, azim_angle, ne, no, np.radians(self.cut_angle), ]
+        if np.ndim(self.thickness) == 0:
+            delay = _calc_delay_uniaxial_crystal_compiled(*args, self.thickness)
+        else:
+            # the delay is proportional to thickness, so a thickness sweep costs a single evaluation of the kernel
+            delay = _calc_delay_uniaxial_crystal_compiled(*args, 1.)
+            if delay is not None:
+                delay = delay * self.thickness
+        if delay is None:
+            delay = _calc_delay_uniaxial_crystal(*args, self.thickness)
+        return delay
+
+    def get_delay_jacobian(self, wavelength, inc_angle, azim_angle):
+        """
+        Calculate the path delay imparted by the retarder, together with its exact partial derivatives with respect to
+        the ray geometry, the wavelength and the crystal parameters, all in the same vectorised calculation
+
+        :param wavelength: Wavelength in m.
+        :type wavelength: float, xarray.DataArray
+
+        :param inc_angle: Ray incidence angle(s) in radians.
+        :type inc_angle: float, xarray.DataArray
+
+        :param azim_angle: Ray azimuthal angle(s) in radians.
+        :type azim_angle: float, xarray.DataArray
+
+        :return: (delay, jacobian) where delay is in radians and jacobian is a dict of its partial derivatives with
+            respect to 'wavelength' (rad / m), 'inc_angle' and 'azim_angle' (rad / rad), 'thickness' (rad / m) and
+            'cut_angle' (rad / degree). The derivative with respect to the crystal orientation (rad / degree) follows
+            from azim_angle: -pi / 180 * jacobian['azim_angle'].
+        """
+        kwargs = {
+            'sellmeier_coefs_source': self.sellmeier_coefs_source,
+            'sellmeier_coefs': self.sellmeier_coefs,
+        }
+        ne, no, dne, dno = get_refractive_indices(wavelength, self.material, deriv=True, **kwargs)
+        delay, jacobian = _calc_delay_uniaxial_crystal_jacobian(
+            wavelength, inc_angle, azim_angle, ne, no, dne, dno, np.radians(self.cut_angle), self.thickness,
+        )
+        jacobian['cut_angle'] = jacobian['cut_angle'] * np.pi / 180
+        return delay, jacobian
 
     def get_fringe_frequency(self, wavelength, focal_length):
         """
@@ -265,8 +456,8 @@ class UniaxialCrystal(LinearRetarder):
         ne, no = get_refractive_indices(wavelength, self.material, **kwargs)
 
         # from first-order approx. of the Veiras formula.
-        factor = (no ** 2 - ne ** 2) * np.sin(radians(self.cut_angle)) * np.cos(radians(self.cut_angle)) / \
-                 (ne ** 2 * np.sin(radians(self.cut_angle)) ** 2 + no ** 2 * np.cos(radians(self.cut_angle)) ** 2)
+        factor = (no ** 2 - ne ** 2) * np.sin(np.radians(self.cut_angle)) * np.cos(np.radians(self.cut_angle)) / \
+                 (ne ** 2 * np.sin(np.radians(self.cut_angle)) ** 2 + no ** 2 * np.cos(np.radians(self.cut_angle)) ** 2)
         freq = self.thickness / (wavelength * focal_length) * factor
 
         freq_x = freq * np.cos(self.orientation)
@@ -312,7 +503,7 @@ class Waveplate(UniaxialCrystal):
         else:
             super().__init__(**kwargs)
 
-    def get_delay(self, wavelength, inc_angle, azim_angle):
+    def get_delay(self, wavelength, inc_angle, azim_angle, jacobian=False):
         """
         Calculate path delay (in radians) imparted by the retarder
 
@@ -325,9 +516,14 @@ class Waveplate(UniaxialCrystal):
         :param azim_angle: Ray azimuthal angle(s) in radians.
         :type azim_angle: float, xarray.DataArray
 
-        :return: (float, xarray.DataArray) Imparted delay in radians.
+        :param bool jacobian: Also return the exact partial derivatives of the delay, see
+            UniaxialCrystal.get_delay_jacobian().
+
+        :return: (float, xarray.DataArray) Imparted delay in radians. If jacobian is True, (delay, jacobian).
 
         """
+        if jacobian:
+            return self.get_delay_jacobian(wavelength, inc_angle, azim_angle)
 
         kwargs = {
             'sellmeier_coefs_source': self.sellmeier_coefs_source,
@@ -337,6 +533,14 @@ class Waveplate(UniaxialCrystal):
         args = [wavelength, inc_angle, azim_angle, ne, no, self.thickness, ]
         return xr.apply_ufunc(_calc_delay_waveplate, *args, dask='allowed', )
 
+    def get_delay_jacobian(self, wavelength, inc_angle, azim_angle):
+        """
+        As UniaxialCrystal.get_delay_jacobian(), but without 'cut_angle', which the waveplate delay does not depend on.
+        """
+        delay, jacobian = super().get_delay_jacobian(wavelength, inc_angle, azim_angle)
+        jacobian.pop('cut_angle')
+        return delay, jacobian
+
     def get_fringe_frequency(self, *args, **kwargs):
         # no phase change across sensor plane
         return 0, 0
@@ -365,13 +569,13 @@ class SavartPlate(LinearRetarder):
                  **kwargs):
         super().__init__(**kwargs)
 
-        self.thickness = thickness
+        self.thickness = _as_parameter(thickness, 'thickness')
         self.material = material
         self.sellmeier_coefs_source = sellmeier_coefs_source
         self.sellmeier_coefs = sellmeier_coefs
         self.mode = mode
 
-    def get_delay(self, wavelength, inc_angle, azim_angle):
+    def get_delay(self, wavelength, inc_angle, azim_angle, jacobian=False):
         """
         Calculate path delay (in radians) imparted by the retarder
 
@@ -381,59 +585,122 @@ class SavartPlate(LinearRetarder):
         :type inc_angle: float, xarray.DataArray
         :param azim_angle: Ray azimuthal angle(s) in radians.
         :type azim_angle: float, xarray.DataArray
-        :return: (float, xarray.DataArray) Imparted delay in radians.
+        :param bool jacobian: Also return the exact partial derivatives of the delay, see self.get_delay_jacobian().
+        :return: (float, xarray.DataArray) Imparted delay in radians. If jacobian is True, (delay, jacobian).
         """
-
-        kwargs = {
-            'sellmeier_coefs_source': self.sellmeier_coefs_source,
-            'sellmeier_coefs': self.sellmeier_coefs,
-        }
-        ne, no = get_refractive_indices(wavelength, self.material, **kwargs)
+        if jacobian:
+            return self.get_delay_jacobian(wavelength, inc_angle, azim_angle)
 
         if self.mode == 'francon':
+            delay, _ = self._get_delay_francon(wavelength, inc_angle, azim_angle)
 
-            # Delay eqn. from Francon and Mallick's 'Polarization Interferometers' textbook.
-            a = 1 / ne
-            b = 1 / no
-
-            c_azim_angle = np.cos(azim_angle)
-            s_azim_angle = np.sin(azim_angle)
-            s_inc_angle = np.sin(inc_angle)
+        elif self.mode == 'veiras':
+            delay = sum(sign * crystal.get_delay(wavelength, inc_angle, azim_angle - shift)
+                        for sign, crystal, shift in self._get_crystals_veiras())
 
-            term_1 = ((a ** 2 - b ** 2) / (a ** 2 + b ** 2)) * (c_azim_angle + s_azim_angle) * s_inc_angle
+        else:
+            raise Exception('invalid SavartPlate.mode')
 
-            term_2 = ((a ** 2 - b ** 2) / (a ** 2 + b ** 2) ** (3 / 2)) * ((a ** 2) / np.sqrt(2)) * \
-                     (c_azim_angle ** 2 - s_azim_angle ** 2) * s_inc_angle ** 2
+        return delay
 
-            # minus sign here makes the OPD calculation consistent with Veiras' definition
-            delay = 2 * np.pi * - (self.thickness / (2 * wavelength)) * (term_1 + term_2)
+    def get_delay_jacobian(self, wavelength, inc_angle, azim_angle):
+        """
+        Calculate the path delay imparted by the retarder, together with its exact partial derivatives, see
+        UniaxialCrystal.get_delay_jacobian(). There is no 'cut_angle'.
+        """
+        if self.mode == 'francon':
+            return self._get_delay_francon(wavelength, inc_angle, azim_angle, jacobian=True)
 
         elif self.mode == 'veiras':
-            # explicitly model plate as the combination of two uniaxial crystals
-
-            or1 = self.orientation
-            or2 = self.orientation - 90
-
-            azim_angle1 = azim_angle
-            azim_angle2 = azim_angle - np.pi / 2
-            t = self.thickness / 2
+            delay = 0
+            jacobian = {}
+            for sign, crystal, shift in self._get_crystals_veiras():
+                delay_crystal, jacobian_crystal = crystal.get_delay_jacobian(wavelength, inc_angle, azim_angle - shift)
+                delay = delay + sign * delay_crystal
+                # each crystal is half of the plate
+                jacobian_crystal['thickness'] = jacobian_crystal['thickness'] / 2
+                jacobian_crystal.pop('cut_angle')
+                for name, deriv in jacobian_crystal.items():
+                    jacobian[name] = jacobian.get(name, 0) + sign * deriv
+            return delay, jacobian
 
-            kwargs = {
-                'thickness': t,
-                'material': self.material,
-                'sellmeier_coefs': self.sellmeier_coefs,
-                'sellmeier_coefs_source': self.sellmeier_coefs_source,
-            }
-            crystal_1 = UniaxialCrystal(orientation=or1, cut_angle=-45, **kwargs, )
-            crystal_2 = UniaxialCrystal(orientation=or2, cut_angle=45, **kwargs, )
+        else:
+            raise Exception('invalid SavartPlate.mode')
 
-            delay = crystal_1.get_delay(wavelength, inc_angle, azim_angle1, ) - \
-                    crystal_2.get_delay(wavelength, inc_angle, azim_angle2, )
+    def _get_delay_francon(self, wavelength, inc_angle, azim_angle, jacobian=False):
+        """
+        Delay eqn. from Francon and Mallick's 'Polarization Interferometers' textbook, with its partial derivatives if
+        jacobian is True.
 
+        :return: (delay, jacobian), with jacobian None if not requested.
+        """
+        kwargs = {
+            'sellmeier_coefs_source': self.sellmeier_coefs_source,
+            'sellmeier_coefs': self.sellmeier_coefs,
+        }
+        if jacobian:
+            ne, no, dne, dno = get_refractive_indices(wavelength, self.material, deriv=True, **kwargs)
         else:
-            raise Exception('invalid SavartPlate.mode')
+            ne, no = get_refractive_indices(wavelength, self.material, **kwargs)
+
+        a = 1 / ne
+        b = 1 / no
+
+        c_azim_angle = np.cos(azim_angle)
+        s_azim_angle = np.sin(azim_angle)
+        s_inc_angle = np.sin(inc_angle)
+
+        # opd = coef_1 * geom_1 + coef_2 * geom_2
+        coef_1 = (a ** 2 - b ** 2) / (a ** 2 + b ** 2)
+        coef_2 = ((a ** 2 - b ** 2) / (a ** 2 + b ** 2) ** (3 / 2)) * ((a ** 2) / np.sqrt(2))
+        geom_1 = (c_azim_angle + s_azim_angle) * s_inc_angle
+        geom_2 = (c_azim_angle ** 2 - s_azim_angle ** 2) * s_inc_angle ** 2
+
+        # minus sign here makes the OPD calculation consistent with Veiras' definition
+        opd = coef_1 * geom_1 + coef_2 * geom_2
+        factor = - np.pi * self.thickness / wavelength
+        delay = factor * opd
+        if not jacobian:
+            return delay, None
+
+        # derivatives of the coefficients with respect to p = a ** 2 and q = b ** 2
+        p, q = a ** 2, b ** 2
+        s = p + q
+        d_coef_1_p = 2 * q / s ** 2
+        d_coef_1_q = - 2 * p / s ** 2
+        d_coef_2_p = (2 * p - q) / (np.sqrt(2) * s ** (3 / 2)) - 3 * (p - q) * p / (2 * np.sqrt(2) * s ** (5 / 2))
+        d_coef_2_q = - p / (np.sqrt(2) * s ** (3 / 2)) - 3 * (p - q) * p / (2 * np.sqrt(2) * s ** (5 / 2))
+        d_p = - 2 * dne / ne ** 3
+        d_q = - 2 * dno / no ** 3
+        d_opd_d_wavelength = (d_coef_1_p * d_p + d_coef_1_q * d_q) * geom_1 + \
+            (d_coef_2_p * d_p + d_coef_2_q * d_q) * geom_2
+
+        c_inc_angle = np.cos(inc_angle)
+        jacobian = {
+            'wavelength': factor * d_opd_d_wavelength - delay / wavelength,
+            'inc_angle': factor * (coef_1 * (c_azim_angle + s_azim_angle) * c_inc_angle +
+                                   coef_2 * 2 * (c_azim_angle ** 2 - s_azim_angle ** 2) * s_inc_angle * c_inc_angle),
+            'azim_angle': factor * (coef_1 * (c_azim_angle - s_azim_angle) * s_inc_angle -
+                                    coef_2 * 4 * s_azim_angle * c_azim_angle * s_inc_angle ** 2),
+            'thickness': - np.pi * opd / wavelength,
+        }
+        return delay, jacobian
 
-        return delay
+    def _get_crystals_veiras(self):
+        """
+        Explicitly model plate as the combination of two uniaxial crystals.
+
+        :return: list of (sign, crystal, azimuthal angle shift in radians) tuples, one per crystal.
+        """
+        kwargs = {
+            'thickness': self.thickness / 2,
+            'material': self.material,
+            'sellmeier_coefs': self.sellmeier_coefs,
+            'sellmeier_coefs_source': self.sellmeier_coefs_source,
+        }
+        crystal_1 = UniaxialCrystal(orientation=self.orientation, cut_angle=-45, **kwargs, )
+        crystal_2 = UniaxialCrystal(orientation=self.orientation - 90, cut_angle=45, **kwargs, )
+        return [(1, crystal_1, 0, ), (-1, crystal_2, np.pi / 2, ), ]
 
     def get_fringe_frequency(self, *args, **kwargs):
         # TODO!
@@ -447,11 +714,16 @@ class IdealWaveplate(LinearRetarder):
     :param float orientation: Orientation of component fast axis in degrees, relative to the x-axis.
     :param float delay: Imparted delay in radians.
     """
+    constant = True
+
     def __init__(self, delay, **kwargs):
         super().__init__(**kwargs)
         self.delay = delay
 
-    def get_delay(self, *args, **kwargs):
+    def get_delay(self, *args, jacobian=False, **kwargs):
+        if jacobian:
+            # the delay depends on none of the parameters
+            return xr.DataArray(self.delay), {}
         return xr.DataArray(self.delay)
 
     def get_fringe_frequency(self, *args, **kwargs):
@@ -481,7 +753,6 @@ class HalfWaveplate(IdealWaveplate):
         super().__init__(delay, **kwargs)
 
 
-# @vectorize([f8(f8, f8, f8, f8, f8, f8, f8), ], nopython=True, fastmath=True, cache=True, )
 def _calc_delay_uniaxial_crystal(wavelength, inc_angle, azim_angle, ne, no, cut_angle, thickness, ):
     s_inc_angle = np.sin(inc_angle)
     s_inc_angle_2 = s_inc_angle ** 2
@@ -501,6 +772,156 @@ def _calc_delay_uniaxial_crystal(wavelength, inc_angle, azim_angle, ne, no, cut_
     return 2 * np.pi * (thickness / wavelength) * (term_1 + term_2 + term_3)
 
 
+def _calc_delay_uniaxial_crystal_jacobian(wavelength, inc_angle, azim_angle, ne, no, dne, dno, cut_angle, thickness, ):
+    """
+    Same formula as _calc_delay_uniaxial_crystal, together with its exact partial derivatives. dne and dno are the
+    derivatives of the refractive indices with respect to wavelength.
+
+    :return: (delay, jacobian) where jacobian is a dict of the partial derivatives of the delay with respect to
+        'wavelength' (rad / m), 'inc_angle' and 'azim_angle' (rad / rad), 'thickness' (rad / m) and 'cut_angle'
+        (rad / rad).
+    """
+    s_inc_angle = np.sin(inc_angle)
+    s_inc_angle_2 = s_inc_angle ** 2
+    c_azim_angle = np.cos(azim_angle)
+    s_azim_angle = np.sin(azim_angle)
+    s_cut_angle = np.sin(cut_angle)
+    c_cut_angle = np.cos(cut_angle)
+    s_cut_angle_2 = s_cut_angle ** 2
+    c_cut_angle_2 = c_cut_angle ** 2
+    ne_2 = ne ** 2
+    no_2 = no ** 2
+
+    # delay = 2 pi * (thickness / wavelength) * (term_1 + term_2 + term_3), written in terms of:
+    denom = ne_2 * s_cut_angle_2 + no_2 * c_cut_angle_2
+    geom = s_cut_angle * c_cut_angle * c_azim_angle * s_inc_angle
+    b = ne_2 - (ne_2 - no_2) * c_cut_angle_2 * s_azim_angle ** 2
+    root_q = np.sqrt(ne_2 * denom - b * s_inc_angle_2)
+
+    term_1 = np.sqrt(no_2 - s_inc_angle_2)
+    term_2 = (no_2 - ne_2) * geom / denom
+    term_3 = - no * root_q / denom
+    opd = term_1 + term_2 + term_3
+    factor = 2 * np.pi * thickness / wavelength
+    delay = factor * opd
+
+    def d_term_3(d_denom, d_q):
+        return - no * (d_q / (2 * root_q * denom) - root_q * d_denom / denom ** 2)
+
+    # inc_angle
+    d_opd_d_s = - s_inc_angle / term_1 + (no_2 - ne_2) * s_cut_angle * c_cut_angle * c_azim_angle / denom + \
+        no * b * s_inc_angle / (denom * root_q)
+    d_inc_angle = factor * d_opd_d_s * np.cos(inc_angle)
+
+    # azim_angle
+    d_b = - 2 * (ne_2 - no_2) * c_cut_angle_2 * s_azim_angle * c_azim_angle
+    d_opd = - (no_2 - ne_2) * s_cut_angle * c_cut_angle * s_azim_angle * s_inc_angle / denom + \
+        d_term_3(0, - s_inc_angle_2 * d_b)
+    d_azim_angle = factor * d_opd
+
+    # cut_angle
+    d_denom = 2 * s_cut_angle * c_cut_angle * (ne_2 - no_2)
+    d_b = 2 * (ne_2 - no_2) * c_cut_angle * s_cut_angle * s_azim_angle ** 2
+    d_opd = (no_2 - ne_2) * c_azim_angle * s_inc_angle * \
+        ((c_cut_angle_2 - s_cut_angle_2) * denom - s_cut_angle * c_cut_angle * d_denom) / denom ** 2 + \
+        d_term_3(d_denom, ne_2 * d_denom - s_inc_angle_2 * d_b)
+    d_cut_angle = factor * d_opd
+
+    # wavelength, through the explicit dependence and through the dispersion of ne and no
+    d_denom = 2 * ne * s_cut_angle_2
+    d_b = 2 * ne * (1 - c_cut_angle_2 * s_azim_angle ** 2)
+    d_opd_d_ne = geom * (- 2 * ne * denom - (no_2 - ne_2) * d_denom) / denom ** 2 + \
+        d_term_3(d_denom, 2 * ne * denom + ne_2 * d_denom - s_inc_angle_2 * d_b)
+    d_denom = 2 * no * c_cut_angle_2
+    d_b = 2 * no * c_cut_angle_2 * s_azim_angle ** 2
+    d_opd_d_no = no / term_1 + geom * (2 * no * denom - (no_2 - ne_2) * d_denom) / denom ** 2 - root_q / denom + \
+        d_term_3(d_denom, ne_2 * d_denom - s_inc_angle_2 * d_b)
+    d_wavelength = factor * (d_opd_d_ne * dne + d_opd_d_no * dno) - delay / wavelength
+
+    jacobian = {
+        'wavelength': d_wavelength,
+        'inc_angle': d_inc_angle,
+        'azim_angle': d_azim_angle,
+        'thickness': 2 * np.pi * opd / wavelength,
+        'cut_angle': d_cut_angle,
+    }
+    return delay, jacobian
+
+
+def _calc_delay_uniaxial_crystal_compiled(wavelength, inc_angle, azim_angle, ne, no, cut_angle, thickness):
+    """
+    Evaluate _calc_delay_uniaxial_crystal using the compiled, multithreaded kernel
+
+    The ray geometry (inc_angle, azim_angle) is given as DataArrays without a 'wavelength' dimension and the
+    wavelength-dependent quantities (wavelength, ne, no) as scalars or as 1-D DataArrays with dimension 'wavelength'.
+    The kernel writes the delay straight into a single output array, so no intermediate (x, y, wavelength) cubes are
+    created.
+
+    :return: (xr.DataArray) Imparted delay in radians with dimensions inc_angle.dims + ('wavelength', ), or None if
+        the arguments are not of a form the kernel handles, in which case use _calc_delay_uniaxial_crystal.
+    """
+    if not (isinstance(inc_angle, xr.DataArray) and isinstance(azim_angle, xr.DataArray)):
+        return None
+    if not all(np.ndim(arg) == 0 for arg in [cut_angle, thickness]):
+        return None
+    if 'wavelength' in inc_angle.dims or 'wavelength' in azim_angle.dims:
+        return None
+
+    if isinstance(wavelength, xr.DataArray) and wavelength.dims == ('wavelength', ):
+        scalar_wavelength = False
+    elif np.ndim(wavelength) == 0:
+        scalar_wavelength = True
+    else:
+        return None
+
+    inc_angle, azim_angle = xr.broadcast(inc_angle, azim_angle)
+    azim_angle = azim_angle.transpose(*inc_angle.dims)
+    wl_1d, ne_1d, no_1d = [np.atleast_1d(np.asarray(arg, dtype=np.float64)) for arg in [wavelength, ne, no]]
+    out = np.empty(inc_angle.shape + (wl_1d.size, ))
+
+    _delay_uniaxial_crystal_kernel(
+        wl_1d, np.ravel(inc_angle.values), np.ravel(azim_angle.values), ne_1d, no_1d, float(cut_angle),
+        float(thickness), out.reshape(-1, wl_1d.size),
+    )
+
+    coords = dict(inc_angle.coords)
+    coords.update(azim_angle.coords)
+    if scalar_wavelength:
+        return xr.DataArray(out.reshape(inc_angle.shape), dims=inc_angle.dims, coords=coords, )
+    coords.update(wavelength.coords)
+    return xr.DataArray(out, dims=inc_angle.dims + ('wavelength', ), coords=coords, )
+
+
+@njit(parallel=True, nogil=True, cache=True, )
+def _delay_uniaxial_crystal_kernel(wavelength, inc_angle, azim_angle, ne, no, cut_angle, thickness, out):
+    """
+    Same formula as _calc_delay_uniaxial_crystal. wavelength, ne and no have shape (n_wavelength, ), inc_angle and
+    azim_angle have shape (n_ray, ) and out has shape (n_ray, n_wavelength).
+    """
+    s_cut_angle = np.sin(cut_angle)
+    c_cut_angle = np.cos(cut_angle)
+    s_cut_angle_2 = s_cut_angle ** 2
+    c_cut_angle_2 = c_cut_angle ** 2
+
+    for ii in prange(inc_angle.size):
+        s_inc_angle = np.sin(inc_angle[ii])
+        s_inc_angle_2 = s_inc_angle ** 2
+        c_azim_angle = np.cos(azim_angle[ii])
+        s_azim_angle_2 = np.sin(azim_angle[ii]) ** 2
+
+        for jj in range(wavelength.size):
+            ne_2 = ne[jj] ** 2
+            no_2 = no[jj] ** 2
+            denom = ne_2 * s_cut_angle_2 + no_2 * c_cut_angle_2
+
+            term_1 = np.sqrt(no_2 - s_inc_angle_2)
+            term_2 = (no_2 - ne_2) * (s_cut_angle * c_cut_angle * c_azim_angle * s_inc_angle) / denom
+            term_3 = - no[jj] * np.sqrt(
+                (ne_2 * denom) - ((ne_2 - (ne_2 - no_2) * c_cut_angle_2 * s_azim_angle_2) * s_inc_angle_2)) / denom
+
+            out[ii, jj] = 2 * np.pi * (thickness / wavelength[jj]) * (term_1 + term_2 + term_3)
+
+
 @vectorize([f8(f8, f8, f8, f8, f8, f8), ], nopython=True, fastmath=True, cache=True, )
 def _calc_delay_waveplate(wavelength, inc_angle, azim_angle, ne, no, thickness, ):
     s_inc_angle = np.sin(inc_angle)
@@ -0,0 +1,59 @@
+import numpy as np
+
+precision_default = 'double'
+precisions = {
+    'single': (np.float32, np.complex64, ),
+    'double': (np.float64, np.complex128, ),
+}
+
+
+def set_precision(precision):
+    """
+    Set the global floating-point precision of the forward model (pycis.model.Instrument.capture() etc.) and of the
+    demodulation (pycis.analysis.demod_linear() etc.), used wherever no precision is given in the call.
+
+    In single precision, spectra, delays, Mueller stacks, quadrature weights, FFTs and carrier windows are float32 /
+    complex64, halving memory traffic. Error bounds:
+
+    - Interferometer delays are computed in double precision and wrapped to [0, 2 pi) before rounding, so the phase
+      error from rounding is at most 2 pi * 2^-24 ~ 4e-7 rad, however large the delay.
+    - Integrated pixel signals then have relative error ~1e-6 (float32 machine epsilon times a slowly-growing function
+      of the number of wavelength samples), well below the shot noise for any realistic signal.
+    - Demodulated phases and contrasts differ from double precision by ~1e-5 rad and ~1e-6 respectively (complex64
+      FFT rounding), far below the effect of quantisation by a 12-bit camera.
+
+    The coherence-based fast capture (see pycis.model.Instrument.get_signal_coherence()) always runs in double
+    precision.
+
+    :param str precision: 'single' or 'double'.
+    """
+    global precision_default
+    assert precision in precisions
+    precision_default = precision
+
+
+def get_precision(dtype=None):
+    """
+    Floating-point precision of the given NumPy dtype.
+
+    :param dtype: NumPy dtype. Defaults to the global precision, see set_precision().
+    :return: (str) 'single' for float32 and complex64, otherwise 'double'.
+    """
+    if dtype is None:
+        return precision_default
+    elif np.dtype(dtype) in [np.float32, np.complex64, ]:
+        return 'single'
+    return 'double'
+
+
+def get_dtype(precision=None, complex=False):
+    """
+    NumPy dtype for the given floating-point precision.
+
+    :param str precision: 'single' or 'double'. Defaults to the global precision, see set_precision().
+    :param bool complex: True for the complex dtype, False for the real dtype.
+    :return: (type) NumPy dtype e.g. np.float32.
+    """
+    if precision is None:
+        precision = precision_default
+    return precisions[precision][int(complex)]
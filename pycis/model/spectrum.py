@@ -1,13 +1,20 @@
 import numpy as np
 import xarray as xr
+from numba import njit, prange
 from scipy.constants import c, e, atomic_mass
 from pycis.temp.zeeman import zeeman
+from pycis.model import get_dtype
 
 """
 Simple example spectra useful for testing.
 """
 D_WL = 1e-13  # small wavelength spacing (m) used to approximate delta function width
 
+# C III triplet at 464.9 nm: line component wavelengths in m, relative intensities and Zeeman doublet shift in m / T
+CIII_WAVELENGTHS = np.array([464.742e-9, 465.025e-9, 465.147e-9, ])
+CIII_REL_INTS = np.array([0.556, 0.333, 0.111, ])
+CIII_ZEEMAN_SHIFT = 2.0213e-11
+
 
 def freq2wl(spectrum):
     """
@@ -147,10 +154,9 @@ def get_spectrum_ciii_triplet(temperature, bfield=0, view=0, domain='frequency',
 
     stokes=stokes
     if test == True and bfield != 0:
-        wls = np.array([4.648719972899276e-07 + 2.0213e-11 * bfield, 4.648719972899276e-07 - 2.0213e-11 * bfield,
-                        4.6515488591713053e-07 + 2.0213e-11 * bfield, 4.6515488591713053e-07 - 2.0213e-11 * bfield,
-                        4.652776012198098e-07 + 2.0213e-11 * bfield,  4.652776012198098e-07 - 2.0213e-11 * bfield])
-        rel_ints = np.array([0.556/2, 0.556/2, 0.333/2, 0.333/2, 0.111/2, 0.111/2])  # relative intensities
+        # Zeeman doublet of equal halves about each line of the field-free triplet
+        wls = np.repeat(CIII_WAVELENGTHS, 2) + np.tile([CIII_ZEEMAN_SHIFT, -CIII_ZEEMAN_SHIFT], 3) * bfield
+        rel_ints = np.repeat(CIII_REL_INTS, 2) / 2  # relative intensities
 
     # define spectrum (corresponds to Doppler-broadened carbon III triplet at 464.9 nm)
     # if stokes is True, ensure that a stokes vector is returned, even if the magnetic field is 0.
@@ -168,8 +174,8 @@ def get_spectrum_ciii_triplet(temperature, bfield=0, view=0, domain='frequency',
 
     # if just the intensities are required and there is no field, simply use the accepted values for wl and int.
     else:
-         wls = np.array([464.742e-9, 465.025e-9, 465.147e-9, ])  # line component centre wavelengths in m
-         rel_ints = np.array([0.556, 0.333, 0.111, ])  # relative intensities
+         wls = CIII_WAVELENGTHS  # line component centre wavelengths in m
+         rel_ints = CIII_REL_INTS  # relative intensities
     freqs = c / wls
     freq_com = (c / wls * rel_ints).sum()  # centre-of-mass frequency in Hz
     sigma_freq = freq_com / c * np.sqrt(temperature * e / (12 * atomic_mass))  # line Doppler-width st. dev. in Hz
@@ -262,3 +268,102 @@ def get_spectrum_cii_multiplet(temperature, domain='frequency', nbins=1000):
         return spectrum
     else:
         raise Exception('input not understood')
+
+
+def get_spectrum_doppler_multiplet(grid, wavelength, rel_int, temperature, mass, v=0, intensity=1, bfield=0,
+                                   zeeman_shift=None, chunk=None, precision=None):
+    """
+    Spectral cube of a multiplet of Doppler-broadened, Doppler-shifted and (optionally) Zeeman-split Gaussian line
+    components, from maps of plasma parameters.
+
+    The maps (temperature, v, intensity and bfield) are broadcast against each other, by dimension name for
+    xr.DataArrays e.g. temperature and v with dimensions ('x', 'y', ), and the whole cube is evaluated in one compiled
+    pass, parallel over the points of the maps. Line component j has rest wavelength wavelength[j] + zeeman_shift[j] *
+    bfield, Doppler-shifted by v, and a Doppler-width standard deviation in frequency proportional to its centre
+    frequency. Each spectrum integrates to the given intensity.
+
+    :param grid: Spectral grid: wavelengths in m (np.ndarray, or xr.DataArray with dimension 'wavelength'),
+        frequencies in Hz (xr.DataArray with dimension 'frequency'), or a pycis.model.Instrument with a stored spectral
+        response (see Instrument.set_spectral_response()), to use its capture wavelength grid.
+    :param wavelength: Rest wavelengths of the line components in m.
+    :type wavelength: Union[float, np.ndarray]
+    :param rel_int: Relative intensities of the line components.
+    :type rel_int: Union[float, np.ndarray]
+    :param temperature: Ion temperature in eV.
+    :type temperature: Union[float, xr.DataArray]
+    :param float mass: Ion mass in atomic mass units.
+    :param v: Line-of-sight flow velocity in km/s, positive for a red-shift.
+    :type v: Union[float, xr.DataArray]
+    :param intensity: Spectrally-integrated intensity.
+    :type intensity: Union[float, xr.DataArray]
+    :param bfield: Magnetic field strength in T.
+    :type bfield: Union[float, xr.DataArray]
+    :param zeeman_shift: Rest-wavelength shift of each line component per unit field, in m / T. Defaults to zero.
+    :type zeeman_shift: Union[float, np.ndarray]
+    :param int chunk: If given, return a generator of consecutive chunks of the cube along the spectral dimension,
+        each of (at most) this many samples and overlapping the previous chunk by one sample, as streamed by
+        pycis.model.Instrument.get_signal() (see wavelength_chunk). Summing the signals of the chunks then gives the
+        signal of the whole cube, without it ever being held in memory.
+    :param str precision: 'single' or 'double', see pycis.model.set_precision().
+    :return: (xr.DataArray) spectrum in units of intensity per m (or per Hz), with the dimensions of the maps followed
+        by 'wavelength' (or 'frequency').
+    """
+    if hasattr(grid, 'spectral_response'):
+        assert grid.spectral_response is not None
+        grid = grid.spectral_response.wavelength
+    if not isinstance(grid, xr.DataArray):
+        grid = xr.DataArray(grid, dims=('wavelength', ), coords=(grid, ), )
+    dim, = grid.dims
+    assert dim in ['wavelength', 'frequency']
+
+    wavelength, rel_int = np.broadcast_arrays(np.atleast_1d(wavelength).astype(float),
+                                              np.atleast_1d(rel_int).astype(float))
+    zeeman_shift = np.broadcast_to(0 if zeeman_shift is None else zeeman_shift, wavelength.shape).astype(float)
+    rel_int = rel_int / rel_int.sum()
+
+    maps = xr.broadcast(*[xr.DataArray(m) for m in [temperature, v, intensity, bfield, ]])
+    template = maps[0]
+    maps = [np.ascontiguousarray(m.values, dtype=float).ravel() for m in maps]
+    doppler = np.sqrt(maps[0] * e / (mass * atomic_mass)) / c  # Doppler-width st. dev. / frequency
+    shift = 1 + maps[1] / (c / 1e3)
+    dtype = get_dtype(precision)
+
+    def get_chunk(grid_chunk):
+        values = np.ascontiguousarray(grid_chunk.values, dtype=float)
+        freq = values if dim == 'frequency' else c / values
+        out = np.empty((doppler.size, values.size, ), dtype=dtype)
+        # Jacobian of the conversion to per-wavelength units, c / wavelength^2
+        jacobian = freq ** 2 / c if dim == 'wavelength' else np.ones_like(freq)
+        _doppler_multiplet_kernel(freq, jacobian, wavelength, rel_int, zeeman_shift, doppler, shift, maps[2], maps[3],
+                                  out)
+        coords = dict(template.coords)
+        coords[dim] = grid_chunk[dim]
+        return xr.DataArray(out.reshape(template.shape + (values.size, )), dims=template.dims + (dim, ),
+                            coords=coords, )
+
+    if chunk is None:
+        return get_chunk(grid)
+    assert chunk >= 2
+    return (get_chunk(grid.isel({dim: slice(idx_start, idx_start + chunk)}))
+            for idx_start in range(0, max(grid.size - 1, 1), chunk - 1))
+
+
+@njit(parallel=True, nogil=True, cache=True, )
+def _doppler_multiplet_kernel(freq, jacobian, wavelength, rel_int, zeeman_shift, doppler, shift, intensity, bfield,
+                              out):
+    """
+    Sum of area-normalised Gaussians in frequency at each map point (rows of out) and grid frequency (columns), times
+    jacobian.
+    """
+    norm = 1 / np.sqrt(2 * np.pi)
+    for p in prange(out.shape[0]):
+        for k in range(freq.size):
+            out[p, k] = 0
+        for j in range(wavelength.size):
+            freq_j = c / ((wavelength[j] + zeeman_shift[j] * bfield[p]) * shift[p])
+            sigma_inv = 1 / (freq_j * doppler[p])
+            amplitude = intensity[p] * rel_int[j] * norm * sigma_inv
+            for k in range(freq.size):
+                z = (freq[k] - freq_j) * sigma_inv
+                if abs(z) < 40:  # otherwise below the smallest double
+                    out[p, k] += amplitude * jacobian[k] * np.exp(-0.5 * z * z)
@@ -2,13 +2,20 @@
 Basic 'symbolic computation' implementation of Mueller calculus framework, used to derive the equations for
 interference fringe patterns.
 
-Currently this module exists by itself, not interacting with the tools for synthetic image generation.
+get_interferogram_kernel() turns the symbolic interferogram for an arbitrary polariser / retarder stack into a cached,
+compiled numerical kernel, which pycis.model.Instrument uses for configurations with no hand-coded formula.
 """
 import numpy as np
 from math import radians
-from sympy import Matrix, sin,  cos, symbols, simplify, pi, trigsimp, init_printing, sqrt
+from functools import lru_cache
+from numba import vectorize
+from sympy import Matrix, sin,  cos, symbols, simplify, pi, trigsimp, init_printing, sqrt, lambdify
 init_printing()
 
+# maximum number of interferogram expressions / compiled kernels held in memory at once. Kernels are keyed by the
+# numerical orientations etc. of the components, so an unbounded cache would grow with every configuration modelled.
+KERNEL_CACHE_SIZE = 32
+
 
 # ----------------------------------------------------------------------------------------------------------------------
 # STOKES VECTORS
@@ -37,38 +44,51 @@ def rot(rho):
     return rot
 
 
-def polariser(rho):
+def polariser(rho, tx_1=1, tx_2=0):
     """
     Polariser Mueller matrix
 
     :param float rho: angle in radians of polariser transmission axis about x-axis.
+    :param float tx_1: Transmission, primary component.
+    :param float tx_2: Transmission, secondary (orthogonal) component.
     :return:
     """
-    polariser = Matrix(
-        [
-            [0.5, 0.5, 0, 0],
-            [0.5, 0.5, 0, 0],
-            [0, 0, 0, 0],
-            [0, 0, 0, 0],
-        ]
-    )
+    if tx_1 == 1 and tx_2 == 0:
+        polariser = Matrix(
+            [
+                [0.5, 0.5, 0, 0],
+                [0.5, 0.5, 0, 0],
+                [0, 0, 0, 0],
+                [0, 0, 0, 0],
+            ]
+        )
+    else:
+        polariser = Matrix(
+            [
+                [tx_2 ** 2 + tx_1 ** 2, tx_1 ** 2 - tx_2 ** 2, 0, 0],
+                [tx_1 ** 2 - tx_2 ** 2, tx_2 ** 2 + tx_1 ** 2, 0, 0],
+                [0, 0, 2 * tx_2 * tx_1, 0],
+                [0, 0, 0, 2 * tx_2 * tx_1],
+            ]
+        ) / 2
     return rot(-rho) * polariser * rot(rho)
 
 
-def retarder(rho, phi):
+def retarder(rho, phi, contrast=1):
     """
     Retarder Mueller matrix
 
     :param float rho: angle in radians of retarder fast axis about x-axis.
     :param float phi: angle in radians of imparted retardance.
+    :param float contrast: contrast degradation factor, as in pycis.model.LinearRetarder.
     :return: Mueller matrix.
     """
     retarder = Matrix(
         [
             [1, 0, 0, 0],
             [0, 1, 0, 0],
-            [0, 0, cos(phi), sin(phi)],
-            [0, 0, -sin(phi), cos(phi)],
+            [0, 0, contrast * cos(phi), contrast * sin(phi)],
+            [0, 0, -contrast * sin(phi), contrast * cos(phi)],
         ]
     )
     return rot(-rho) * retarder * rot(rho)
@@ -156,6 +176,100 @@ def specpol_2retarder_linear():
     print(' ')
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+# CODE GENERATION
+def get_interferogram_kernel(interferometer, camera_type='monochrome', stokes=False):
+    """
+    Compiled numerical kernel for the interferogram of the given interferometer
+
+    The kernel evaluates the first Stokes parameter of the light reaching the sensor. It takes the following arguments,
+    all broadcast against each other:
+
+    - s0 (and s1, s2, s3 if stokes is True): the Stokes parameters of the incident light.
+    - m: the pixelated polariser index of each pixel, with transmission axis at m * 45 degrees (see
+      pycis.model.get_pixelated_phase_mask). Ignored unless camera_type is 'monochrome_polarised'.
+    - phi_1, phi_2, ...: the delay in radians imparted by each retarder in the interferometer, in order.
+
+    Kernels are cached, keyed by the component types, orientations, transmissions and contrasts, so calling this
+    repeatedly for the same configuration is cheap. Only the KERNEL_CACHE_SIZE most recently used kernels are kept.
+
+    :param list interferometer: list of pycis.model.Component instances.
+    :param str camera_type: see pycis.model.Camera.
+    :param bool stokes: whether the incident light is described by a full Stokes vector (True) or is unpolarised (False).
+    :return: the kernel, a numpy ufunc.
+    :raises NotImplementedError: if no closed-form expression can be derived for this configuration.
+    """
+    return _get_interferogram_kernel(_get_interferogram_key(interferometer, camera_type), stokes)
+
+
+def get_interferogram_expr(interferometer, camera_type='monochrome', stokes=False):
+    """
+    Symbolic expression for the interferogram of the given interferometer. See get_interferogram_kernel().
+
+    :return: (expr, args) the sympy expression and a list of its argument symbols, in kernel argument order.
+    """
+    return _get_interferogram_expr(_get_interferogram_key(interferometer, camera_type), stokes)
+
+
+def _get_interferogram_key(interferometer, camera_type):
+    """
+    Hashable description of the interferometer, sufficient to derive its interferogram expression.
+    """
+    from pycis.model import LinearPolariser, LinearRetarder
+
+    if camera_type not in ['monochrome', 'monochrome_polarised']:
+        raise NotImplementedError
+
+    key = []
+    for component in interferometer:
+        if isinstance(component, LinearPolariser):
+            key.append(('polariser', float(component.orientation), float(component.tx_1), float(component.tx_2), ))
+        elif isinstance(component, LinearRetarder):
+            key.append(('retarder', float(component.orientation), float(component.contrast_inst), ))
+        else:
+            raise NotImplementedError
+    return tuple(key), camera_type
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _get_interferogram_expr(key, stokes):
+    components, camera_type = key
+    m = symbols('m', real=True)
+    phis = symbols('phi_1:' + str(1 + sum(c[0] == 'retarder' for c in components)), real=True)
+
+    mueller = Matrix.eye(4)
+    phis_iter = iter(phis)
+    for component in components:
+        if component[0] == 'polariser':
+            _, orientation, tx_1, tx_2 = component
+            mueller = polariser(radians(orientation), tx_1=tx_1, tx_2=tx_2) * mueller
+        else:
+            _, orientation, contrast = component
+            mueller = retarder(radians(orientation), next(phis_iter), contrast=contrast) * mueller
+    if camera_type == 'monochrome_polarised':
+        mueller = polariser(m * pi / 4) * mueller
+
+    if stokes:
+        s_in = S_GENERAL
+        args = [s0, s1, s2, s3, m, *phis]
+    else:
+        s_in = S_UNPOLARISED
+        args = [s0, m, *phis]
+    return (mueller * s_in)[0], args
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _get_interferogram_kernel(key, stokes):
+    expr, args = _get_interferogram_expr(key, stokes)
+    fn = lambdify(args, expr, modules='math', cse=True)
+    signature = 'f8(' + ', '.join(['f8'] * len(args)) + ')'
+    try:
+        return vectorize([signature], nopython=True, target='parallel')(fn)
+    except Exception:
+        # compilation failed, use NumPy
+        return lambdify(args, expr, modules='numpy', cse=True)
+
+
 if __name__ == '__main__':
     spec_1retarder_linear()
     # spec_1retarder_pixelated()
@@ -6,6 +6,6 @@ setuptools.setup(
     author='Joseph Allcock',
     description='Analysis and modelling for the Coherence Imaging Spectroscopy (CIS) plasma diagnostic',
     url='https://github.com/jsallcock/pycis',
-    install_requires=['numpy', 'scipy', 'matplotlib', 'xarray', 'numba', 'pyyaml'],
+    install_requires=['numpy', 'scipy', 'matplotlib', 'xarray', 'numba', 'pyyaml', 'sympy'],
     packages=setuptools.find_packages(),
 )
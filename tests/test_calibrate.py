@@ -0,0 +1,86 @@
+import os
+import copy
+import unittest
+from unittest import mock
+import numpy as np
+import xarray as xr
+from pycis.model import Camera, LinearPolariser, QuarterWaveplate, UniaxialCrystal, Instrument
+from pycis.analysis import wrap, fit_instrument
+
+# define camera
+camera = Camera((100, 100, ), 6.5e-6 * 2, 12, 0.35, 0.46, 2.5, type='monochrome_polarised')
+optics = [17e-3, 105e-3, 150e-3, ]
+interferometer = [
+    LinearPolariser(orientation=10, ),
+    UniaxialCrystal(thickness=5e-3, cut_angle=40, orientation=55, contrast_inst=0.9, ),
+    QuarterWaveplate(orientation=100, ),
+]
+inst_true = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+
+# demodulated phase and contrast of calibration lines, on a subsampled grid of pixels
+wavelength = np.array([457.9e-9, 465.8e-9, 488.0e-9, ])
+wavelength = xr.DataArray(wavelength, dims=('wavelength', ), coords=(wavelength, ), )
+x, y = camera.x[::5], camera.y[::5]
+phase = wrap(inst_true.get_delay(wavelength, x, y)).transpose('wavelength', 'x', 'y')
+contrast = inst_true.get_contrast() * xr.ones_like(phase)
+
+
+class TestCalibrate(unittest.TestCase):
+
+    def test_fit_instrument(self, ):
+        """
+        Test that perturbed instrument parameters are recovered from noiseless calibration data containing outliers,
+        and that the fitted config is written
+        """
+        params = ['thickness_1', 'cut_angle_1', 'orientation', 'contrast_inst_1', ]
+        values_true = [5e-3, 40, 10, 0.9, ]
+
+        inst_guess = copy.deepcopy(inst_true)
+        inst_guess.interferometer[1].thickness += 2e-7
+        inst_guess.interferometer[1].cut_angle += 0.004
+        inst_guess.interferometer[1].contrast_inst = 1
+        for component in inst_guess.interferometer:
+            component.orientation += 0.5
+        inst_guess.compile()
+
+        # corrupt some pixels
+        phase_outliers = phase.copy()
+        phase_outliers[:, :3, :3] = np.pi / 2
+        phase_outliers[0, 5, 5] = np.nan
+
+        fpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_calibrate.yaml')
+        inst_fit, results = fit_instrument(inst_guess, phase_outliers, params, contrast=contrast, f_scale=0.01,
+                                           fpath=fpath, )
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0].success)
+        inst_read = Instrument(fpath)
+        os.remove(fpath)
+
+        for inst in [inst_fit, inst_read, ]:
+            self.assertEqual(inst.type, 'single_delay_pixelated')
+            self.assertAlmostEqual(inst.interferometer[1].thickness / values_true[0], 1, places=5)
+            self.assertAlmostEqual(inst.interferometer[1].cut_angle, values_true[1], places=3)
+            self.assertAlmostEqual(inst.interferometer[2].orientation, 100, places=3)
+            self.assertAlmostEqual(inst.interferometer[1].contrast_inst, values_true[3], places=6)
+        self.assertEqual(inst_guess.interferometer[1].contrast_inst, 1)
+
+    def test_fit_instrument_multistart(self, ):
+        """
+        Test that multiple starts are run and sorted by cost, and that the best of them recovers the parameters. The
+        instrument is compiled once per start and once for the result, not for every evaluation of the model
+        """
+        params = ['thickness_1', 'cut_angle_1', ]
+        bounds = ([5e-3 - 1e-6, 39, ], [5e-3 + 1e-6, 41, ])
+        with mock.patch.object(Instrument, 'compile', autospec=True, side_effect=Instrument.compile) as compile_:
+            inst_fit, results = fit_instrument(inst_true, phase, params, bounds=bounds, n_starts=3, seed=1,
+                                               max_workers=2, )
+        self.assertEqual(compile_.call_count, 3 + 1)
+        self.assertGreater(sum(r.nfev for r in results), 3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual([r.cost for r in results], sorted(r.cost for r in results))
+        self.assertAlmostEqual(inst_fit.interferometer[1].thickness / 5e-3, 1, places=6)
+        self.assertAlmostEqual(inst_fit.interferometer[1].cut_angle, 40, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
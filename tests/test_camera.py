@@ -0,0 +1,128 @@
+import unittest
+import numpy as np
+import xarray as xr
+from numpy.testing import assert_equal, assert_almost_equal
+from pycis.model import Camera, mueller_product, get_pixelated_phase_mask, get_pixel_idxs, get_superpixel_position
+
+# define camera
+bit_depth = 12
+sensor_format = (100, 100,)
+pixel_size = 6.5e-6 * 2
+qe = 0.35
+epercount = 0.46  # [e / count]
+cam_noise = 2.5
+camera = Camera(sensor_format, pixel_size, bit_depth, qe, epercount, cam_noise, type='monochrome')
+
+# photon fluence spanning the range of the sensor, including saturated pixels
+rng = np.random.default_rng(0)
+x, y = camera.get_pixel_position()
+signal = xr.DataArray(rng.random(sensor_format) * 1.2 * 2 ** bit_depth * epercount / qe, dims=('x', 'y', ),
+                      coords={'x': x, 'y': y, }, )
+
+
+class TestCamera(unittest.TestCase):
+
+    def test_digitise_clean(self, ):
+        """
+        Test that clean digitisation matches the original np.digitize quantisation, for both float64 and float32
+        """
+        values = signal.values * qe / epercount
+        image_expected = np.digitize(values, np.arange(0, 2 ** bit_depth)).astype(np.uint16)
+        image = camera.digitise(signal, clean=True, )
+        assert_equal(image.values, image_expected)
+        self.assertEqual(image.dtype, np.uint16)
+        self.assertEqual(image.dims, signal.dims)
+
+        image_32 = camera.digitise(signal, clean=True, dtype=np.float32, )
+        self.assertLessEqual(np.abs(image_32.values.astype(int) - image_expected.astype(int)).max(), 1)
+
+    def test_digitise_seed(self, ):
+        """
+        Test that image noise is reproducible given a seed, and independent between calls otherwise
+        """
+        for dtype in [np.float64, np.float32, ]:
+            image_1 = camera.digitise(signal, seed=1, dtype=dtype, )
+            image_2 = camera.digitise(signal, seed=1, dtype=dtype, )
+            assert_equal(image_1.values, image_2.values)
+
+        image_1 = camera.digitise(signal, )
+        image_2 = camera.digitise(signal, )
+        self.assertFalse(np.array_equal(image_1.values, image_2.values))
+
+        rng = np.random.default_rng(1)
+        image_1 = camera.digitise(signal, seed=rng, )
+        image_2 = camera.digitise(signal, seed=rng, )
+        self.assertFalse(np.array_equal(image_1.values, image_2.values))
+
+    def test_digitise_gaussian_threshold(self, ):
+        """
+        Test the statistics of the shot noise drawn using the Gaussian approximation for large photon counts
+        """
+        camera_ideal = Camera(sensor_format, pixel_size, 16, 1, 1, 0, type='monochrome')
+        for fluence in [30, 3000, ]:
+            signal_uniform = xr.full_like(signal, fluence)
+            image = camera_ideal.digitise(signal_uniform, seed=1, gaussian_threshold=1000, ).values - 1.
+            self.assertLess(abs(image.mean() - fluence), 5 * np.sqrt(fluence / image.size))
+            self.assertLess(abs(image.var() / fluence - 1), 0.05)
+
+    def test_apply_polarisers(self, ):
+        """
+        Test that the compact superpixel representation of the pixelated polariser array gives the same intensity as
+        the full per-pixel Mueller matrix product, for the full sensor and for sub-regions that do and don't align with
+        the superpixels, including an empty one
+        """
+        camera_pol = Camera(sensor_format, pixel_size, bit_depth, qe, epercount, cam_noise, type='monochrome_polarised')
+        wavelength = xr.DataArray(np.linspace(460e-9, 461e-9, 3), dims=('wavelength', ), )
+        rng = np.random.default_rng(2)
+        stokes = xr.DataArray(rng.random(sensor_format + (3, 4, )) - 0.5, dims=('x', 'y', 'wavelength', 'stokes', ),
+                              coords={'x': x, 'y': y, 'wavelength': wavelength, }, )
+        stokes[..., 0] = 1
+
+        x_pixel, y_pixel = camera_pol.get_pixel_index(x, y)
+        assert_equal(x_pixel.values, x.x_pixel.values)
+        assert_equal(y_pixel.values, y.y_pixel.values)
+
+        intensity_expected = mueller_product(camera_pol.get_mueller_matrix(), stokes).isel(stokes=0, drop=True)
+        for roi in [{}, {'x': slice(10, 30), 'y': slice(4, 50)}, {'x': slice(11, 30), 'y': slice(3, 50, 3)},
+                    {'x': slice(10, 10), 'y': slice(4, 50)}, ]:
+            intensity = camera_pol.get_intensity(stokes.isel(roi), apply_polarisers=True, )
+            intensity_roi = intensity_expected.isel(roi)
+            assert_almost_equal(intensity.transpose(*intensity_roi.dims).values, intensity_roi.values)
+
+    def test_check_pixel_position(self, ):
+        """
+        Test that pixel centre positions are validated arithmetically, tolerating float rounding but not positions off
+        the pixel centres or off the sensor
+        """
+        x_pixel, y_pixel = camera.check_pixel_position(x.values[10:30], y.values[::3] * (1 + 1e-12))
+        assert_equal(x_pixel, np.arange(10, 30))
+        assert_equal(y_pixel, np.arange(0, sensor_format[1], 3))
+        self.assertIsNone(camera.check_pixel_position(y=y.values)[0])
+
+        for x_bad in [x.values[:5] + pixel_size / 4, x.values[-5:] + pixel_size, ]:
+            with self.assertRaises(ValueError):
+                camera.check_pixel_position(x_bad)
+
+    def test_pixel_layout_cache(self, ):
+        """
+        Test that the memoised phase mask and pixel indices are shared, read-only and match the pixel layout
+        """
+        phase_mask_1 = get_pixelated_phase_mask(sensor_format)
+        phase_mask_2 = get_pixelated_phase_mask(list(sensor_format))
+        self.assertTrue(np.shares_memory(phase_mask_1.values, phase_mask_2.values))
+        self.assertFalse(phase_mask_1.values.flags.writeable)
+
+        phase_mask_1 = phase_mask_1.assign_coords(x=x, y=y, )
+        self.assertNotIn('x', phase_mask_2.coords)
+        for idxs, phase in zip(get_pixel_idxs(sensor_format), [0, np.pi / 2, np.pi, 3 * np.pi / 2, ]):
+            assert_equal(phase_mask_1.isel(x=idxs[0], y=idxs[1]).values, phase)
+
+        xs_1, ys_1 = get_superpixel_position(x, y)
+        xs_2, ys_2 = get_superpixel_position(x, y)
+        self.assertTrue(np.shares_memory(xs_1.values, xs_2.values))
+        assert_almost_equal(xs_1.values, (x.values[0::2] + x.values[1::2]) / 2)
+        assert_almost_equal(ys_1.values, (y.values[0::2] + y.values[1::2]) / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
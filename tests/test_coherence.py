@@ -3,7 +3,9 @@ import numpy as np
 from numpy.testing import assert_almost_equal
 import xarray as xr
 from scipy.constants import c, atomic_mass, e
-from pycis.model import calculate_coherence, get_kappa, get_spectrum_ciii_triplet
+from pycis.model import calculate_coherence, calculate_coherence_fft, get_kappa, get_spectrum_ciii_triplet, \
+    get_coherence_doppler_multiplet, get_coherence_ciii_triplet, get_spectrum_doppler_multiplet, CIII_WAVELENGTHS, \
+    CIII_REL_INTS, CIII_ZEEMAN_SHIFT
 
 
 class TestCoherence(unittest.TestCase):
@@ -46,6 +48,104 @@ class TestCoherence(unittest.TestCase):
             assert_almost_equal(doc_numerical.real.data, doc_analytical.real.data, )
             assert_almost_equal(doc_numerical.imag.data, doc_analytical.imag.data, )
 
+    def test_coherence_fft(self, ):
+        """
+        Test that the NUFFT coherence matches the direct integral for delays on a regular grid, for arbitrary per-pixel
+        delays and for per-pixel spectra, with and without dispersion and for spectra uniform in frequency and in
+        wavelength.
+        """
+        temperature = 15
+        delay = xr.DataArray(np.linspace(0, 40000, 100), dims=('delay', ), )
+        delay_pixel = xr.DataArray(np.random.rand(30, 20) * 40000, dims=('x', 'y', ), )
+        for domain in ['frequency', 'wavelength', ]:
+            spectrum = get_spectrum_ciii_triplet(temperature, domain=domain, )
+            spectrum_pixel = spectrum * xr.DataArray(np.random.rand(30, 20), dims=('x', 'y', ), )
+            for material in [None, 'a-BBO', ]:
+                for s, d in [(spectrum, delay), (spectrum, delay_pixel), (spectrum_pixel, delay_pixel), ]:
+                    doc = calculate_coherence(s, d, material=material, )
+                    doc_fft = calculate_coherence_fft(s, d, material=material, ).transpose(*doc.dims)
+                    assert_almost_equal(doc_fft.real.data, doc.real.data, )
+                    assert_almost_equal(doc_fft.imag.data, doc.imag.data, )
+
+    def test_doppler_multiplet(self, ):
+        """
+        Test the analytic multiplet coherence against the numerical coherence of the corresponding spectrum, broadcast
+        over temperature, flow velocity, magnetic field and delay.
+        """
+        delay = xr.DataArray(np.linspace(0, 40000, 100), dims=('delay', ), )
+        temperature = xr.DataArray([1, 15, ], dims=('temperature', ), )
+        v = xr.DataArray([-20, 0, 50, ], dims=('v', ), )
+        bfield = xr.DataArray([0, 2, ], dims=('bfield', ), )
+        freq_ref = (c / CIII_WAVELENGTHS * CIII_REL_INTS).sum() / CIII_REL_INTS.sum()
+
+        freq = np.linspace(6.440e14, 6.458e14, 20000)
+        freq = xr.DataArray(freq, dims=('frequency', ), coords=(freq, ), )
+        spectrum = 0
+        for wl, rel_int in zip(CIII_WAVELENGTHS, CIII_REL_INTS):
+            for shift in [CIII_ZEEMAN_SHIFT, -CIII_ZEEMAN_SHIFT, ]:
+                freq_j = c / ((wl + shift * bfield) * (1 + v / (c / 1e3)))
+                sigma = freq_j / c * np.sqrt(temperature * e / (12 * atomic_mass))
+                spectrum += rel_int / 2 * np.exp(-((freq - freq_j) / sigma) ** 2 / 2) / (sigma * np.sqrt(2 * np.pi))
+
+        for material in [None, 'a-BBO', ]:
+            doc = get_coherence_ciii_triplet(delay, temperature, v=v, bfield=bfield, material=material, )
+            doc_numerical = calculate_coherence(spectrum, delay, material=material, freq_ref=freq_ref, )
+            doc = doc.transpose(*doc_numerical.dims)
+            assert_almost_equal(doc.real.data, doc_numerical.real.data, )
+            assert_almost_equal(doc.imag.data, doc_numerical.imag.data, )
+
+        # the test Zeeman spectrum has the same line components, with a common Doppler width (so agreement to ~1e-4)
+        for temperature_i in [1, 15, ]:
+            doc = get_coherence_ciii_triplet(delay, temperature_i, bfield=2, )
+            spectrum = get_spectrum_ciii_triplet(temperature_i, bfield=2, test=True, )
+            doc_numerical = calculate_coherence(spectrum, delay, freq_ref=freq_ref, )
+            assert_almost_equal(doc.real.data, doc_numerical.real.data, decimal=3, )
+            assert_almost_equal(doc.imag.data, doc_numerical.imag.data, decimal=3, )
+
+        # plain NumPy arrays broadcast by shape, and the field-free triplet needs no Zeeman shifts
+        doc = get_coherence_doppler_multiplet(np.linspace(0, 40000, 100)[:, None], CIII_WAVELENGTHS, CIII_REL_INTS,
+                                              np.array([1, 15, ]), 12, )
+        doc_expected = get_coherence_ciii_triplet(delay, temperature, ).transpose('delay', 'temperature')
+        assert_almost_equal(doc, doc_expected.values, )
+
+    def test_spectrum_doppler_multiplet(self, ):
+        """
+        Test the spectral cube built from plasma parameter maps: its coherence matches the analytic multiplet coherence
+        at each pixel, it integrates to the intensity map in both domains and its chunks tile the full cube.
+        """
+        shape = (6, 5, )
+        temperature = xr.DataArray(np.random.rand(*shape) * 20 + 1, dims=('x', 'y', ), )
+        v = xr.DataArray(np.random.rand(*shape) * 100 - 50, dims=('x', 'y', ), )
+        intensity = xr.DataArray(np.random.rand(*shape) + 1, dims=('x', 'y', ), )
+        bfield = xr.DataArray(np.random.rand(shape[1]) * 3, dims=('y', ), )
+        kwargs = dict(v=v, intensity=intensity, bfield=bfield, )
+        args = (CIII_WAVELENGTHS, CIII_REL_INTS, temperature, 12, )
+
+        freq = np.linspace(6.440e14, 6.458e14, 20000)
+        wavelength = c / freq[::-1]
+        for grid in [xr.DataArray(freq, dims=('frequency', ), coords=(freq, ), ), wavelength, ]:
+            dim = 'frequency' if isinstance(grid, xr.DataArray) else 'wavelength'
+            cube = get_spectrum_doppler_multiplet(grid, *args, zeeman_shift=CIII_ZEEMAN_SHIFT, **kwargs)
+            self.assertEqual(cube.dims, ('x', 'y', dim, ))
+            assert_almost_equal((cube.integrate(coord=dim) / intensity).values, 1, )
+
+            chunks = list(get_spectrum_doppler_multiplet(grid, *args, zeeman_shift=CIII_ZEEMAN_SHIFT, chunk=7000,
+                                                         **kwargs))
+            self.assertEqual(len(chunks), 3)
+            cube_chunked = xr.concat([chunks[0], ] + [chunk.isel({dim: slice(1, None)}) for chunk in chunks[1:]],
+                                     dim=dim)
+            assert_almost_equal(cube_chunked.values, cube.values)
+
+        cube = get_spectrum_doppler_multiplet(xr.DataArray(freq, dims=('frequency', ), coords=(freq, ), ),
+                                              CIII_WAVELENGTHS, CIII_REL_INTS, temperature, 12, v=v, )
+        delay = xr.DataArray(np.linspace(0, 40000, 20), dims=('delay', ), )
+        freq_ref = (c / CIII_WAVELENGTHS * CIII_REL_INTS).sum()
+        doc = get_coherence_doppler_multiplet(delay, CIII_WAVELENGTHS, CIII_REL_INTS, temperature, 12, v=v, )
+        doc_numerical = calculate_coherence(cube, delay, freq_ref=freq_ref, ) / cube.integrate(coord='frequency')
+        doc = doc.transpose(*doc_numerical.dims)
+        assert_almost_equal(doc.real.data, doc_numerical.real.data, )
+        assert_almost_equal(doc.imag.data, doc_numerical.imag.data, )
+
 
 if __name__ == '__main__':
     unittest.main()
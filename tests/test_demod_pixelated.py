@@ -3,7 +3,7 @@ import unittest
 import numpy as np
 from numpy.testing import assert_almost_equal
 import xarray as xr
-from pycis.model import get_pixelated_phase_mask, Instrument, get_spectrum_delta
+from pycis.model import get_pixelated_phase_mask, Instrument, get_spectrum_delta, set_precision
 from pycis.analysis import wrap, demod_triple_delay_pixelated
 
 
@@ -54,6 +54,36 @@ class TestDemodPixelated(unittest.TestCase):
             err_msg_coherence = 'Demod failed: coherence error at delay' + str(ii_delay + 1) + '/3'
             assert_almost_equal(coherence_demod, coherence_predicted, decimal=decimal, err_msg=err_msg_coherence)
 
+    def test_demod_triple_delay_pixelated_precision(self):
+        """
+        Test that single-precision demodulation matches double precision to within the documented error bounds, with
+        the precision set both per call and globally
+        """
+        inst = Instrument(config='triple_delay_pixelated.yaml')
+        wl0 = 465e-9
+        spectrum = get_spectrum_delta(wl0, 5e3)
+        roi = {'x': slice(1000, 1400), 'y': slice(800, 1200), }
+        spectrum = spectrum * xr.ones_like(inst.camera.x.isel(x=roi['x'])) * xr.ones_like(inst.camera.y.isel(y=roi['y']))
+        igram = inst.capture(spectrum, clean=True, precision='single', )
+        fringe_freq = inst.retarders[0].get_fringe_frequency(wl0, inst.optics[-1])
+
+        dc, phase, contrast = demod_triple_delay_pixelated(igram, fringe_freq, )
+        try:
+            set_precision('single')
+            results_single = [demod_triple_delay_pixelated(igram, fringe_freq, ),
+                              demod_triple_delay_pixelated(igram, fringe_freq, precision='single', )]
+        finally:
+            set_precision('double')
+
+        for dc_single, phase_single, contrast_single in results_single:
+            self.assertEqual(dc_single.dtype, np.float32)
+            assert_almost_equal(dc_single.values / dc.values, 1, decimal=5)
+            for ii_delay in range(3):
+                self.assertEqual(phase_single[ii_delay].dtype, np.float32)
+                phase_diff = np.angle(np.exp(1j * (phase_single[ii_delay] - phase[ii_delay]).values))
+                assert_almost_equal(phase_diff, 0, decimal=4)
+                assert_almost_equal(contrast_single[ii_delay].values, contrast[ii_delay].values, decimal=5)
+
 
 if __name__ == '__main__':
     unittest.main()
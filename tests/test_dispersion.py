@@ -0,0 +1,87 @@
+import unittest
+import numpy as np
+import xarray as xr
+from numpy.testing import assert_allclose
+from pycis.model import get_refractive_indices, get_kappa, sellmeier_coefs_all, DWL, Camera, LinearPolariser, \
+    UniaxialCrystal, QuarterWaveplate, Instrument
+from pycis.model.dispersion import _get_refractive_indices
+from pycis.analysis import fit_instrument
+
+wavelength = np.linspace(400e-9, 700e-9, 31)
+
+
+class TestDispersion(unittest.TestCase):
+
+    def test_refractive_index_derivative(self, ):
+        """
+        Test the analytic derivatives of the refractive indices against central finite differences, for each form of
+        the Sellmeier equation
+        """
+        for source in ['agoptics', 'kato2010', 'ghosh', 'zelmon', ]:
+            material = sellmeier_coefs_all[source]['material']
+            kwargs = {'material': material, 'sellmeier_coefs_source': source, }
+            dn_dwl = get_refractive_indices(wavelength, deriv=True, **kwargs)[2:]
+            n_p1 = get_refractive_indices(wavelength + DWL, **kwargs)
+            n_m1 = get_refractive_indices(wavelength - DWL, **kwargs)
+            for dn_dwl_t, n_p1_t, n_m1_t in zip(dn_dwl, n_p1, n_m1):
+                assert_allclose(dn_dwl_t, (n_p1_t - n_m1_t) / (2 * DWL), rtol=1e-5, )
+
+    def test_cache(self, ):
+        """
+        Test that memoised refractive indices match direct evaluation, for scalar, array and DataArray wavelengths and
+        for manually specified Sellmeier coefficients
+        """
+        sellmeier_coefs = dict(sellmeier_coefs_all['agoptics']['sellmeier_coefs'])
+        ne, no = get_refractive_indices(wavelength, sellmeier_coefs=sellmeier_coefs, )
+        ne_2, no_2 = get_refractive_indices(wavelength, sellmeier_coefs=sellmeier_coefs, )
+        self.assertTrue(np.shares_memory(ne, ne_2))
+        self.assertFalse(ne.flags.writeable)
+
+        ne_expected = (2.3753 + 0.01224 / ((wavelength * 1e6) ** 2 - 0.01667) - 0.01516 * (wavelength * 1e6) ** 2) ** 0.5
+        assert_allclose(ne, ne_expected, rtol=1e-14, )
+        assert_allclose(get_refractive_indices(wavelength[3], material='a-BBO', )[0], ne_expected[3], rtol=1e-14, )
+
+        wavelength_xr = xr.DataArray(wavelength, dims=('wavelength', ), coords={'wavelength': wavelength, }, )
+        ne_xr, no_xr = get_refractive_indices(wavelength_xr, material='a-BBO', )
+        self.assertEqual(ne_xr.dims, ('wavelength', ))
+        assert_allclose(ne_xr.values, ne_expected, rtol=1e-14, )
+
+        kappa = get_kappa(wavelength_xr, material='a-BBO', )
+        assert_allclose(kappa.values, get_kappa(wavelength, material='a-BBO', ), )
+
+    def test_cache_hits(self, ):
+        """
+        Test that the memoised refractive indices are reused by repeated captures and by the model evaluations of an
+        instrument fit
+        """
+        camera = Camera((20, 20, ), 6.5e-6 * 5, 12, 0.35, 0.46, 2.5, type='monochrome_polarised')
+        interferometer = [
+            LinearPolariser(orientation=0, ),
+            UniaxialCrystal(thickness=5e-3, cut_angle=40, orientation=45, ),
+            QuarterWaveplate(orientation=90, ),
+        ]
+        inst = Instrument(camera=camera, optics=[17e-3, 105e-3, 150e-3, ], interferometer=interferometer, )
+        wavelength_xr = xr.DataArray(wavelength[:5], dims=('wavelength', ), coords=(wavelength[:5], ), )
+        spectrum = xr.ones_like(wavelength_xr) * 1e4
+
+        _get_refractive_indices.cache_clear()
+        for _ in range(3):
+            inst.capture(spectrum, clean=True, )
+        cache_info = _get_refractive_indices.cache_info()
+        self.assertEqual(cache_info.misses, 1)
+        self.assertEqual(cache_info.hits, 2)
+
+        # one miss each for the model and its Jacobian
+        phase = inst.get_delay(wavelength_xr, camera.x, camera.y).transpose('wavelength', 'x', 'y')
+        inst.interferometer[1].thickness += 1e-7
+        inst.compile()
+        _get_refractive_indices.cache_clear()
+        _, results = fit_instrument(inst, phase, ['thickness_1', ], )
+        cache_info = _get_refractive_indices.cache_info()
+        self.assertGreater(results[0].nfev, 1)
+        self.assertEqual(cache_info.misses, 2)
+        self.assertEqual(cache_info.hits, results[0].nfev + results[0].njev - 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,14 @@
 import os
+import copy
+import pickle
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pycis
 from numpy.testing import assert_almost_equal
 import xarray as xr
-from pycis.model import Camera, LinearPolariser, QuarterWaveplate, UniaxialCrystal, Instrument, Waveplate
+from pycis.model import Camera, LinearPolariser, QuarterWaveplate, UniaxialCrystal, Instrument, Waveplate, SavartPlate
+from pycis.model.symbolic import KERNEL_CACHE_SIZE, _get_interferogram_kernel
 
 # define camera
 bit_depth = 12
@@ -282,6 +286,622 @@ class TestInstrument(unittest.TestCase):
             igram_fm = instrument_fm.capture(spectrum, clean=True, )
             assert_almost_equal(igram.values, igram_fm.values)
 
+    def test_symbolic_vs_mueller(self, ):
+        """
+        Test that interferograms calculated with kernels generated by pycis.model.symbolic are the same as for the full
+        Mueller matrix calculation, for configurations with no hand-coded formula and for polarised input light
+        """
+        interferometer = [
+            LinearPolariser(
+                orientation=10 + angle,
+            ),
+            UniaxialCrystal(
+                orientation=35 + angle,
+                thickness=8.e-3,
+                cut_angle=45,
+                contrast_inst=0.9,
+            ),
+            UniaxialCrystal(
+                orientation=80 + angle,
+                thickness=4.e-3,
+                cut_angle=30,
+                tilt_x=1,
+            ),
+            QuarterWaveplate(
+                orientation=20 + angle,
+            ),
+            LinearPolariser(
+                orientation=50 + angle,
+                tx_2=0.1,
+            ),
+        ]
+        stokes = xr.DataArray([1, 0.3, -0.2, 0.1], dims=('stokes', ), )
+
+        for camera_type in ['monochrome', 'monochrome_polarised']:
+            camera.type = camera_type
+            instrument = Instrument(camera=camera, optics=optics, interferometer=interferometer, force_mueller=False)
+            instrument_fm = Instrument(camera=camera, optics=optics, interferometer=interferometer, force_mueller=True)
+            self.assertEqual(instrument.type, 'symbolic')
+            self.assertEqual(instrument_fm.type, 'mueller')
+
+            for spectrum in spectra + [spectrum_test_roi * stokes, ]:
+                igram = instrument.capture(spectrum, clean=True, )
+                igram_fm = instrument_fm.capture(spectrum, clean=True, )
+                assert_almost_equal(igram.values, igram_fm.values)
+
+        # the delay, contrast and fringe frequency are only available for the hand-coded types
+        with self.assertRaises(AssertionError):
+            instrument.get_delay(460e-9, x, y)
+        with self.assertRaises(AssertionError):
+            instrument.get_contrast()
+        with self.assertRaises(AssertionError):
+            instrument.get_fringe_frequency(460e-9)
+
+        # an array-valued contrast cannot be symbolic, so falls back to the Mueller calculation
+        contrast_inst = np.array([0.8, 0.9, ])
+        spectrum = spectrum_test_roi.isel(x=slice(0, 10), y=slice(0, 10), )
+        interferometer_array = copy.deepcopy(interferometer)
+        interferometer_array[1].contrast_inst = xr.DataArray(contrast_inst, dims=('contrast_inst', ), )
+        instrument = Instrument(camera=camera, optics=optics, interferometer=interferometer_array, )
+        self.assertEqual(instrument.type, 'mueller')
+        igram = instrument.capture(spectrum, clean=True, )
+        for ii, value in enumerate(contrast_inst):
+            interferometer_array[1].contrast_inst = value
+            instrument = Instrument(camera=camera, optics=optics, interferometer=interferometer_array, )
+            self.assertEqual(instrument.type, 'symbolic')
+            igram_single = instrument.capture(spectrum, clean=True, )
+            assert_almost_equal(igram.isel(contrast_inst=ii).transpose(*igram_single.dims).values, igram_single.values)
+
+        # compiled kernels are held in a bounded cache
+        cache_info = _get_interferogram_kernel.cache_info()
+        self.assertEqual(cache_info.maxsize, KERNEL_CACHE_SIZE)
+        self.assertLessEqual(cache_info.currsize, KERNEL_CACHE_SIZE)
+
+        # hand-coded instrument type with polarised input light
+        camera.type = 'monochrome_polarised'
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            UniaxialCrystal(thickness=5e-3, cut_angle=0, orientation=45 + angle, ),
+            QuarterWaveplate(orientation=90 + angle, )
+        ]
+        instrument = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+        instrument_fm = Instrument(camera=camera, optics=optics, interferometer=interferometer, force_mueller=True, )
+        self.assertEqual(instrument.type, 'single_delay_pixelated')
+        igram = instrument.capture(spectrum_test_roi * stokes, clean=True, )
+        igram_fm = instrument_fm.capture(spectrum_test_roi * stokes, clean=True, )
+        assert_almost_equal(igram.values, igram_fm.values)
+
+    def test_wavelength_chunk(self, ):
+        """
+        Test that streaming the capture along the wavelength axis in chunks gives the same image as the one-shot
+        calculation
+        """
+        camera.type = 'monochrome_polarised'
+        interferometer = [
+            LinearPolariser(orientation=22.5 + angle, ),
+            UniaxialCrystal(orientation=0 + angle, thickness=8.e-3, cut_angle=45, ),
+            UniaxialCrystal(orientation=45 + angle, thickness=9.8e-3, cut_angle=45, ),
+            QuarterWaveplate(orientation=90 + angle, ),
+        ]
+        for force_mueller in [False, True]:
+            instrument = Instrument(camera=camera, optics=optics, interferometer=interferometer,
+                                    force_mueller=force_mueller)
+            for spectrum in spectra:
+                igram = instrument.capture(spectrum, clean=True, )
+                for wavelength_chunk in [2, 3, 7, ]:
+                    igram_chunked = instrument.capture(spectrum, clean=True, wavelength_chunk=wavelength_chunk, )
+                    assert_almost_equal(igram.values, igram_chunked.transpose(*igram.dims).values)
+
+    def test_tile_size(self, ):
+        """
+        Test that the tiled parallel capture gives the same image as the single-tile calculation
+        """
+        camera.type = 'monochrome_polarised'
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            UniaxialCrystal(thickness=5e-3, cut_angle=0, orientation=45 + angle, ),
+            QuarterWaveplate(orientation=90 + angle, ),
+        ]
+        for force_mueller in [False, True]:
+            instrument = Instrument(camera=camera, optics=optics, interferometer=interferometer,
+                                    force_mueller=force_mueller)
+            for spectrum in spectra + [spectrum_test.isel(x=0, y=0, drop=True), ]:
+                igram = instrument.capture(spectrum, clean=True, )
+                igram_tiled = instrument.capture(spectrum, clean=True, tile_size=(32, 18), max_workers=2,
+                                                 wavelength_chunk=8, )
+                assert_almost_equal(igram.values, igram_tiled.transpose(*igram.dims).values)
+
+        # process pool
+        spectrum = spectrum_test_roi
+        igram = instrument.capture(spectrum, clean=True, )
+        igram_tiled = instrument.capture(spectrum, clean=True, tile_size=(16, 16), max_workers=2, processes=True, )
+        assert_almost_equal(igram.values, igram_tiled.transpose(*igram.dims).values)
+
+    def test_spectral_response(self, ):
+        """
+        Test that capturing with a precomputed spectral response gives the same image as the full calculation
+        """
+        interferometer = [
+            LinearPolariser(orientation=22.5 + angle, ),
+            UniaxialCrystal(orientation=0 + angle, thickness=8.e-3, cut_angle=45, ),
+            UniaxialCrystal(orientation=45 + angle, thickness=9.8e-3, cut_angle=45, ),
+            QuarterWaveplate(orientation=90 + angle, ),
+        ]
+        stokes = xr.DataArray([1, 0.3, -0.2, 0.1], dims=('stokes', ), )
+        spectrum_uniform = spectrum_test.isel(x=0, y=0, drop=True)
+
+        for camera_type in ['monochrome', 'monochrome_polarised']:
+            camera.type = camera_type
+            for force_mueller in [False, True]:
+                instrument = Instrument(camera=camera, optics=optics, interferometer=interferometer,
+                                        force_mueller=force_mueller)
+                igrams = [instrument.capture(spectrum, clean=True, ) for spectrum in spectra + [spectrum_uniform, ]]
+                igram_stokes = instrument.capture(spectrum_test_roi * stokes, clean=True, )
+
+                instrument.set_spectral_response(wavelength, stokes=True, )
+                self.assertEqual(instrument.spectral_response.dims, ('x', 'y', 'wavelength', 'stokes', ))
+                for igram, spectrum in zip(igrams, spectra + [spectrum_uniform, ]):
+                    igram_response = instrument.capture(spectrum, clean=True, )
+                    assert_almost_equal(igram.values, igram_response.transpose(*igram.dims).values)
+                igram_response = instrument.capture(spectrum_test_roi * stokes, clean=True, )
+                assert_almost_equal(igram_stokes.values, igram_response.transpose(*igram_stokes.dims).values)
+
+    def test_coherence(self, ):
+        """
+        Test that the coherence-based calculation of the signal agrees with the full integral for a narrow line
+        """
+        wl0, sigma = 464.9e-9, 0.01e-9
+        wl = np.linspace(wl0 - 6 * sigma, wl0 + 6 * sigma, 121)
+        wl = xr.DataArray(wl, dims=('wavelength',), coords=(wl,), )
+        line = np.exp(-0.5 * ((wl - wl0) / sigma) ** 2)
+        line = 1e4 * line / line.integrate(coord='wavelength')
+        cube = line * (1 + 0.5 * x / x.max()) * (1 - 0.3 * y / y.max())
+
+        interferometers = {
+            'monochrome': [
+                LinearPolariser(orientation=45 + angle, ),
+                UniaxialCrystal(orientation=0 + angle, thickness=8.e-3, cut_angle=45, ),
+                UniaxialCrystal(orientation=45 + angle, thickness=9.8e-3, cut_angle=45, ),
+                LinearPolariser(orientation=0 + angle, ),
+            ],
+            'monochrome_polarised': [
+                LinearPolariser(orientation=22.5 + angle, ),
+                UniaxialCrystal(orientation=0 + angle, thickness=8.e-3, cut_angle=45, ),
+                UniaxialCrystal(orientation=45 + angle, thickness=9.8e-3, cut_angle=45, ),
+                QuarterWaveplate(orientation=90 + angle, ),
+            ],
+        }
+        for camera_type, interferometer in interferometers.items():
+            camera.type = camera_type
+            instrument = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+            time = xr.DataArray(np.arange(2), dims=('time', ), coords=(np.arange(2), ), )
+            for spectrum in [line, cube, cube.sel(roi), cube.sel(roi) * (1 + time), ]:
+                signal = instrument.get_signal(spectrum, )
+                signal_coherence = instrument.get_signal(spectrum, coherence=True, )
+                self.assertEqual(signal_coherence.dims[:2], ('x', 'y', ))
+                signal_coherence = signal_coherence.transpose(*signal.dims)
+                error = abs(signal - signal_coherence).max() / signal.mean()
+                self.assertLess(float(error), 1e-5)
+
+            instrument_fm = Instrument(camera=camera, optics=optics, interferometer=interferometer, force_mueller=True)
+            with self.assertRaises(NotImplementedError):
+                instrument_fm.get_signal(line, coherence=True, )
+
+    def test_capture_batch(self, ):
+        """
+        Test that batched capture of a time series gives the same images as capturing frame by frame
+        """
+        camera.type = 'monochrome_polarised'
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            UniaxialCrystal(thickness=5e-3, cut_angle=0, orientation=45 + angle, ),
+            QuarterWaveplate(orientation=90 + angle, ),
+        ]
+        instrument = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+        time = xr.DataArray(np.arange(5), dims=('time', ), coords=(np.arange(5), ), )
+        for spectrum in spectra:
+            spectrum = spectrum * (1 + 0.1 * time)
+            igrams = [instrument.capture(spectrum.sel(time=t), clean=True, ) for t in time.values]
+            for block_size in [1, 2, ]:
+                blocks = list(instrument.capture_batch(spectrum, block_size=block_size, clean=True, ))
+                self.assertEqual(len(blocks), int(np.ceil(time.size / block_size)))
+                igrams_batch = xr.concat(blocks, dim='time')
+                for t, igram in zip(time.values, igrams):
+                    assert_almost_equal(igram.values, igrams_batch.sel(time=t).transpose(*igram.dims).values)
+
+    def test_geometry_cache(self, ):
+        """
+        Test that cached ray-geometry maps match the direct calculation, are read-only and are recalculated when a
+        component's tilt or orientation changes
+        """
+        camera.type = 'monochrome'
+        crystal = UniaxialCrystal(thickness=5e-3, cut_angle=45, orientation=45 + angle, tilt_x=2, tilt_y=-1, )
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            crystal,
+            LinearPolariser(orientation=0 + angle, ),
+        ]
+        inst = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+
+        for _ in range(2):
+            inc_angle, azim_angle = inst.get_geometry(crystal)
+            assert_almost_equal(inc_angle.values, inst._calc_inc_angle(x, y, crystal).values)
+            assert_almost_equal(azim_angle.values, inst._calc_azim_angle(x, y, crystal).values)
+            self.assertFalse(inc_angle.values.flags.writeable)
+            self.assertFalse(azim_angle.values.flags.writeable)
+        self.assertIs(inst.get_geometry(crystal)[0], inst.get_inc_angle(x, y, crystal))
+
+        # subset of the sensor
+        x_roi, y_roi = x.sel(x=roi['x']), y.sel(y=roi['y'])
+        assert_almost_equal(inst.get_inc_angle(x_roi, y_roi, crystal).values,
+                            inst._calc_inc_angle(x_roi, y_roi, crystal).values)
+
+        crystal_plan = inst.plan.retarders[0]
+        inc_angle_plan = inst.get_geometry(crystal_plan)[0]
+        crystal.tilt_x = -3
+        crystal.orientation = 10
+        inc_angle, azim_angle = inst.get_geometry(crystal)
+        assert_almost_equal(inc_angle.values, inst._calc_inc_angle(x, y, crystal).values)
+        assert_almost_equal(azim_angle.values, inst._calc_azim_angle(x, y, crystal).values)
+
+        # the maps for the compiled plan's components, used until recompiling, are not evicted
+        self.assertIs(inst.get_geometry(crystal_plan)[0], inc_angle_plan)
+        inst.get_geometry(interferometer[0])
+        self.assertIs(inst.get_geometry(crystal_plan)[0], inc_angle_plan)
+
+        # the caches are shared safely between threads, and survive copying and pickling
+        crystals = [UniaxialCrystal(thickness=5e-3, cut_angle=45, orientation=o, tilt_x=o / 10, ) for o in range(16)]
+        wavelengths = [wavelength[:n] for n in range(2, 18)]
+        inst = pickle.loads(pickle.dumps(copy.deepcopy(inst)))
+
+        def get(idx):
+            weights = inst.camera.get_quadrature_weights(wavelengths[idx])
+            return inst.get_geometry(crystals[idx])[1], weights
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(get, list(range(16)) * 4))
+        for idx, (azim_angle, weights) in zip(list(range(16)) * 4, results):
+            assert_almost_equal(azim_angle.values, inst._calc_azim_angle(x, y, crystals[idx]).values)
+            assert_almost_equal(weights.sum(), float(wavelengths[idx][-1] - wavelengths[idx][0]))
+
+    def test_mueller_plan(self, ):
+        """
+        Test that runs of constant components are folded into single 4x4 matrices without changing the total Mueller
+        matrix
+        """
+        camera.type = 'monochrome'
+        crystal = UniaxialCrystal(thickness=5e-3, cut_angle=45, orientation=45 + angle, )
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            QuarterWaveplate(orientation=22.5 + angle, ),
+            crystal,
+            QuarterWaveplate(orientation=90 + angle, ),
+            LinearPolariser(orientation=0 + angle, ),
+        ]
+        inst = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+        plan = inst.get_mueller_plan()
+        self.assertEqual(len(plan), 3)
+        self.assertEqual(plan[1], crystal)
+        self.assertEqual(plan[0].dims, pycis.MUELLER_DIMS)
+
+        x_roi, y_roi = x.sel(x=roi['x']), y.sel(y=roi['y'])
+        mat_expected = xr.DataArray(np.identity(4), dims=pycis.MUELLER_DIMS, )
+        for component in interferometer:
+            inc_angle = inst.get_inc_angle(x_roi, y_roi, component)
+            azim_angle = inst.get_azim_angle(x_roi, y_roi, component)
+            mat_expected = pycis.mueller_product(component.get_mueller_matrix(wavelength, inc_angle, azim_angle),
+                                                 mat_expected)
+        mat = inst.get_mueller_matrix(wavelength, x_roi, y_roi)
+        assert_almost_equal(mat.transpose(*mat_expected.dims).values, mat_expected.values)
+
+    def test_compile(self, ):
+        """
+        Test that the compiled plan is frozen until the instrument is recompiled, and that its content hash identifies
+        the instrument configuration
+        """
+        camera.type = 'monochrome'
+        crystal = UniaxialCrystal(thickness=5e-3, cut_angle=45, orientation=45 + angle, )
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            crystal,
+            LinearPolariser(orientation=0 + angle, ),
+        ]
+        inst = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+        inst_2 = Instrument(camera=camera, optics=optics, interferometer=copy.deepcopy(interferometer), )
+        plan = inst.plan
+        self.assertEqual(plan.type, 'single_delay_linear')
+        self.assertEqual(plan, inst_2.plan)
+        self.assertEqual(hash(plan), hash(inst_2.plan))
+        self.assertEqual(plan, pickle.loads(pickle.dumps(plan)))
+        image = inst.capture(spectrum_test_roi, clean=True, )
+
+        delay = inst.get_delay(460e-9, x, y)
+        inst.set_spectral_response(wavelength)
+
+        # the plan is unaffected by changes to the components until recompiled
+        crystal.orientation = 30 + angle
+        crystal.thickness = 6e-3
+        assert_almost_equal(inst.capture(spectrum_test_roi, clean=True, ).values, image.values)
+        assert_almost_equal(inst.get_delay(460e-9, x, y).values, delay.values)
+        crystal.thickness = 5e-3
+        inst.compile()
+        self.assertIsNone(inst.spectral_response)
+        self.assertEqual(inst.compile().type, 'symbolic')
+        self.assertNotEqual(inst.plan, plan)
+        self.assertNotEqual(inst.plan.key, plan.key)
+        self.assertEqual(inst.type, 'symbolic')
+
+        crystal.orientation = 45 + angle
+        self.assertEqual(inst.compile(), plan)
+
+    def test_precision(self, ):
+        """
+        Test that single-precision captures match double precision to within the documented error bounds, for the
+        hand-coded, symbolic and Mueller calculations
+        """
+        camera.type = 'monochrome_polarised'
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            UniaxialCrystal(thickness=8e-3, cut_angle=45, orientation=45 + angle, ),
+            QuarterWaveplate(orientation=90 + angle, ),
+        ]
+        interferometer_symbolic = [
+            LinearPolariser(orientation=0 + angle, ),
+            UniaxialCrystal(thickness=8e-3, cut_angle=45, orientation=30 + angle, ),
+        ]
+        insts = [
+            Instrument(camera=camera, optics=optics, interferometer=interferometer, ),
+            Instrument(camera=camera, optics=optics, interferometer=interferometer_symbolic, ),
+            Instrument(camera=camera, optics=optics, interferometer=interferometer, force_mueller=True, ),
+        ]
+        self.assertEqual([inst.type for inst in insts], ['single_delay_pixelated', 'symbolic', 'mueller', ])
+
+        for inst in insts:
+            signal = inst.get_signal(spectrum_test_roi)
+            signal_single = inst.get_signal(spectrum_test_roi.astype(np.float32))
+            self.assertEqual(signal_single.dtype, np.float32)
+            self.assertLess(float(abs(signal_single - signal).max() / signal.mean()), 1e-5)
+
+            image = inst.capture(spectrum_test_roi, clean=True, )
+            image_single = inst.capture(spectrum_test_roi, clean=True, precision='single', )
+            self.assertLessEqual(int(abs(image_single.astype(int) - image.astype(int)).max()), 1)
+
+    def test_capture_points(self, ):
+        """
+        Test that capturing at sample points matches the full capture at pixel centres, and that the hand-coded and
+        Mueller calculations agree at arbitrary positions
+        """
+        camera.type = 'monochrome_polarised'
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            UniaxialCrystal(thickness=5e-3, cut_angle=45, orientation=45 + angle, ),
+            QuarterWaveplate(orientation=90 + angle, ),
+        ]
+        interferometer_symbolic = [
+            LinearPolariser(orientation=0 + angle, ),
+            UniaxialCrystal(thickness=5e-3, cut_angle=45, orientation=30 + angle, ),
+        ]
+        insts = [
+            Instrument(camera=camera, optics=optics, interferometer=interferometer, ),
+            Instrument(camera=camera, optics=optics, interferometer=interferometer_symbolic, ),
+            Instrument(camera=camera, optics=optics, interferometer=interferometer, force_mueller=True, ),
+        ]
+        spectrum = spectrum_test.isel(x=0, y=0, drop=True)
+        idx_x, idx_y = np.random.randint(0, sensor_format[0], 40), np.random.randint(0, sensor_format[1], 40)
+        x_point, y_point = x.values[idx_x], y.values[idx_y]
+
+        for inst in insts:
+            image = inst.capture(spectrum, clean=True, )
+            image_points = inst.capture_points(spectrum, x_point, y_point, clean=True, )
+            self.assertEqual(image_points.dims, ('point', ))
+            assert_almost_equal(image_points.x.values, x_point)
+            assert_almost_equal(image_points.values, image.values[idx_x, idx_y])
+
+        x_point = x_point + pixel_size * (np.random.rand(40) - 0.5) * 0.9
+        y_point = y_point + pixel_size * (np.random.rand(40) - 0.5) * 0.9
+        signal = [inst.capture_points(spectrum, x_point, y_point, clean=True, ).values for inst in insts[::2]]
+        assert_almost_equal(*signal)
+
+    def test_grid_alignment(self, ):
+        """
+        Test that a spectrum whose pixel positions differ from the camera's only by float rounding is captured as if
+        they were exact, and that positions off the pixel centres are rejected
+        """
+        camera.type = 'monochrome_polarised'
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            UniaxialCrystal(thickness=5e-3, cut_angle=45, orientation=45 + angle, ),
+            QuarterWaveplate(orientation=90 + angle, ),
+        ]
+        for force_mueller in [False, True, ]:
+            inst = Instrument(camera=camera, optics=optics, interferometer=interferometer, force_mueller=force_mueller)
+            image = inst.capture(spectrum_test_roi, clean=True, )
+            spectrum = spectrum_test_roi.assign_coords(x=spectrum_test_roi.x.values * (1 + 1e-12), )
+            image_rounded = inst.capture(spectrum, clean=True, )
+            assert_almost_equal(image_rounded.values, image.values)
+            assert_almost_equal(image_rounded.x.values, image.x.values)
+
+            spectrum = spectrum_test_roi.assign_coords(x=spectrum_test_roi.x.values + pixel_size / 3, )
+            with self.assertRaises(ValueError):
+                inst.capture(spectrum, clean=True, )
+
+    def test_design_sweep(self, ):
+        """
+        Test that array-valued component parameters give the same images as a loop over the individual designs, for
+        both the hand-coded and the Mueller calculations
+        """
+        camera.type = 'monochrome_polarised'
+        thickness = np.array([4e-3, 5e-3, 6e-3, ])
+        cut_angle = xr.DataArray([30, 45, ], dims=('cut_angle', ), )
+        tilt_x = np.array([0, 1.5, ])
+        orientation = xr.DataArray([0, 10, ], dims=('orientation', ), )
+        spectrum = spectrum_test_roi.isel(x=slice(0, 10), y=slice(0, 10), )
+
+        def get_interferometer(thickness, cut_angle, tilt_x, orientation):
+            return [
+                LinearPolariser(orientation=orientation + angle, ),
+                UniaxialCrystal(thickness=thickness, cut_angle=cut_angle, tilt_x=tilt_x,
+                                orientation=45 + orientation + angle, ),
+                QuarterWaveplate(orientation=90 + orientation + angle, ),
+            ]
+
+        for force_mueller in [False, True, ]:
+            interferometer = get_interferometer(thickness, cut_angle, tilt_x, orientation)
+            inst = Instrument(camera=camera, optics=optics, interferometer=interferometer, force_mueller=force_mueller)
+            self.assertEqual(inst.type, 'mueller' if force_mueller else 'single_delay_pixelated')
+            image = inst.capture(spectrum, clean=True, )
+            self.assertEqual(set(image.dims), {'x', 'y', 'thickness', 'cut_angle', 'tilt_x', 'orientation', })
+
+            for idx in np.ndindex(len(thickness), cut_angle.size, len(tilt_x), orientation.size):
+                params = [thickness[idx[0]], float(cut_angle[idx[1]]), tilt_x[idx[2]], float(orientation[idx[3]]), ]
+                inst_single = Instrument(camera=camera, optics=optics, interferometer=get_interferometer(*params),
+                                         force_mueller=force_mueller, )
+                image_single = inst_single.capture(spectrum, clean=True, )
+                sel = dict(zip(['thickness', 'cut_angle', 'tilt_x', 'orientation', ], idx))
+                assert_almost_equal(image.isel(sel).transpose('x', 'y').values, image_single.values)
+
+        # the symbolic kernel takes the delays as arguments, so sweeps of the delay parameters stay symbolic
+        interferometer = get_interferometer(thickness, cut_angle, tilt_x, 0)
+        interferometer[1].orientation = 35 + angle
+        interferometer[1].contrast_inst = 0.9
+        inst = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+        inst_fm = Instrument(camera=camera, optics=optics, interferometer=interferometer, force_mueller=True)
+        self.assertEqual(inst.type, 'symbolic')
+        image = inst.capture(spectrum, clean=True, )
+        self.assertEqual(set(image.dims), {'x', 'y', 'thickness', 'cut_angle', 'tilt_x', })
+        assert_almost_equal(image.values, inst_fm.capture(spectrum, clean=True, ).transpose(*image.dims).values)
+
+        # orientations that vary relative to one another are not a hand-coded type
+        interferometer = get_interferometer(5e-3, 45, 0, 0)
+        interferometer[1].orientation = interferometer[1].orientation + orientation
+        inst = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+        self.assertEqual(inst.type, 'mueller')
+        self.assertEqual(inst.capture(spectrum, clean=True, ).sizes['orientation'], orientation.size)
+
+    def check_jacobian(self, inst, jacobian, get_output, tol=1e-5):
+        """
+        Check analytic derivatives against central finite differences
+
+        :param inst: the instrument.
+        :param jacobian: dict of derivatives (each an array or a tuple of arrays, matching the output) keyed by parameter
+            label, as in Instrument.get_jacobian(), or the xr.DataArray returned by Instrument.get_jacobian().
+        :param get_output: get_output(inst_fd, param, step) returns the output for inst_fd, a copy of inst with the
+            parameter param perturbed by step. The parameter 'wavelength' is not perturbed on the instrument, so must be
+            perturbed by get_output.
+        :param float tol: tolerance on the maximum error, relative to the maximum derivative.
+        """
+        if isinstance(jacobian, xr.DataArray):
+            jacobian = {param: jacobian.sel(parameter=param) for param in jacobian.parameter.values}
+
+        for param, deriv in jacobian.items():
+            h = 1e-9 if 'thickness' in param else 1e-13 if param == 'wavelength' else 1e-5
+            outputs = []
+            for sign in [1, -1, ]:
+                inst_fd = copy.deepcopy(inst)
+                if param == 'orientation':
+                    for component in inst_fd.interferometer:
+                        component.orientation += sign * h
+                elif param != 'wavelength':
+                    name, idx = param.rsplit('_', 1)
+                    component = inst_fd.interferometer[int(idx)]
+                    setattr(component, name, getattr(component, name) + sign * h)
+                inst_fd.compile()
+                outputs.append(get_output(inst_fd, param, sign * h))
+
+            if not isinstance(deriv, tuple):
+                deriv, outputs = (deriv, ), [(output, ) for output in outputs]
+            for d, output_p1, output_m1 in zip(deriv, *outputs):
+                deriv_fd = (output_p1 - output_m1) / (2 * h)
+                scale = np.abs(deriv_fd).max()
+                if scale == 0:
+                    self.assertFalse(np.any(d), param)
+                    continue
+                error = np.abs(xr.DataArray(d) - deriv_fd).max() / scale
+                self.assertLess(float(error), tol, param)
+
+    def test_jacobian(self, ):
+        """
+        Test the analytic derivatives of the signal with respect to the instrument parameters against central finite
+        differences of the forward model
+        """
+        camera.type = 'monochrome_polarised'
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            UniaxialCrystal(thickness=5e-3, cut_angle=45, orientation=-22.5 + angle, tilt_x=0.3, ),
+            UniaxialCrystal(thickness=8e-3, cut_angle=30, orientation=22.5 + angle, tilt_y=1, ),
+            QuarterWaveplate(orientation=67.5 + angle, ),
+        ]
+        inst = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+        self.assertEqual(inst.type, 'triple_delay_pixelated')
+        spectrum = spectrum_test_roi.isel(x=slice(0, 10), y=slice(0, 10), )
+        signal, jacobian = inst.get_jacobian(spectrum)
+        assert_almost_equal(signal.values, inst.get_signal(spectrum).values)
+        self.assertEqual(set(jacobian.parameter.values), {'orientation', 'thickness_1', 'cut_angle_1', 'tilt_x_1',
+                                                          'tilt_y_1', 'thickness_2', 'cut_angle_2', 'tilt_x_2',
+                                                          'tilt_y_2', })
+        self.check_jacobian(inst, jacobian, lambda inst_fd, param, step: inst_fd.get_signal(spectrum), )
+
+    def test_delay_contrast_jacobian(self, ):
+        """
+        Test the analytic derivatives of the interferometer delays and instrument contrasts against central finite
+        differences
+        """
+        camera.type = 'monochrome_polarised'
+        interferometer = [
+            LinearPolariser(orientation=0 + angle, ),
+            UniaxialCrystal(thickness=5e-3, cut_angle=45, orientation=-22.5 + angle, tilt_x=0.3, contrast_inst=0.9, ),
+            UniaxialCrystal(thickness=8e-3, cut_angle=30, orientation=22.5 + angle, contrast_inst=0.8, ),
+            QuarterWaveplate(orientation=67.5 + angle, ),
+        ]
+        inst = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+        x_roi, y_roi = x[::10], y[::10]
+        delay, jacobian = inst.get_delay(460e-9, x_roi, y_roi, jacobian=True)
+        contrast, jacobian_contrast = inst.get_contrast(jacobian=True)
+        self.assertEqual(len(delay), 3)
+        self.assertIn('wavelength', jacobian)
+        self.assertEqual(set(jacobian_contrast), {'contrast_inst_1', 'contrast_inst_2', })
+        jacobian.update(jacobian_contrast)
+
+        def get_output(inst_fd, param, step):
+            if 'contrast' in param:
+                return inst_fd.get_contrast()
+            return inst_fd.get_delay(460e-9 + (step if param == 'wavelength' else 0), x_roi, y_roi)
+
+        self.check_jacobian(inst, jacobian, get_output, tol=5e-5, )
+
+    def test_jacobian_savart(self, ):
+        """
+        Test the analytic derivatives for a Savart plate instrument, including at the centre of the ray geometry, where
+        the incidence and azimuthal angles are singular
+        """
+        camera.type = 'monochrome'
+        coords = {'x': ('point', [-3e-4, 0, 2e-4, 0, ], ), 'y': ('point', [0, 1e-4, 2e-4, 0, ], ), }
+        x_test = xr.DataArray(coords['x'][1], dims=('point', ), coords=coords, )
+        y_test = xr.DataArray(coords['y'][1], dims=('point', ), coords=coords, )
+        spectrum = xr.ones_like(wavelength) * 1e3
+        for mode in ['francon', 'veiras', ]:
+            interferometer = [
+                LinearPolariser(orientation=0 + angle, ),
+                SavartPlate(thickness=4e-3, orientation=45 + angle, mode=mode, ),
+                LinearPolariser(orientation=0 + angle, ),
+            ]
+            inst = Instrument(camera=camera, optics=optics, interferometer=interferometer, )
+            self.assertEqual(inst.type, 'single_delay_linear')
+            signal, jacobian = inst.get_jacobian(spectrum, x_test, y_test)
+            self.assertFalse(np.any(np.isnan(jacobian.values)))
+
+            def get_output(inst_fd, param, step):
+                return inst_fd.get_signal(spectrum, x_test, y_test)
+
+            self.check_jacobian(inst, jacobian, get_output, )
+
+            _, jacobian_delay = inst.get_delay(460e-9, x_test, y_test, jacobian=True)
+
+            def get_output(inst_fd, param, step):
+                return inst_fd.get_delay(460e-9 + step, x_test, y_test)
+
+            self.check_jacobian(inst, {'wavelength': jacobian_delay['wavelength'], }, get_output, )
+
     def test_read_config_write_config(self, ):
         inst_1 = pycis.Instrument('single_delay_pixelated.yaml')
         testpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test.yaml')
@@ -290,6 +910,13 @@ class TestInstrument(unittest.TestCase):
         os.remove(testpath)
         assert inst_1 == inst_2
 
+        # array-valued parameters cannot be written to a config file
+        inst_1.interferometer[1].thickness = xr.DataArray([5e-3, 6.5e-3, ], dims=('thickness', ), )
+        self.assertNotEqual(inst_1, inst_2)
+        with self.assertRaises(ValueError):
+            inst_1.write_config(testpath)
+        self.assertFalse(os.path.exists(testpath))
+
     # import matplotlib.pyplot as plt
     # plt.figure()
     # igram.plot(x='x', y='y')
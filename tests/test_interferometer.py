@@ -2,7 +2,9 @@ import unittest
 import numpy as np
 from numpy.testing import assert_almost_equal
 import xarray as xr
-from pycis import mueller_product, UniaxialCrystal, Waveplate
+from pycis import mueller_product, rotation_matrix, UniaxialCrystal, Waveplate, SavartPlate, LinearPolariser, \
+    get_refractive_indices
+from pycis.model.interferometer import _calc_delay_uniaxial_crystal, _calc_delay_uniaxial_crystal_compiled
 
 
 class TestMueller(unittest.TestCase):
@@ -19,6 +21,55 @@ class TestMueller(unittest.TestCase):
         assert_almost_equal(mm_1.values, mueller_product(mm_2, mm_1).values, )
         assert_almost_equal(sv_1.values, mueller_product(mm_2, sv_1).data, )
 
+    def test_mueller_product_broadcast(self, ):
+        """
+        Test Mueller matrix multiplication of stacks with differing dimensions against an explicit loop.
+        """
+        mdims = ('mueller_v', 'mueller_h')
+        mm_1 = xr.DataArray(np.random.rand(3, 4, 4, ), dims=('x', ) + mdims, )
+        mm_2 = xr.DataArray(np.random.rand(5, 4, 4, ), dims=('wavelength', ) + mdims, )
+        sv = xr.DataArray(np.random.rand(5, 4, ), dims=('wavelength', 'stokes', ), )
+
+        mm_12 = mueller_product(mm_1, mm_2).transpose('x', 'wavelength', *mdims)
+        sv_out = mueller_product(mm_1, sv).transpose('x', 'wavelength', 'stokes')
+        for ii in range(3):
+            for jj in range(5):
+                assert_almost_equal(mm_12.values[ii, jj], mm_1.values[ii] @ mm_2.values[jj])
+                assert_almost_equal(sv_out.values[ii, jj], mm_1.values[ii] @ sv.values[jj])
+
+    def test_retarder_mueller_matrix(self, ):
+        """
+        Test the closed-form rotated retarder Mueller matrix against R(-rho) @ M @ R(rho)
+        """
+        orientation = np.random.rand() * 360
+        contrast_inst = np.random.rand()
+        crystal = UniaxialCrystal(thickness=5e-3, cut_angle=45, orientation=orientation, contrast_inst=contrast_inst, )
+        wavelength = xr.DataArray(np.linspace(460e-9, 470e-9, 5), dims=('wavelength', ), )
+        inc_angle = xr.DataArray(np.random.uniform(0, 0.2, 6), dims=('x', ), )
+        azim_angle = xr.DataArray(np.random.uniform(0, 2 * np.pi, 6), dims=('x', ), )
+
+        mat = crystal.get_mueller_matrix(wavelength, inc_angle, azim_angle)
+        delay = crystal.get_delay(wavelength, inc_angle, azim_angle).transpose(*mat.dims[:-2])
+        for idx in np.ndindex(delay.shape):
+            d = float(delay.values[idx])
+            m = np.array([[1, 0, 0, 0],
+                          [0, 1, 0, 0],
+                          [0, 0, contrast_inst * np.cos(d), contrast_inst * np.sin(d)],
+                          [0, 0, -contrast_inst * np.sin(d), contrast_inst * np.cos(d)]])
+            m = rotation_matrix(-orientation).values @ m @ rotation_matrix(orientation).values
+            assert_almost_equal(mat.values[idx], m)
+
+        sv = xr.DataArray(np.random.rand(5, 4), dims=('wavelength', 'stokes', ), )
+        sv_out = crystal.apply_mueller_matrix(sv, wavelength, inc_angle, azim_angle)
+        sv_out_mat = mueller_product(mat, sv)
+        assert_almost_equal(sv_out.values, sv_out_mat.transpose(*sv_out.dims).values)
+
+        # polariser transmission axis
+        pol = LinearPolariser(orientation=orientation).get_mueller_matrix()
+        sv = xr.DataArray([1, np.cos(2 * np.radians(orientation)), np.sin(2 * np.radians(orientation)), 0],
+                          dims=('stokes', ))
+        assert_almost_equal(mueller_product(pol, sv).values, sv.values)
+
     def test_waveplate(self, ):
         """
         test waveplate as a special case of a uniaxial crystal
@@ -44,5 +95,67 @@ class TestMueller(unittest.TestCase):
         assert_almost_equal(uni_crystal.get_delay(**kwargs), waveplate.get_delay(**kwargs))
 
 
+    def test_delay_uniaxial_crystal_compiled(self, ):
+        """
+        test the compiled uniaxial crystal delay kernel against the NumPy evaluation of the same formula
+        """
+        wavelength = np.linspace(460e-9, 470e-9, 7)
+        wavelength = xr.DataArray(wavelength, dims=('wavelength', ), coords=(wavelength, ), )
+        inc_angle = xr.DataArray(np.random.uniform(0, 0.2, (11, 13)), dims=('x', 'y', ), )
+        azim_angle = xr.DataArray(np.random.uniform(0, 2 * np.pi, (13, )), dims=('y', ), )
+        cut_angle = np.random.uniform(0, np.pi / 2)
+        thickness = np.random.rand() * 1e-2
+
+        for wl in [wavelength, 465e-9, ]:
+            ne, no = get_refractive_indices(wl, 'a-BBO')
+            args = [wl, inc_angle, azim_angle, ne, no, cut_angle, thickness, ]
+            delay = _calc_delay_uniaxial_crystal(*args)
+            delay_compiled = _calc_delay_uniaxial_crystal_compiled(*args)
+            assert_almost_equal(delay_compiled.values, delay.transpose(*delay_compiled.dims).values)
+
+        # unsupported argument types fall back to NumPy
+        self.assertIsNone(_calc_delay_uniaxial_crystal_compiled(465e-9, 0.1, 0.2, 1.6, 1.7, 0.3, 1e-3))
+
+    def test_delay_jacobian(self, ):
+        """
+        test the analytic partial derivatives of the retarder delay against central finite differences
+        """
+        kwargs = {'wavelength': 465e-9, 'inc_angle': 0.05, 'azim_angle': 0.7, }
+        steps = {'wavelength': 1e-13, 'inc_angle': 1e-5, 'azim_angle': 1e-5, 'thickness': 1e-9, 'cut_angle': 1e-5, }
+        retarders = [UniaxialCrystal(thickness=5e-3, cut_angle=30, ), Waveplate(thickness=3e-3, ),
+                     SavartPlate(thickness=4e-3, orientation=10, ), SavartPlate(thickness=4e-3, mode='veiras', ), ]
+        for retarder in retarders:
+            delay, jacobian = retarder.get_delay(**kwargs, jacobian=True)
+            assert_almost_equal(delay, retarder.get_delay(**kwargs))
+
+            for name, deriv in jacobian.items():
+                h = steps[name]
+                delays = []
+                for sign in [1, -1, ]:
+                    if name in kwargs:
+                        delays.append(retarder.get_delay(**dict(kwargs, **{name: kwargs[name] + sign * h})))
+                    else:
+                        value = getattr(retarder, name)
+                        setattr(retarder, name, value + sign * h)
+                        delays.append(retarder.get_delay(**kwargs))
+                        setattr(retarder, name, value)
+                deriv_fd = (delays[0] - delays[1]) / (2 * h)
+                self.assertLess(abs(deriv / deriv_fd - 1), 1e-5)
+
+    def test_component_eq(self, ):
+        """
+        test component comparison, including array-valued parameters
+        """
+        thickness = xr.DataArray([4e-3, 5e-3, ], dims=('thickness', ), )
+        self.assertEqual(UniaxialCrystal(thickness=5e-3, cut_angle=30, ), UniaxialCrystal(thickness=5e-3, cut_angle=30, ))
+        self.assertNotEqual(UniaxialCrystal(thickness=5e-3, cut_angle=30, ), UniaxialCrystal(thickness=5e-3, cut_angle=45, ))
+        self.assertNotEqual(UniaxialCrystal(thickness=5e-3, cut_angle=0, ), Waveplate(thickness=5e-3, ))
+        self.assertEqual(Waveplate(thickness=thickness, ), Waveplate(thickness=thickness.copy(), ))
+        self.assertEqual(Waveplate(thickness=[4e-3, 5e-3, ], ), Waveplate(thickness=[4e-3, 5e-3, ], ))
+        self.assertNotEqual(Waveplate(thickness=thickness, ), Waveplate(thickness=thickness + 1e-3, ))
+        self.assertNotEqual(Waveplate(thickness=thickness, ), Waveplate(thickness=5e-3, ))
+        self.assertNotEqual(Waveplate(thickness=thickness, ), Waveplate(thickness=thickness.rename(thickness='t'), ))
+
+
 if __name__ == '__main__':
     unittest.main()